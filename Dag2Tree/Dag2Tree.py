@@ -11,151 +11,945 @@ Stipulations:   All edges must have a "type" field.  Either "child" or "follow-o
 
 import networkx as nx
 import matplotlib.pyplot as plt
-from itertools import chain, izip
+from collections import deque, namedtuple
+import hashlib
+import itertools
+import multiprocessing
+import os
+import Queue
 import random
+import time
+import traceback
 
-def cwl_to_dag(tool, job, wf=None):
+import cwl
+from ancestry import AncestryIndex
+from compact import CompactDAG, convert_compact
+
+def cwl_to_dag(tool, job, wf=None, cache_dir=None):
+    '''
+    Converts CWL to a networkx DAG, one node per step or scatter job; see cwl.py
+
+    :param tool: Path of the CWL workflow, or of a single CommandLineTool
+    :param job: Path of the job order, or the job order as a dict
+    :param wf: Id of the workflow to run from a packed document
+    :param cache_dir: Optional directory where parsed workflows are kept, keyed by document hash
+    '''
+    return cwl.to_dag(cwl.load_workflow(tool, wf, cache_dir), cwl.load_job(job))
+
+
+def cwl_to_tree(tool, job, wf=None, cache_dir=None, placement='mrca'):
     '''
-    Converts CWL to a networkx DAG
+    cwl_to_dag followed by convert.  With a cache_dir, the tree is kept too, keyed by the workflow and the shape of the
+    job order, so submitting the same template for many samples parses and converts it once and only binds each job.
     '''
-    pass
+    workflow = cwl.load_workflow(tool, wf, cache_dir)
+    job = cwl.load_job(job)
+    if cache_dir is None:
+        return convert(cwl.to_dag(workflow, job), placement=placement)
+
+    key = hashlib.sha1(repr((workflow.key, placement, cwl.shape(workflow, job)))).hexdigest()
+    path = os.path.join(cache_dir, 'trees', key)
+    T = cwl.load_cached(path)
+    if T is not None:
+        return cwl.bind(T, workflow, job)
+    T = convert(cwl.to_dag(workflow, job), placement=placement)
+    cwl.save_cached(path, T)
+    return T
+
 
+# Nodes below which a DAG is converted in one process whatever processes asks for: up to here, starting the workers,
+# shipping the regions and stitching their trees back together costs more than converting them concurrently saves
+PARALLEL_MIN_NODES = 2000
 
-def convert(G):
+
+def convert(G, placement='mrca', cost='runtime', timings=None, processes=1):
     """
     Converts networkx DAG to jobTree Tree
+
+    :param placement: 'mrca' always breaks a node with several parents at the MRCA of its parents.
+                      'critical-path' attaches the node under its last parent instead when every other parent already
+                      finishes before that one, if it gives the shorter critical path.
+    :param cost: Node attribute holding an estimated runtime. Nodes without it cost 1, pseudonodes and S cost 0.
+    :param timings: Optional dict, filled with the seconds spent in each phase: 'sources', 'resolve' and 'collapse',
+                    plus 'import' and 'export' to and from the compact core, and 'makespan' for the reports.
+                    Parallel conversion fills 'regions', 'parallel' and 'stitch' instead.
+    :param processes: Processes to convert with, all cores if None, and never more than the cores.  With more than
+                      one, a DAG of PARALLEL_MIN_NODES nodes or more that splits into independent regions (see
+                      shared_regions) has them converted concurrently.
+    Stores the DAG's ideal makespan and the resulting tree's makespan in G.graph['dag_makespan'] and
+    G.graph['tree_makespan'].
     """
-    assert nx.is_directed_acyclic_graph(G), 'Graph provided is not a "networkx" DAG.'
+    assert placement in ('mrca', 'critical-path'), 'Unknown placement: {}'.format(placement)
+    timings = {} if timings is None else timings
+
+    # More processes than cores only take turns on them, and pay for it in contention
+    processes = min(processes or multiprocessing.cpu_count(), multiprocessing.cpu_count())
+    if processes > 1 and len(G) >= PARALLEL_MIN_NODES:
+        start = time.time()
+        split = shared_regions(G)
+        timings['regions'] = time.time() - start
+        if split is not None:
+            return _convert_regions(G, split, placement, cost, timings, processes)
+
+    # MRCA placement needs no node attributes, so it runs on the compact core; see compact.convert_compact
+    if placement == 'mrca':
+        start = time.time()
+        G.graph['dag_makespan'] = dag_makespan(G, cost)
+        timings['makespan'] = time.time() - start
+
+        start = time.time()
+        dag = CompactDAG.from_networkx(G)
+        timings['import'] = time.time() - start
+
+        tree = convert_compact(dag, timings)
+
+        start = time.time()
+        G.remove_edges_from(G.edges())
+        tree.to_networkx(G)
+        timings['export'] = time.time() - start
+
+        start = time.time()
+        G.graph['tree_makespan'] = tree_makespan(G, cost)
+        timings['makespan'] += time.time() - start
+        return G
 
     #################################################
     # I. Ensure there is only one source node       #
     #                                               #
+    # Order nodes topologically (Kahn's algorithm)  #
     # If number of source nodes is greater than 1:  #
     #   Create new node, S                          #
     #   For node in source_nodes:                   #
     #       (S, node)                               #
     #################################################
 
-    source_nodes = [node for node in G.nodes() if not nx.ancestors(G, node)]
+    start = time.time()
+    order = topological_order(G)
+    G.graph['dag_makespan'] = dag_makespan(G, cost, order)
+    source_nodes = [node for node in order if not G.pred[node]]
     if len(source_nodes) > 1:
         assert not G.has_node('S'), 'Graph must not contain a node labelled "S". Reserved for Source Node.'
-        G.add_edges_from([('S', node) for node in source_nodes],type='child')
+        G.add_edges_from([('S', node) for node in source_nodes], type='child')
+        order.insert(0, 'S')
+    timings['sources'] = time.time() - start
 
     #############################################################################################################
     # II. Convert DAG to Tree by breaking nodes with more than one parent and generating pseudonodes            #
     #                                                                                                           #
-    # While there exists a node with more than 1 parent:                                                        #
-    #   If node's parents have only 1 parent each:                                                              #
-    #       Find the MRCA: Y'                                                                                   #
+    # For node in topological order:                                                                            #
+    #   If node has more than 1 parent (every ancestor of node already has exactly 1 parent):                   #
+    #       Find the MRCA: Y' -- queried from an AncestryIndex that follows every rewiring below                #
     #       Find Y: the node on a path from Y' to X that is connected to Y' by a sequence of follow-on edges.   #
     #       Make new child of Y, Z                                                                              #
-    #       Remove edges from (Y, incident nodes)                                                               #
+    #       Remove edges from (Y, incident nodes) -- the nodes directly below Y on the paths to the parents     #
     #       Remove edges from (Parents of node, node)                                                           #
     #       Add child edges from (Z, incident nodes)                                                            #
     #       Add follow-on edge from (Z, node)                                                                   #
     #############################################################################################################
 
-    pseudonode_count = 0
+    start = time.time()
+    index = AncestryIndex()
+    spans = SpanCache(G, cost, index, bottom_levels(G, cost, order)) if placement == 'critical-path' else None
+    pseudonodes = []
+
+    for node in order:
+        parents = list(G.pred[node])
+        parent = parents[0] if len(parents) == 1 else None
+        if len(parents) > 1 and spans is not None:
+            parent = best_parent(G, index, spans, node)
+            if parent is not None:
+                G.remove_edges_from([(n, node) for n in parents if n != parent])
+
+        if parent is not None or not parents:
+            index.add(node, parent)
+        else:
+            Z = 'Z{}'.format(len(pseudonodes))
+            parent = break_node(G, index, node, Z)
+            pseudonodes.append(Z)
 
-    neighbors = chain.from_iterable([G.neighbors(node) for node in G.nodes()])
-    seen = set()
-    multi_parents = list(set(x for x in neighbors if x in seen or seen.add(x)))
+        if spans is not None:
+            for n in parents + [parent]:
+                spans.invalidate(n)
+
+    assert nx.is_tree(G), 'convert function failed to convert DAG to tree'
+    timings['resolve'] = time.time() - start
+
+    #########################################################################
+    # III. Collapse redundant pseudonodes                                   #
+    #                                                                       #
+    # If a pseudnode has only one follow-on and no children:                #
+    #   Collapse pseudonode into parent, convert follow-on to child edge.   #
+    # If a pseudnode has a parent whose only child is the pn:               #
+    #    Collapse pseudonode into parent, retaining edge type.              #
+    #########################################################################
+
+    start = time.time()
+    for pn in pseudonodes:
+        collapse_pseudonode(G, pn)
+    timings['collapse'] = time.time() - start
+
+    start = time.time()
+    G.graph['tree_makespan'] = tree_makespan(G, cost)
+    timings['makespan'] = time.time() - start
+    return G
+
+
+def shared_regions(G, hub_degree=None):
+    """
+    Splits G into a head, the shared setup nodes, a tail, the nodes that gather everything, and regions in between
+    with no edges from one to another -- in a campaign graph, the sub-DAGs of the samples.
+
+    Hubs, nodes with at least hub_degree edges, go to the head with their ancestors or to the tail with their
+    descendants, whichever is smaller.  Running the whole head before any region, and the tail after all of them,
+    then respects every edge.  Without hubs, the regions are just the weakly connected components.
+
+    :param hub_degree: Defaults to the square root of the number of nodes, and at least 16
+    :returns: (head, tail, regions), sets of nodes, or None if G does not split into two regions or more
+    """
+    hub_degree = hub_degree or max(16, int(len(G) ** 0.5))
+    head, tail = set(), set()
+    for node in G:
+        if node in head or node in tail or len(G.pred[node]) + len(G.succ[node]) < hub_degree:
+            continue
+        ancestors, descendants = nx.ancestors(G, node), nx.descendants(G, node)
+        if len(ancestors) <= len(descendants):
+            head |= ancestors
+            head.add(node)
+        else:
+            tail |= descendants
+            tail.add(node)
+    if head & tail:
+        return None
+
+    regions, seen = [], head | tail
+    for node in G:
+        if node in seen:
+            continue
+        region, stack = set([node]), [node]
+        seen.add(node)
+        while stack:
+            n = stack.pop()
+            for m in itertools.chain(G.succ[n], G.pred[n]):
+                if m not in seen:
+                    seen.add(m)
+                    region.add(m)
+                    stack.append(m)
+        regions.append(region)
+    return (head, tail, regions) if len(regions) > 1 else None
+
+
+def _convert_regions(G, split, placement, cost, timings, processes):
+    """
+    convert, with the regions of shared_regions converted in a process pool and stitched together: the head's tree
+    first, then the regions as children of one pseudonode that follows it, then the tail's tree as a follow-on.
+    Pseudonodes are renumbered across the pieces, and the S a piece added for its sources becomes a pseudonode.
+    """
+    head, tail, regions = split
+    start = time.time()
+    G.graph['dag_makespan'] = dag_makespan(G, cost)
+    timings['makespan'] = time.time() - start
+
+    # A few batches per process, balanced by size, so that small regions do not each pay for a round trip
+    start = time.time()
+    batches = [[] for _ in xrange(min(len(regions), processes * 4))]
+    loads = [0] * len(batches)
+    for region in sorted(regions, key=len, reverse=True):
+        lightest = loads.index(min(loads))
+        batches[lightest].extend(region)
+        loads[lightest] += len(region)
+    pool = multiprocessing.Pool(min(processes, len(batches)))
+    try:
+        pieces = pool.map(_convert_piece, [(G.subgraph(batch), placement, cost) for batch in batches])
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+    timings['parallel'] = time.time() - start
+
+    start = time.time()
+    if not head:
+        assert not G.has_node('S'), 'Graph must not contain a node labelled "S". Reserved for Source Node.'
+    ends = [_convert_piece((G.subgraph(nodes).copy(), placement, cost)) if nodes else None for nodes in (head, tail)]
+    G.remove_edges_from(G.edges())
+    names = ('Z{}'.format(i) for i in itertools.count())
+    roots = [_add_piece(G, piece, names) for piece in pieces]
+
+    if head:
+        top = _add_piece(G, ends[0], names)
+        Z = next(names)
+        G.add_node(Z, pseudo=True)
+        G.add_edge(if_follow_on(G, top), Z, type='follow-on')
+    else:
+        top = Z = 'S'
+    G.add_edges_from([(Z, root) for root in roots], type='child')
+    if tail:
+        G.add_edge(if_follow_on(G, top), _add_piece(G, ends[1], names), type='follow-on')
+    timings['stitch'] = time.time() - start
+
+    start = time.time()
+    G.graph['tree_makespan'] = tree_makespan(G, cost)
+    timings['makespan'] += time.time() - start
+    return G
 
-    while multi_parents:
 
-        for node in multi_parents:
+def _convert_piece(args):
+    """
+    Converts part of a DAG, in a pool worker.
+    :returns: (typed edges, nodes added by the conversion, root) of its tree
+    """
+    G, placement, cost = args
+    had_source = G.has_node('S')
+    convert(G, placement, cost)
+    added = [n for n in G if 'pseudo' in G.node[n] or (n == 'S' and not had_source)]
+    root = next(n for n in G if not G.pred[n])
+    return [(u, v, data['type']) for u, v, data in G.edges_iter(data=True)], added, root
 
-            # If parents of "node" have each have only ONE parent.
-            parents = [parent for parent in G.predecessors(node)]
-            if sum(len(G.predecessors(x))-1 for x in parents) == 0:
-                print 'Working on node with multiple parents: {}'.format(node)
 
-                # Find the Most Recent Common Ancestor (MRCA) for the parents
-                ancestors = [nx.topological_sort(G.subgraph(nx.ancestors(G, parent))) for parent in parents]
-                temp_ancestor = ancestors[0]
-                for ancestor in ancestors:
-                    temp_ancestor = [i for i, j in izip(temp_ancestor, ancestor) if i == j]
-                mrca = temp_ancestor[-1]
+def _add_piece(G, piece, names):
+    """
+    Adds a converted piece to G, with fresh names for its pseudonodes.
+    :returns: Its root
+    """
+    edges, added, root = piece
+    renamed = {n: next(names) for n in added}
+    for n in renamed.values():
+        G.add_node(n, pseudo=True)
+    G.add_edges_from((renamed.get(u, u), renamed.get(v, v), {'type': t}) for u, v, t in edges)
+    return renamed.get(root, root)
 
-                # Determine Y -- Y = mrca unless it is connected to a follow-on, then Y is = chain of follow-ons
-                Y = if_follow_on(G, mrca)
-                print '\tnode: {}, parents: {}, mrca: {}, Y: {}'.format(node, parents, mrca, Y)
 
-                # Create a child of Y, Z (pseudo-node)
-                assert not G.has_node('Z{}'.format(pseudonode_count)), "Z{int} is a reserved naming scheme for nodes."
-                G.add_node('Z{}'.format(pseudonode_count), pseudo=True)
-                G.add_edge(Y, 'Z{}'.format(pseudonode_count), type='child')
+def break_node(G, index, node, Z):
+    """
+    Breaks node's parent edges: node becomes the follow-on of a new pseudonode Z whose children lead to its parents.
+    Every ancestor of node must already be in the tree indexed by index.
+    :type index: AncestryIndex
+    :returns: Y, the node Z was attached to
+    """
+    parents = list(G.pred[node])
+    Y = pseudonode_anchor(G, index, parents)
 
-                # Find first nodes on the path from Y to node
-                incident_nodes = [path[1] for path in nx.all_simple_paths(G,Y,node)]
+    # Create a child of Y, Z (pseudo-node)
+    assert not G.has_node(Z), "Z{int} is a reserved naming scheme for nodes."
+    G.add_node(Z, pseudo=True)
+    G.add_edge(Y, Z, type='child')
+    index.add(Z, Y)
 
-                # Remove these incident edges from Y DELETE(Y, incident node)
-                G.remove_edges_from([(Y,n) for n in incident_nodes])
+    # Find first nodes on the path from Y to node
+    incident_nodes = incident_to(index, Y, node, parents)
 
-                # Attach these incident edges from Z to
-                G.add_edges_from([('Z{}'.format(pseudonode_count),n) for n in incident_nodes],type='child')
+    # Move these incident edges from Y to Z
+    for n in incident_nodes:
+        if n != node:
+            G.remove_edge(Y, n)
+            G.add_edge(Z, n, type='child')
+            index.move(n, Z)
 
-                # Delete parent edges from node
-                G.remove_edges_from([(n,node) for n in parents])
+    # Delete parent edges from node and add follow-on edge from Z to node
+    G.remove_edges_from([(n, node) for n in parents])
+    G.add_edge(Z, node, type='follow-on')
+    index.add(node, Z)
+    return Y
 
-                # Add follow-on edge from Z to node
-                G.add_edge('Z{}'.format(pseudonode_count), node, type='follow-on')
 
-                # Remove node from pool of nodes with multiple parents
-                multi_parents.remove(node)
-                pseudonode_count += 1
+def pseudonode_anchor(G, index, parents):
+    """
+    Returns Y, the node a pseudonode breaking a node with these parents hangs from.
+    :type index: AncestryIndex
+    """
+    # Find the Most Recent Common Ancestor (MRCA) for the parents
+    Y = index.mrca(parents)
 
-    assert nx.is_tree(G), 'convert function failed to convert DAG to tree'
+    # Determine Y -- Y = mrca unless a follow-on of it leads to node, then Y is = chain of follow-ons.  Only follow-ons
+    # already in the tree are walked: G still holds the DAG's edges to nodes not placed yet.
+    f = placed_follow_on(G, index, Y)
+    while f is not None and any(index.is_ancestor(f, parent) for parent in parents):
+        Y = f
+        f = placed_follow_on(G, index, Y)
+    return Y
 
-    #########################################################################
-    # III. Collapse redundant pseudonodes                                   #
-    #                                                                       #
-    # If a pseudnode has only one follow-on and no children:                #
-    #   Collapse pseudonode into parent, convert follow-on to child edge.   #                                                                   #
-    # If a pseudnode has a parent whose only child is the pn:               #
-    #    Collapse pseudonode into parent, retaining edge type.              #
-    #########################################################################
 
-    pseudonodes = [node for node in G.nodes() if 'pseudo' in G.node[node]]
-    for pn in pseudonodes:
+def best_parent(G, index, spans, node):
+    """
+    Critical-path placement for a node with several parents.  If one parent already finishes after all of the
+    others, node can hang directly below it instead of behind a pseudonode at the MRCA.  Both rewrites only change
+    the subtree of the MRCA, so the one giving the MRCA the shorter span gives the shorter critical path.
+    :type index: AncestryIndex
+    :type spans: SpanCache
+    :returns: The parent to attach node to, or None to break node with a pseudonode
+    """
+    parents = list(G.pred[node])
+    for parent in parents:
+        spans.invalidate(parent)
+    spans.placing = node
 
-        if len(G.neighbors(pn)) == 1:
-            # If pseudonodes only child is a follow-on
-            if G.get_edge_data(pn, G.neighbors(pn)[0])['type'] == 'follow-on':
-                # Collapse pseudonode into parent as a child edge
-                G.add_edge( G.predecessors(pn)[0], G.neighbors(pn)[0], type='child')
-                G.remove_node(pn)
-
-        # If a parent of a pseudonode has only one descendent
-        elif len(G.neighbors(G.predecessors(pn)[0])) == 1:
-            # If that descendent is a child edge
-            if G.get_edge_data(G.predecessors(pn)[0], pn)['type'] == 'child':
-                # Transfer all edges from pseudonode's descendents to parent.
-                parent = G.predecessors(pn)[0]
-                for child in G.neighbors(pn):
-                    G.add_edge(parent, child, type=G.get_edge_data(pn, child)['type'] )
-                G.remove_node(pn)
+    last = parents[0]
+    for parent in parents[1:]:
+        if runs_before(G, index, last, parent):
+            last = parent
+    if G.succ[last][node]['type'] != 'child' or \
+            not all(runs_before(G, index, parent, last) for parent in parents if parent != last):
+        return None
 
-    return G
+    mrca = index.mrca(parents)
+    cost = spans.cost(node)
+
+    # Span of the MRCA with node below last
+    direct = spans.climb(last, spans.span(last, extra=cost), mrca)
 
+    # Span of the MRCA with node behind a pseudonode
+    Y = pseudonode_anchor(G, index, parents)
+    incident_nodes = [n for n in incident_to(index, Y, node, parents) if n != node]
+    z = max([spans[n] for n in incident_nodes] or [0]) + cost
+    pseudo = spans.climb(Y, spans.span(Y, extra=z, dropped=incident_nodes), mrca)
 
-def evaluate(G, node):
+    return last if direct < pseudo else None
+
+
+def runs_before(G, index, u, v):
+    """
+    True if, in the tree indexed by index, u finishes before v starts.
+    :type index: AncestryIndex
+    """
+    X = index.mrca([u, v])
+    if X == u:
+        return True
+    if X == v:
+        return False
+    f = placed_follow_on(G, index, X)
+    return f is not None and index.child_toward(X, v) == f and index.child_toward(X, u) != f
+
+
+def dag_makespan(G, cost='runtime', order=None):
+    """
+    Length of the critical path of DAG G: its makespan with unlimited workers.
+    """
+    finish = {}
+    for node in order or topological_order(G):
+        finish[node] = max([finish[parent] for parent in G.pred[node]] or [0]) + node_cost(G, node, cost)
+    return max(finish.values() or [0])
+
+
+def bottom_levels(G, cost='runtime', order=None):
+    """
+    Length of the longest path from each node of DAG G to a sink, the node included.
+    """
+    bottom = {}
+    for node in reversed(order or topological_order(G)):
+        bottom[node] = max([bottom[child] for child in G.succ[node]] or [0]) + node_cost(G, node, cost)
+    return bottom
+
+
+def tree_makespan(T, cost='runtime'):
+    """
+    Makespan of the jobTree tree T with unlimited workers: the span of its root.
+    """
+    return max([SpanCache(T, cost)[node] for node in T if not T.pred[node]] or [0])
+
+
+def node_cost(G, node, cost='runtime'):
+    data = G.node[node]
+    return data.get(cost, 0 if 'pseudo' in data or node == 'S' else 1)
+
+
+class SpanCache(object):
+    """
+    Spans of the nodes of a jobTree tree: the time from a node starting until it, its children and its follow-on have
+    all finished.  span = cost + longest child span + follow-on span.  Spans are computed lazily and invalidated
+    from a node up to the root when the tree changes below it.
+    """
+    def __init__(self, G, cost='runtime', placed=None, bottom=None):
+        """
+        :param placed: If given, only nodes in placed are part of the tree. G may hold other edges to other nodes.
+        :param bottom: Bottom levels of the DAG.  If given, the DAG children of a node that are not placed yet are
+                       counted as children of that node, so spans estimate the work still to come.
+        """
+        self.G = G
+        self.placed = placed
+        self.bottom = bottom
+        self.placing = None
+        self.cost_attribute = cost
+        self.spans = {}
+
+    def __getitem__(self, node):
+        stack = [node]
+        while stack:
+            n = stack[-1]
+            if n in self.spans:
+                stack.pop()
+                continue
+            pending = [c for c in self._below(n) if c not in self.spans]
+            if pending:
+                stack.extend(pending)
+            else:
+                self.spans[n] = self.span(n)
+                stack.pop()
+        return self.spans[node]
+
+    def cost(self, node):
+        return node_cost(self.G, node, self.cost_attribute)
+
+    def span(self, node, extra=None, dropped=(), replaced=None, value=None):
+        """
+        Span of node, as if it also had a child of span extra, lost the children in dropped,
+        and the span of its child or follow-on replaced were value.
+        """
+        children = [] if extra is None else [extra]
+        if self.bottom is not None:
+            children.extend(self.bottom[c] for c in self.G.succ[node] if c not in self.placed and c != self.placing)
+        follow = 0
+        for c in self._below(node):
+            if c in dropped:
+                continue
+            s = value if c == replaced else self[c]
+            if self.G.succ[node][c].get('type') == 'follow-on':
+                follow = s
+            else:
+                children.append(s)
+        return self.cost(node) + max(children or [0]) + follow
+
+    def climb(self, node, span, top):
+        """
+        Given a new span for node, returns the span top would get.  top must be an ancestor of node.
+        """
+        while node != top:
+            parent = next(iter(self.G.pred[node]))
+            span = self.span(parent, replaced=node, value=span)
+            node = parent
+        return span
+
+    def invalidate(self, node):
+        while node in self.spans:
+            del self.spans[node]
+            node = next(iter(self.G.pred[node]), None)
+
+    def _below(self, node):
+        return [c for c in self.G.succ[node] if self.placed is None or c in self.placed]
+
+
+def topological_order(G):
+    """
+    Orders the nodes of G with Kahn's algorithm (in-degree counting).
+    :returns: List of nodes, parents before children
+    """
+    in_degree = {node: len(G.pred[node]) for node in G}
+    ready = deque(node for node in G if in_degree[node] == 0)
+    order = []
+    while ready:
+        node = ready.popleft()
+        order.append(node)
+        for child in G.succ[node]:
+            in_degree[child] -= 1
+            if in_degree[child] == 0:
+                ready.append(child)
+
+    assert len(order) == len(in_degree), 'Graph provided is not a "networkx" DAG.'
+    return order
+
+
+def incident_to(index, Y, node, parents):
+    """
+    Returns the nodes directly below Y on the paths from Y to node.
+    node itself is incident if Y is one of its parents.
+    :type index: AncestryIndex
+    """
+    incident_nodes = []
+    seen = set()
+    for parent in parents:
+        if parent == Y:
+            n = node
+        elif index.is_ancestor(Y, parent):
+            n = index.child_toward(Y, parent)
+        else:
+            continue
+        if n not in seen:
+            seen.add(n)
+            incident_nodes.append(n)
+    return incident_nodes
+
+
+def collapse_pseudonode(G, pn, index=None):
+    """
+    Collapses pseudonode pn into its parent if it is redundant.
+    A pseudonode left without a follow-on is redundant: its children become children of its parent.  A pseudonode
+    that is itself a follow-on, which only the incremental converter makes, passes on its place to a single
+    descendent instead.
+    :param index: AncestryIndex to keep in step with G, if any
+    :returns: True if pn was collapsed
+    """
+    parent = next(iter(G.pred[pn]))
+    descendents = G.succ[pn]
+    edge_type = G.succ[parent][pn]['type']
+
+    if edge_type == 'follow-on' and len(descendents) > 1:
+        return False
+
+    if not any(data['type'] == 'follow-on' for data in descendents.values()):
+        moved = [(child, edge_type) for child in descendents]
+
+    elif len(descendents) == 1:
+        # If pseudonodes only child is a follow-on: collapse pseudonode into parent, as a child edge unless the
+        # pseudonode was a follow-on
+        moved = [(next(iter(descendents)), edge_type)]
+
+    # If a parent of a pseudonode has only one descendent, and that descendent is a child edge
+    elif len(G.succ[parent]) == 1 and G.succ[parent][pn]['type'] == 'child':
+        # Transfer all edges from pseudonode's descendents to parent.
+        moved = [(child, data['type']) for child, data in descendents.items()]
+
+    else:
+        return False
+
+    for child, edge_type in moved:
+        G.add_edge(parent, child, type=edge_type)
+        if index is not None:
+            index.move(child, parent)
+    G.remove_node(pn)
+    if index is not None:
+        index.remove(pn)
+    return True
+
+
+def evaluate(G, node=None, workers=None, memory=None, timings=None):
     '''
-    Dynamically and recursively spawns jobTree targets
+    Runs the jobTree tree G locally, without a cluster, starting at node (the root by default).
+
+    A node runs once its parent has; its children then run concurrently in a process pool, and its follow-on starts
+    only after all of its children, with their own follow-ons, have finished.  Each node's "task" attribute (a
+    picklable callable, called with its "args") is the work done; nodes without one, like pseudonodes, are no-ops.
+    Resource hints on a node, "cores" (default 1) and "memory", are reserved while it runs.
+
+    :param workers: Cores to use. Defaults to all of them.
+    :param memory: Memory available to tasks, in the units of the nodes' "memory" hints. Unlimited by default.
+    :param timings: Optional dict, filled with the (start, finish) time of every node
+    :returns: Dict of the value returned by each node's task
     '''
+    if node is None:
+        node = next(n for n in G if not G.pred[n])
+    workers = workers or multiprocessing.cpu_count()
+    timings = {} if timings is None else timings
+    results = {}
+
+    pending_children = {}
+    ready = deque([node])
+    running = {}
+    finished = Queue.Queue()
+    free = {'cores': workers, 'memory': memory}
+    failure = None
+
+    def demand(n):
+        return min(G.node[n].get('cores', 1), workers), G.node[n].get('memory', 0)
+
+    def ran(n):
+        children = [c for c, data in G.succ[n].items() if data['type'] == 'child']
+        pending_children[n] = len(children)
+        ready.extend(children)
+        if not children:
+            children_done(n)
+
+    def children_done(n):
+        f = follow_on(G, n)
+        if f is not None:
+            ready.append(f)
+        else:
+            done(n)
+
+    def done(n):
+        # A node is done once it, its children and its follow-on have all run
+        while G.pred[n]:
+            parent = next(iter(G.pred[n]))
+            if G.succ[parent][n]['type'] == 'follow-on':
+                n = parent
+                continue
+            pending_children[parent] -= 1
+            if pending_children[parent]:
+                return
+            f = follow_on(G, parent)
+            if f is not None:
+                ready.append(f)
+                return
+            n = parent
+
+    pool = multiprocessing.Pool(workers)
+    try:
+        while ready or running:
+            # Start everything that fits, first-fit, so a large task never holds up smaller ones behind it
+            blocked = deque()
+            while ready and failure is None:
+                n = ready.popleft()
+                if 'task' not in G.node[n]:
+                    timings[n] = (time.time(), time.time())
+                    ran(n)
+                    continue
+                cores, mem = demand(n)
+                if cores > free['cores'] or (memory is not None and running and mem > free['memory']):
+                    blocked.append(n)
+                    continue
+                free['cores'] -= cores
+                if memory is not None:
+                    free['memory'] -= mem
+                task = pool.apply_async(_run_task, (G.node[n]['task'], G.node[n].get('args', ())),
+                                        callback=lambda outcome, n=n: finished.put((n, outcome)))
+                running[n] = (time.time(), task)
+            ready.extend(blocked)
+
+            if not running:
+                break
+
+            # Wait for a task to finish and release its resources
+            try:
+                n, (ok, value) = finished.get(timeout=1)
+            except Queue.Empty:
+                # The pool never calls back for tasks it could not pickle
+                lost = [(n, r) for n, (_, r) in running.items() if r.ready() and not r.successful()]
+                if not lost:
+                    continue
+                n, r = lost[0]
+                ok, value = False, str(_exception(r))
+            timings[n] = (running.pop(n)[0], time.time())
+            cores, mem = demand(n)
+            free['cores'] += cores
+            if memory is not None:
+                free['memory'] += mem
+            if ok:
+                results[n] = value
+                if failure is None:
+                    ran(n)
+            elif failure is None:
+                failure = (n, value)
+
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+
+    if failure is not None:
+        raise RuntimeError('Node {} failed:\n{}'.format(*failure))
+    return results
+
+
+def _exception(async_result):
+    try:
+        async_result.get()
+    except Exception as e:
+        return e
+
+
+def _run_task(task, args):
+    """
+    Runs a node's task in a pool worker, returning (True, result) or (False, traceback) so failures reach evaluate.
+    """
+    try:
+        return True, task(*args)
+    except Exception:
+        return False, traceback.format_exc()
+
+
+def follow_on(G, node):
+    """
+    Returns the follow-on of node, or None if it has none.
+    """
+    return next((x for x, data in G.succ[node].items() if data['type'] == 'follow-on'), None)
+
+
+def placed_follow_on(G, index, node):
+    """
+    Returns the follow-on of node in the tree indexed by index, or None.  Follow-on edges of G to nodes not in the
+    index yet are skipped.
+    :type index: AncestryIndex
+    """
+    return next((x for x, data in G.succ[node].items() if data['type'] == 'follow-on' and x in index), None)
+
 
-    #
+def if_follow_on(G, mrca, leads_to=None):
+    """
+    Walks the chain of follow-ons hanging off mrca and returns the last node on it.
+    If leads_to is given, the walk only continues through follow-ons for which leads_to(follow-on) is True.
+    """
+    Y = mrca
+    mrca_follow_on = follow_on(G, Y)
+    while mrca_follow_on is not None and (leads_to is None or leads_to(mrca_follow_on)):
+        Y = mrca_follow_on
+        mrca_follow_on = follow_on(G, Y)
+    return Y
 
 
-def if_follow_on(G, mrca):
-    if any(x['type'] == 'follow-on' for x in [G.get_edge_data(mrca, x) for x in G.neighbors(mrca)]):
-        mrca_follow_on = [x for x in G.neighbors(mrca) if G.get_edge_data(mrca,x)['type'] == 'follow-on'][0]
-        if not any(x['type'] == 'follow-on' for x in [G.get_edge_data(mrca_follow_on, x) for x in G.neighbors(mrca_follow_on)]):
-            return mrca_follow_on
+DeltaCost = namedtuple('DeltaCost', ['nodes_placed', 'pseudonodes_added', 'pseudonodes_removed', 'seconds'])
+
+
+class IncrementalConverter(object):
+    """
+    Keeps the jobTree tree of a growing DAG up to date, one delta at a time.
+
+    Adding a node or an edge to a new node costs O(1).  Adding an edge into an existing node v re-places only v and
+    its descendants in the DAG -- the only nodes whose position in the tree can depend on v's parents.
+    The DAG passed in is never modified.
+    """
+    def __init__(self, G=None):
+        """
+        :param G: Optional networkx DAG to start from.
+        """
+        self.dag = nx.DiGraph()
+        self.tree = nx.DiGraph()
+        self.index = AncestryIndex()
+        self.root = None
+        self.pseudonode_count = 0
+
+        if G is not None:
+            for node in topological_order(G):
+                assert node != 'S', 'Graph must not contain a node labelled "S". Reserved for Source Node.'
+                self.dag.add_node(node, **G.node[node])
+                self.tree.add_node(node, **G.node[node])
+                self.dag.add_edges_from((parent, node, data) for parent, data in G.pred[node].items())
+                self._place([node])
+
+    def add_node(self, node, **attr):
+        """
+        Adds node to the DAG as a new source, or updates its attributes if it is already present.
+        :rtype: DeltaCost
+        """
+        start = time.time()
+        if node in self.dag:
+            self.dag.node[node].update(attr)
+            self.tree.node[node].update(attr)
+            return DeltaCost(0, 0, 0, time.time() - start)
+
+        assert node != 'S', 'Graph must not contain a node labelled "S". Reserved for Source Node.'
+        self.dag.add_node(node, **attr)
+        self.tree.add_node(node, **attr)
+        self._attach_source(node)
+        return DeltaCost(1, 0, 0, time.time() - start)
+
+    def add_edge(self, u, v, type='child', **attr):
+        """
+        Adds edge (u, v) to the DAG, adding u and v first if they are new, and repairs the tree.
+        :rtype: DeltaCost
+        """
+        start = time.time()
+        if u not in self.dag:
+            self.add_node(u)
+
+        if v not in self.dag:
+            assert v != 'S', 'Graph must not contain a node labelled "S". Reserved for Source Node.'
+            self.dag.add_node(v)
+            self.dag.add_edge(u, v, type=type, **attr)
+            added = self._attach(v, u, type)
+            return DeltaCost(1, added, 0, time.time() - start)
+
+        affected = nx.descendants(self.dag, v)
+        assert u != v and u not in affected, 'Edge ({}, {}) would create a cycle.'.format(u, v)
+        self.dag.add_edge(u, v, type=type, **attr)
+        affected.add(v)
+
+        order = topological_order(self.dag.subgraph(affected))
+        removed = self._detach(order)
+        placed, added = self._place(order)
+        return DeltaCost(placed, added, removed, time.time() - start)
+
+    def _attach_source(self, node):
+        """
+        Hangs a node without parents under the source node, creating S if the tree now has two sources.
+        """
+        if self.root is None:
+            self.index.add(node)
+            self.root = node
+        elif self.root == 'S':
+            self.tree.add_edge('S', node, type='child')
+            self.index.add(node, 'S')
         else:
-            if_follow_on(G, mrca_follow_on)
-    else:
-        return mrca
+            self.tree.add_edges_from([('S', self.root), ('S', node)], type='child')
+            self.index.add('S')
+            self.index.move(self.root, 'S')
+            self.index.add(node, 'S')
+            self.root = 'S'
+
+    def _detach(self, order):
+        """
+        Removes the affected nodes, given in topological order, from the tree with everything the tree hangs below
+        them, and collapses the pseudonodes this leaves redundant.
+        :returns: Number of pseudonodes removed
+        """
+        # Everything below an affected node in the tree descends from it in the DAG, so it is affected too.
+        doomed = []
+        seen = set()
+        for node in order:
+            if node in seen:
+                continue
+            subtree = [node]
+            seen.add(node)
+            for n in subtree:
+                for child in self.tree.succ[n]:
+                    if child not in seen:
+                        seen.add(child)
+                        subtree.append(child)
+            doomed.extend(subtree)
+
+        boundary = set(next(iter(self.tree.pred[n])) for n in doomed if self.tree.pred[n]) - seen
+        removed = 0
+        for n in reversed(doomed):
+            self.index.remove(n)
+            if 'pseudo' in self.tree.node[n]:
+                removed += 1
+            else:
+                self.tree.remove_edges_from(self.tree.in_edges(n))
+        self.tree.remove_nodes_from(n for n in doomed if 'pseudo' in self.tree.node[n])
+        removed += sum(self._collapse(pn) for pn in boundary if 'pseudo' in self.tree.node[pn])
+        return removed
+
+    def _place(self, order):
+        """
+        Places nodes, in topological order, whose parents are all in the tree.
+        :returns: (nodes placed, pseudonodes added)
+        """
+        pseudonodes = []
+        for node in order:
+            parents = self.dag.pred[node]
+            if not parents:
+                self._attach_source(node)
+                continue
+
+            if len(parents) == 1:
+                parent, data = next(iter(parents.items()))
+                if self._attach(node, parent, data['type']):
+                    pseudonodes.append(next(iter(self.tree.pred[node])))
+            else:
+                self.tree.add_edges_from((parent, node, {'type': data['type']}) for parent, data in parents.items())
+                Z = self._pseudonode()
+                break_node(self.tree, self.index, node, Z)
+                pseudonodes.append(Z)
+
+        added = len(pseudonodes) - sum(self._collapse(pn) for pn in pseudonodes)
+        return len(order), added
+
+    def _attach(self, node, parent, type):
+        """
+        Hangs node below parent.  jobTree runs one follow-on per target, so a second follow-on of parent goes behind
+        a pseudonode that follows parent, as a child next to the first one.
+        :returns: Number of pseudonodes added
+        """
+        f = follow_on(self.tree, parent) if type == 'follow-on' else None
+        if f is None:
+            self.tree.add_edge(parent, node, type=type)
+            self.index.add(node, parent)
+            return 0
+        Z = self._pseudonode()
+        self.tree.add_node(Z, pseudo=True)
+        self.tree.remove_edge(parent, f)
+        self.tree.add_edge(parent, Z, type='follow-on')
+        self.tree.add_edges_from([(Z, f), (Z, node)], type='child')
+        self.index.add(Z, parent)
+        self.index.move(f, Z)
+        self.index.add(node, Z)
+        return 1
+
+    def _pseudonode(self):
+        Z = 'Z{}'.format(self.pseudonode_count)
+        assert Z not in self.dag, "Z{int} is a reserved naming scheme for nodes."
+        self.pseudonode_count += 1
+        return Z
+
+    def _collapse(self, pn):
+        return collapse_pseudonode(self.tree, pn, self.index)
+
 
 def main():
 
@@ -0,0 +1,230 @@
+"""
+Ancestry index for the trees built by Dag2Tree.convert
+
+The tree is stored as a link-cut tree (Sleator & Tarjan), so it can be queried for the Most Recent Common Ancestor
+of any number of nodes while nodes are attached to it and whole subtrees are moved under new pseudonodes.
+Every operation runs in amortized O(log n), and nothing is ever rebuilt.
+"""
+
+from array import array
+
+_NIL = -1
+
+
+class AncestryIndex(object):
+    """
+    Answers ancestry queries on a rooted tree that grows while it is being queried.
+    """
+    def __init__(self, tree=None, dense=False):
+        """
+        :param tree: Optional networkx tree (every node has at most one predecessor) to index.
+        :param dense: If True, nodes must be small non-negative integers, like the ids of a compact.CompactDAG, and
+                      are used as ids directly instead of through a lookup table.
+        """
+        self._dense = dense
+        self._id = _DenseIds() if dense else {}
+        self._nodes = None if dense else []
+        self._parent = array('i')
+        self._children = array('i')
+
+        # Splay tree children and parents.  A splay root's parent is the path-parent of its preferred path.
+        self._left = array('i')
+        self._right = array('i')
+        self._up = array('i')
+
+        if tree is not None:
+            for node in tree:
+                self._new(node)
+            for node in tree:
+                for parent in tree.pred[node]:
+                    self._link(self._id[node], self._id[parent])
+
+    def __contains__(self, node):
+        return node in self._id
+
+    def __len__(self):
+        return len(self._id)
+
+    def add(self, node, parent=None):
+        """
+        Adds node as a leaf under parent, or as a new root if parent is None.
+        """
+        assert node not in self._id, '{} is already in the index.'.format(node)
+        x = self._new(node)
+        if parent is not None:
+            self._link(x, self._id[parent])
+
+    def move(self, node, parent):
+        """
+        Detaches node, with its whole subtree, and attaches it under parent.
+        """
+        x, p = self._id[node], self._id[parent]
+        if self._parent[x] != _NIL:
+            self._cut(x)
+        self._link(x, p)
+
+    def remove(self, node):
+        """
+        Removes node from the index.  node must not have any children left.
+        """
+        x = self._id.pop(node)
+        if self._parent[x] != _NIL:
+            self._cut(x)
+        assert not self._children[x], 'Only leaves can be removed from the index.'
+        if self._nodes is not None:
+            self._nodes[x] = None
+
+    def parent(self, node):
+        """
+        :returns: Parent of node, or None for a root
+        """
+        p = self._parent[self._id[node]]
+        return self._node(p) if p != _NIL else None
+
+    def mrca(self, nodes):
+        """
+        Most Recent Common Ancestor of an iterable of nodes, which must all be in the same tree.
+        A node counts as its own ancestor.
+        """
+        nodes = iter(nodes)
+        x = self._id[next(nodes)]
+        for node in nodes:
+            x = self._lca(x, self._id[node])
+        return self._node(x)
+
+    def is_ancestor(self, ancestor, node):
+        """
+        True if ancestor is node or lies on the path from the root to node.
+        """
+        a = self._id[ancestor]
+        return self._lca(a, self._id[node]) == a
+
+    def child_toward(self, ancestor, node):
+        """
+        :returns: The child of ancestor on the path down to node
+        """
+        a, x = self._id[ancestor], self._id[node]
+        assert a != x and self._lca(a, x) == a, '{} is not a proper ancestor of {}'.format(ancestor, node)
+
+        # After accessing node, the root-to-node path is a single splay tree.  The child is ancestor's successor in it.
+        self._splay(a)
+        y = self._right[a]
+        while self._left[y] != _NIL:
+            y = self._left[y]
+        self._splay(y)
+        return self._node(y)
+
+    def _new(self, node):
+        x = node if self._dense else len(self._parent)
+        grow = x + 1 - len(self._parent)
+        if grow > 0:
+            if self._nodes is not None:
+                self._nodes.extend([None] * grow)
+            self._children.extend(array('i', [0]) * grow)
+            for column in (self._parent, self._left, self._right, self._up):
+                column.extend(array('i', [_NIL]) * grow)
+        self._id[node] = x
+        if self._nodes is not None:
+            self._nodes[x] = node
+        return x
+
+    def _node(self, x):
+        return x if self._nodes is None else self._nodes[x]
+
+    def _link(self, x, p):
+        # x is the root of its tree, so after accessing it, it has no left (shallower) part in its splay tree.
+        self._access(x)
+        self._up[x] = p
+        self._parent[x] = p
+        self._children[p] += 1
+
+    def _cut(self, x):
+        self._access(x)
+        left = self._left[x]
+        self._up[left] = _NIL
+        self._left[x] = _NIL
+        self._children[self._parent[x]] -= 1
+        self._parent[x] = _NIL
+
+    def _lca(self, x, y):
+        self._access(x)
+        return self._access(y)
+
+    def _is_splay_root(self, x):
+        p = self._up[x]
+        return p == _NIL or (self._left[p] != x and self._right[p] != x)
+
+    def _rotate(self, x):
+        left, right, up = self._left, self._right, self._up
+        p = up[x]
+        g = up[p]
+        if not self._is_splay_root(p):
+            if left[g] == p:
+                left[g] = x
+            else:
+                right[g] = x
+        up[x] = g
+        if left[p] == x:
+            left[p] = right[x]
+            if right[x] != _NIL:
+                up[right[x]] = p
+            right[x] = p
+        else:
+            right[p] = left[x]
+            if left[x] != _NIL:
+                up[left[x]] = p
+            left[x] = p
+        up[p] = x
+
+    def _splay(self, x):
+        left, up = self._left, self._up
+        while not self._is_splay_root(x):
+            p = up[x]
+            if not self._is_splay_root(p):
+                g = up[p]
+                self._rotate(p if (left[g] == p) == (left[p] == x) else x)
+            self._rotate(x)
+
+    def _access(self, x):
+        """
+        Makes the root-to-x path preferred and x the root of its splay tree.
+        :returns: The last path-parent jumped to -- the LCA with the previously accessed node
+        """
+        last = _NIL
+        y = x
+        while y != _NIL:
+            self._splay(y)
+            self._right[y] = last
+            last = y
+            y = self._up[y]
+        self._splay(x)
+        return last
+
+
+class _DenseIds(object):
+    """
+    Stands in for the node to id dict of an AncestryIndex whose nodes are their own ids.
+    """
+    def __init__(self):
+        self._present = bytearray()
+        self._count = 0
+
+    def __contains__(self, node):
+        return 0 <= node < len(self._present) and self._present[node] == 1
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, node):
+        return node
+
+    def __setitem__(self, node, x):
+        if node >= len(self._present):
+            self._present.extend(bytearray(node + 1 - len(self._present)))
+        self._present[node] = 1
+        self._count += 1
+
+    def pop(self, node):
+        self._present[node] = 0
+        self._count -= 1
+        return node
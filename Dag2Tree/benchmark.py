@@ -0,0 +1,246 @@
+"""
+Scaling benchmarks for Dag2Tree.convert
+
+Generates families of DAGs, converts each one in its own process so its peak memory can be measured, and writes the
+phase timings to a JSON file.  Given the file of an earlier run, cases that got slower or bigger are reported and the
+script exits with status 1.
+
+    python benchmark.py --output bench.json
+    python benchmark.py --output new.json --baseline bench.json
+"""
+
+import argparse
+import json
+import multiprocessing
+import Queue
+import random
+import resource
+import subprocess
+import sys
+import time
+
+import networkx as nx
+
+from Dag2Tree import convert
+
+
+def layered_dag(layers, width, fan_in=2, seed=0):
+    """
+    Random layered DAG: every node outside the first layer has fan_in parents in the layer above.
+    """
+    rng = random.Random(seed)
+    G = nx.DiGraph()
+    G.add_nodes_from((0, i) for i in xrange(width))
+    for layer in xrange(1, layers):
+        for i in xrange(width):
+            for j in rng.sample(xrange(width), min(fan_in, width)):
+                G.add_edge((layer - 1, j), (layer, i), type='child')
+    return G
+
+
+def wide_diamonds(width, depth=1):
+    """
+    depth diamonds in a row, each fanning out to width nodes and back in to one.
+    """
+    G = nx.DiGraph()
+    for d in xrange(depth):
+        for i in xrange(width):
+            G.add_edge(('join', d), ('fan', d, i), type='child')
+            G.add_edge(('fan', d, i), ('join', d + 1), type='child')
+    return G
+
+
+def follow_on_chain(depth):
+    """
+    A chain of follow-ons, each with a child that also leads to the next link, so every link has two parents and
+    each pseudonode has to be placed by walking the chain.
+    """
+    G = nx.DiGraph()
+    for i in xrange(depth):
+        G.add_edge(('link', i), ('link', i + 1), type='follow-on')
+        G.add_edge(('link', i), ('child', i), type='child')
+        G.add_edge(('child', i), ('link', i + 1), type='child')
+    return G
+
+
+def scatter_gather(samples, chromosomes=24):
+    """
+    Tumor/normal variant calling: shared reference indexes, a BAM index per input, a caller scattered per chromosome
+    and a gather per sample, then one report over every sample.
+    """
+    G = nx.DiGraph()
+    G.add_edges_from([('reference', 'reference.fai'), ('reference', 'reference.dict')], type='child')
+    for s in xrange(samples):
+        for kind in ('normal', 'tumor'):
+            G.add_edge((kind, s), (kind + '.bai', s), type='child')
+        for c in xrange(chromosomes):
+            call = ('mutect', s, c)
+            G.add_edges_from([(parent, call) for parent in ('reference.fai', 'reference.dict',
+                                                            ('normal.bai', s), ('tumor.bai', s))], type='child')
+            G.add_edge(call, ('merge', s), type='child')
+        G.add_edge(('merge', s), 'report', type='child')
+    return G
+
+
+GENERATORS = {'layered': layered_dag,
+              'diamonds': wide_diamonds,
+              'follow-on-chain': follow_on_chain,
+              'scatter-gather': scatter_gather}
+
+# (name, generator, parameters) for every case, at scale 1
+CASES = [('layered-small', 'layered', {'layers': 50, 'width': 100}),
+         ('layered-large', 'layered', {'layers': 200, 'width': 500}),
+         ('diamonds-wide', 'diamonds', {'width': 50000}),
+         ('diamonds-deep', 'diamonds', {'width': 100, 'depth': 500}),
+         ('follow-on-chain', 'follow-on-chain', {'depth': 20000}),
+         ('scatter-gather', 'scatter-gather', {'samples': 500, 'chromosomes': 24})]
+
+# Sizes that are multiplied by --scale
+_SCALED = ('layers', 'width', 'depth', 'samples')
+
+
+def run_case(name, generator, params, placement='mrca', processes=1):
+    """
+    Generates one DAG and converts it in this process.
+    :returns: Dict of the case's sizes, phase timings, total seconds and peak memory growth in MB
+    """
+    G = GENERATORS[generator](**params)
+    nodes, edges = G.number_of_nodes(), G.number_of_edges()
+    before = _max_rss_mb()
+    timings = {}
+    start = time.time()
+    convert(G, placement=placement, timings=timings, processes=processes)
+    seconds = time.time() - start
+    return {'case': name,
+            'generator': generator,
+            'params': params,
+            'placement': placement,
+            'processes': processes,
+            'nodes': nodes,
+            'edges': edges,
+            'pseudonodes': sum(1 for n in G if 'pseudo' in G.node[n]),
+            'phases': timings,
+            'seconds': seconds,
+            'peak_mb': _max_rss_mb() - before,
+            'dag_makespan': G.graph['dag_makespan'],
+            'tree_makespan': G.graph['tree_makespan']}
+
+
+def run_isolated(name, generator, params, placement='mrca', processes=1):
+    """
+    run_case in a fresh process, so the peak memory of one case does not hide that of the next.
+    """
+    results = multiprocessing.Queue()
+    process = multiprocessing.Process(target=_run_into, args=(results, name, generator, params, placement,
+                                                                      processes))
+    process.start()
+    while True:
+        try:
+            result = results.get(timeout=1)
+            break
+        except Queue.Empty:
+            # A case killed for running out of memory never reports back
+            if not process.is_alive():
+                result = RuntimeError('exited with code {}'.format(process.exitcode))
+                break
+    process.join()
+    if isinstance(result, Exception):
+        raise RuntimeError('Benchmark case {} failed: {}'.format(name, result))
+    return result
+
+
+def run_suite(scale=1.0, placement='mrca', cases=None, processes=1):
+    """
+    :param scale: Multiplies the sizes of every case
+    :param cases: Names of the cases to run, all of them by default
+    :returns: Dict with the commit benchmarked and the result of every case
+    """
+    results = []
+    for name, generator, params in CASES:
+        if cases and name not in cases:
+            continue
+        params = {k: max(1, int(v * scale)) if k in _SCALED else v for k, v in params.items()}
+        results.append(run_isolated(name, generator, params, placement, processes))
+    return {'commit': _commit(), 'time': time.time(), 'scale': scale, 'results': results}
+
+
+def compare(baseline, current, tolerance=0.25, min_seconds=0.05, min_mb=2):
+    """
+    Compares two runs of the suite, case by case.
+    A case regresses when its time or peak memory grows by more than tolerance, and by more than the noise floors
+    min_seconds and min_mb.
+    :returns: List of regression messages
+    """
+    old = {(r['case'], r['placement'], r.get('processes', 1)): r for r in baseline['results']}
+    regressions = []
+    for r in current['results']:
+        b = old.get((r['case'], r['placement'], r.get('processes', 1)))
+        if b is None or b['params'] != r['params']:
+            continue
+        for key, floor in (('seconds', min_seconds), ('peak_mb', min_mb)):
+            if r[key] > b[key] * (1 + tolerance) and r[key] - b[key] > floor:
+                regressions.append('{}: {} went from {:.2f} to {:.2f}'.format(r['case'], key, b[key], r[key]))
+    return regressions
+
+
+def _run_into(queue, *args):
+    try:
+        queue.put(run_case(*args))
+    except Exception as e:
+        queue.put(e)
+
+
+def _max_rss_mb():
+    # ru_maxrss is in kilobytes on Linux and bytes on OS X
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / 2.0 ** 20 if sys.platform == 'darwin' else rss / 1024.0
+
+
+def _commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], stderr=subprocess.STDOUT).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description='Benchmarks Dag2Tree.convert on generated DAGs')
+    parser.add_argument('-o', '--output', default='bench.json', help='JSON file to write the results to')
+    parser.add_argument('-b', '--baseline', help='JSON results of an earlier run to check for regressions')
+    parser.add_argument('-s', '--scale', type=float, default=1.0, help='Multiplies the size of every case')
+    parser.add_argument('-p', '--placement', default='mrca', choices=['mrca', 'critical-path'])
+    parser.add_argument('-j', '--processes', type=int, default=1, help='Processes each conversion may use')
+    parser.add_argument('-t', '--tolerance', type=float, default=0.25,
+                        help='Relative growth in time or memory that counts as a regression')
+    parser.add_argument('-c', '--cases', nargs='*', help='Only run these cases: {}'.format(
+        ', '.join(name for name, _, _ in CASES)))
+    return parser
+
+
+def main():
+    args = build_parser().parse_args()
+    suite = run_suite(args.scale, args.placement, args.cases, args.processes)
+
+    # Cases that split into regions report the parallel conversion and the stitching instead
+    phases = ('resolve', 'collapse') if args.processes == 1 else ('parallel', 'stitch')
+    print '{:<18}{:>9}{:>9}{:>10}{:>10}{:>10}{:>10}'.format('case', 'nodes', 'edges', phases[0], phases[1],
+                                                          'seconds', 'peak MB')
+    for r in suite['results']:
+        print '{:<18}{:>9}{:>9}{:>10.2f}{:>10.2f}{:>10.2f}{:>10.1f}'.format(
+            r['case'], r['nodes'], r['edges'], r['phases'].get(phases[0], r['phases'].get('resolve', 0)),
+            r['phases'].get(phases[1], r['phases'].get('collapse', 0)), r['seconds'], r['peak_mb'])
+
+    with open(args.output, 'w') as f:
+        json.dump(suite, f, indent=2, sort_keys=True)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(json.load(f), suite, args.tolerance)
+        for regression in regressions:
+            print 'REGRESSION ' + regression
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
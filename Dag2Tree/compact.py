@@ -0,0 +1,372 @@
+"""
+Compact graph core for Dag2Tree
+
+networkx keeps a dict of attributes for every edge, which dominates memory on large workflow graphs.  Here nodes are
+integer ids, adjacency lives in CSR (compressed sparse row) arrays, edge types take one byte each and pseudonodes are
+flagged in a bitmap.  Labels are only looked up at the networkx boundary.
+"""
+
+from array import array
+from collections import deque
+from itertools import izip
+import time
+
+import networkx as nx
+
+from ancestry import AncestryIndex
+
+CHILD = 0
+FOLLOW_ON = 1
+EDGE_TYPES = ('child', 'follow-on')
+
+_NIL = -1
+_REAL, _PSEUDO, _REMOVED = 0, 1, 2
+_TYPE_CODES = {name: code for code, name in enumerate(EDGE_TYPES)}
+
+
+class CompactDAG(object):
+    """
+    Directed graph with integer node ids 0..n-1.
+
+    Successors of node i are succ[succ_ptr[i]:succ_ptr[i + 1]], with their edge types in succ_type at the same
+    positions.  pred, pred_ptr and pred_type hold the same edges by destination.
+    """
+    def __init__(self):
+        self.labels = []
+        self._id = {}
+        self.succ_ptr, self.succ, self.succ_type = array('l', [0]), array('i'), bytearray()
+        self.pred_ptr, self.pred, self.pred_type = array('l', [0]), array('i'), bytearray()
+        self.pseudo = bytearray()
+
+    @classmethod
+    def from_edges(cls, edges, nodes=()):
+        """
+        Builds a CompactDAG without going through networkx.
+
+        :param edges: Iterable of unique (u, v) or (u, v, type) tuples, type being 'child' (the default) or 'follow-on'
+        :param nodes: Nodes to include even if no edge touches them
+        """
+        dag = cls()
+        for node in nodes:
+            dag._node_id(node)
+        src, dst, types = array('i'), array('i'), bytearray()
+        for edge in edges:
+            src.append(dag._node_id(edge[0]))
+            dst.append(dag._node_id(edge[1]))
+            types.append(_TYPE_CODES[edge[2]] if len(edge) > 2 else CHILD)
+        dag._build(src, dst, types)
+        dag._id = None
+        return dag
+
+    @classmethod
+    def from_networkx(cls, G):
+        """
+        Builds a CompactDAG from a networkx DiGraph.  Edges without a "type" are child edges.
+        Node attributes other than "pseudo" are not copied.
+        """
+        dag = cls.from_edges(((u, v, data.get('type', 'child')) for u, v, data in G.edges_iter(data=True)), G)
+        for node, data in G.nodes_iter(data=True):
+            if 'pseudo' in data:
+                dag.set_pseudo(dag.id(node))
+        return dag
+
+    def to_networkx(self, G=None):
+        """
+        Adds the nodes and typed edges of this graph to G, a new networkx DiGraph by default.
+        Pseudonodes get the "pseudo" attribute.
+        :returns: G
+        """
+        G = nx.DiGraph() if G is None else G
+        labels = self.labels
+        for i, label in enumerate(labels):
+            if self.is_pseudo(i):
+                G.add_node(label, pseudo=True)
+            else:
+                G.add_node(label)
+        for u in xrange(len(labels)):
+            for k in xrange(self.succ_ptr[u], self.succ_ptr[u + 1]):
+                G.add_edge(labels[u], labels[self.succ[k]], type=EDGE_TYPES[self.succ_type[k]])
+        return G
+
+    def __len__(self):
+        return len(self.labels)
+
+    def __contains__(self, label):
+        return label in self._ids()
+
+    def id(self, label):
+        return self._ids()[label]
+
+    def number_of_edges(self):
+        return len(self.succ)
+
+    def successors(self, i):
+        return self.succ[self.succ_ptr[i]:self.succ_ptr[i + 1]]
+
+    def predecessors(self, i):
+        return self.pred[self.pred_ptr[i]:self.pred_ptr[i + 1]]
+
+    def is_pseudo(self, i):
+        return bool(self.pseudo[i >> 3] & (1 << (i & 7)))
+
+    def set_pseudo(self, i):
+        self.pseudo[i >> 3] |= 1 << (i & 7)
+
+    def topological_order(self):
+        """
+        Orders the node ids with Kahn's algorithm (in-degree counting).
+        :returns: array of node ids, parents before children
+        """
+        n = len(self.labels)
+        in_degree = array('i', (self.pred_ptr[i + 1] - self.pred_ptr[i] for i in xrange(n)))
+        ready = deque(i for i in xrange(n) if in_degree[i] == 0)
+        order = array('i')
+        succ, succ_ptr = self.succ, self.succ_ptr
+        while ready:
+            node = ready.popleft()
+            order.append(node)
+            for k in xrange(succ_ptr[node], succ_ptr[node + 1]):
+                child = succ[k]
+                in_degree[child] -= 1
+                if in_degree[child] == 0:
+                    ready.append(child)
+
+        assert len(order) == n, 'Graph provided is not a "networkx" DAG.'
+        return order
+
+    def _ids(self):
+        # The label lookup is only needed at the networkx boundary, so it is dropped once the arrays are built
+        if self._id is None:
+            self._id = {label: i for i, label in enumerate(self.labels)}
+        return self._id
+
+    def _node_id(self, label):
+        i = self._id.get(label)
+        if i is None:
+            i = self._id[label] = len(self.labels)
+            self.labels.append(label)
+        return i
+
+    def _build(self, src, dst, types):
+        n = len(self.labels)
+        self.succ_ptr, self.succ, self.succ_type = _csr(n, src, dst, types)
+        self.pred_ptr, self.pred, self.pred_type = _csr(n, dst, src, types)
+        self.pseudo = bytearray((n + 7) // 8)
+
+
+def _csr(n, rows, cols, types):
+    """
+    Sorts edges (rows[k], cols[k]) by row with a counting sort.
+    :returns: (row pointers, columns, types)
+    """
+    ptr = array('l', [0]) * (n + 1)
+    for r in rows:
+        ptr[r + 1] += 1
+    for i in xrange(n):
+        ptr[i + 1] += ptr[i]
+    fill = array('l', ptr)
+    columns = array('i', [0]) * len(rows)
+    edge_types = bytearray(len(rows))
+    for r, c, t in izip(rows, cols, types):
+        k = fill[r]
+        columns[k] = c
+        edge_types[k] = t
+        fill[r] = k + 1
+    return ptr, columns, edge_types
+
+
+def convert_compact(dag, timings=None):
+    """
+    Converts a CompactDAG to a jobTree tree, the way Dag2Tree.convert does with 'mrca' placement.
+    Pseudonodes are labelled Z0, Z1, ... in order of creation and flagged in the tree's bitmap.
+    :type dag: CompactDAG
+    :param timings: Optional dict, filled with the seconds spent unifying the sources ('sources'), resolving nodes
+                    with several parents ('resolve') and collapsing pseudonodes ('collapse')
+    :rtype: CompactDAG
+    """
+    timings = {} if timings is None else timings
+    began = time.time()
+    order = dag.topological_order()
+    tree = _TreeBuilder(dag)
+    index = AncestryIndex(dense=True)
+    reserved = set(label for label in dag.labels if label == 'S' or isinstance(label, basestring) and label[:1] == 'Z')
+
+    # I. Ensure there is only one source node
+    sources = [node for node in order if dag.pred_ptr[node] == dag.pred_ptr[node + 1]]
+    root = _NIL
+    if len(sources) > 1:
+        assert 'S' not in reserved, 'Graph must not contain a node labelled "S". Reserved for Source Node.'
+        root = tree.new_node('S')
+        index.add(root)
+    timings['sources'] = time.time() - began
+
+    # II. Break nodes with more than one parent, in topological order, with pseudonodes at the MRCA of the parents
+    pseudonodes = []
+    for node in order:
+        start, end = dag.pred_ptr[node], dag.pred_ptr[node + 1]
+        if start == end:
+            if root == _NIL:
+                index.add(node)
+            else:
+                tree.attach(node, root, CHILD)
+                index.add(node, root)
+        elif end - start == 1:
+            parent = dag.pred[start]
+            tree.attach(node, parent, dag.pred_type[start])
+            index.add(node, parent)
+        else:
+            Z = 'Z{}'.format(len(pseudonodes))
+            assert Z not in reserved, "Z{int} is a reserved naming scheme for nodes."
+            pseudonodes.append(tree.break_node(index, node, dag.pred[start:end], Z))
+
+    timings['resolve'] = time.time() - began - timings['sources']
+
+    # III. Collapse redundant pseudonodes.  The index is not needed any more.
+    began = time.time()
+    del index
+    for pn in pseudonodes:
+        tree.collapse(pn)
+
+    tree = tree.result()
+    timings['collapse'] = time.time() - began
+    return tree
+
+
+class _TreeBuilder(object):
+    """
+    The tree under construction: an array of parents, with each node's children in a doubly linked list of siblings
+    so whole groups of them can be moved to a pseudonode and back.
+    """
+    def __init__(self, dag):
+        n = len(dag)
+        self.labels = dag.labels
+        self.extra = []
+        self.parent = array('i', [_NIL]) * n
+        self.kind = bytearray(n)
+        self.follow = array('i', [_NIL]) * n
+        self.degree = array('i', [0]) * n
+        self.first = array('i', [_NIL]) * n
+        self.next = array('i', [_NIL]) * n
+        self.prev = array('i', [_NIL]) * n
+        self.state = bytearray(n)
+
+    def label(self, x):
+        n = len(self.labels)
+        return self.labels[x] if x < n else self.extra[x - n]
+
+    def new_node(self, label, state=_REAL):
+        x = len(self.labels) + len(self.extra)
+        self.extra.append(label)
+        for column in (self.parent, self.follow, self.first, self.next, self.prev):
+            column.append(_NIL)
+        self.kind.append(CHILD)
+        self.degree.append(0)
+        self.state.append(state)
+        return x
+
+    def children(self, x):
+        child = self.first[x]
+        while child != _NIL:
+            yield child
+            child = self.next[child]
+
+    def attach(self, x, p, edge_type):
+        self.parent[x] = p
+        self.kind[x] = edge_type
+        self.degree[p] += 1
+        if edge_type == FOLLOW_ON:
+            self.follow[p] = x
+        head = self.first[p]
+        self.next[x] = head
+        self.prev[x] = _NIL
+        if head != _NIL:
+            self.prev[head] = x
+        self.first[p] = x
+
+    def detach(self, x):
+        p = self.parent[x]
+        self.degree[p] -= 1
+        if self.follow[p] == x:
+            self.follow[p] = _NIL
+        before, after = self.prev[x], self.next[x]
+        if before == _NIL:
+            self.first[p] = after
+        else:
+            self.next[before] = after
+        if after != _NIL:
+            self.prev[after] = before
+        self.parent[x] = _NIL
+
+    def break_node(self, index, node, parents, label):
+        """
+        Makes node the follow-on of a new pseudonode whose children lead to its parents.
+        :returns: The pseudonode
+        """
+        # Y is the MRCA, or the last follow-on below it that still leads to a parent
+        Y = index.mrca(parents)
+        f = self.follow[Y]
+        while f != _NIL and any(index.is_ancestor(f, parent) for parent in parents):
+            Y = f
+            f = self.follow[Y]
+
+        # The nodes directly below Y on the paths to the parents move under Z
+        incident_nodes = set(index.child_toward(Y, parent) for parent in parents
+                             if parent != Y and index.is_ancestor(Y, parent))
+
+        Z = self.new_node(label, _PSEUDO)
+        self.attach(Z, Y, CHILD)
+        index.add(Z, Y)
+        for n in incident_nodes:
+            self.detach(n)
+            self.attach(n, Z, CHILD)
+            index.move(n, Z)
+
+        self.attach(node, Z, FOLLOW_ON)
+        index.add(node, Z)
+        return Z
+
+    def collapse(self, pn):
+        """
+        Collapses pseudonode pn into its parent if it is redundant, with the rules of Dag2Tree.collapse_pseudonode.
+        """
+        parent = self.parent[pn]
+        f = self.follow[pn]
+
+        if f == _NIL:
+            moved = [(child, CHILD) for child in self.children(pn)]
+        elif self.degree[pn] == 1:
+            moved = [(f, CHILD)]
+        elif self.degree[parent] == 1 and self.kind[pn] == CHILD:
+            moved = [(child, self.kind[child]) for child in self.children(pn)]
+        else:
+            return False
+
+        self.detach(pn)
+        for child, edge_type in moved:
+            self.detach(child)
+            self.attach(child, parent, edge_type)
+        self.state[pn] = _REMOVED
+        return True
+
+    def result(self):
+        """
+        :returns: The tree as a CompactDAG, without the pseudonodes that were collapsed
+        """
+        tree = CompactDAG()
+        ids = array('i', [_NIL]) * len(self.parent)
+        for x, state in enumerate(self.state):
+            if state != _REMOVED:
+                ids[x] = len(tree.labels)
+                tree.labels.append(self.label(x))
+
+        src, dst, types = array('i'), array('i'), bytearray()
+        for x, p in enumerate(self.parent):
+            if p != _NIL:
+                src.append(ids[p])
+                dst.append(ids[x])
+                types.append(self.kind[x])
+        tree._build(src, dst, types)
+        for x, state in enumerate(self.state):
+            if state == _PSEUDO:
+                tree.set_pseudo(ids[x])
+        return tree
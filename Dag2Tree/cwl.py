@@ -0,0 +1,454 @@
+"""
+CWL workflows as Dag2Tree DAGs
+
+Every step of a workflow becomes a node, with a child edge from each step to the steps that read its outputs.
+A scattered step becomes one node per scatter job, named step[i] (step[i,j] for cross products), and the step's own
+node gathers them, so the steps downstream wait on one node instead of every job.  A step that runs a nested workflow
+is expanded in place, its steps named step/inner, and its own node gathers them in the same way.
+
+Nodes carry
+    step            Id of the step, the same for all jobs of a scatter
+    tool            Key of the step's tool in G.graph['tools'].  Gathering nodes have none.
+    job             Inputs of the step bound from the job order and defaults.  Outputs of other steps, known only once
+                    those have run, are bound as {'source': node, 'output': name}.
+    scatter_index   Position of a scatter job, one index per scattered input
+    scatter         Inputs to scatter over, on a step that scatters over another step's output.  How many jobs that
+                    takes is only known at run time, so the step stays one node.
+    value_from      valueFrom expressions of the step's inputs, left to the runner
+
+Parsing depends only on the documents, so with a cache_dir the parsed workflow is pickled under the SHA-1 of its main
+document, with the hashes of every document it reaches.  A template submitted for many job orders is parsed once.
+"""
+import cPickle
+import errno
+import hashlib
+import itertools
+import json
+import os
+
+import networkx as nx
+
+try:
+    import yaml
+except ImportError:
+    yaml = None
+
+
+class Workflow(object):
+    """
+    A parsed workflow, steps in topological order.  Picklable, and independent of any job order.
+    """
+    def __init__(self, id, inputs, steps, tools, key=None):
+        """
+        :param inputs: {input: default}, None for inputs without a default
+        :param steps: List of step dicts: id, in ({input: {'source': [...], 'default', 'valueFrom'}}), out, scatter,
+                      scatter_method, and either tool (a key of tools) or workflow (a nested Workflow)
+        :param tools: {key: CommandLineTool or ExpressionTool document} of every tool, nested workflows' included
+        """
+        self.id = id
+        self.inputs = inputs
+        self.steps = steps
+        self.tools = tools
+        self.key = key
+
+
+def load_workflow(tool, wf=None, cache_dir=None):
+    """
+    :param tool: Path of a CWL document, or the parsed document.  A lone CommandLineTool becomes a one-step workflow.
+    :param wf: Id of the process to run from a packed document ($graph).  Defaults to main, or the only Workflow.
+    :param cache_dir: Directory of parsed workflows, keyed by document hash
+    :returns: Workflow
+    """
+    loader = _Loader()
+    path, text = loader.source(tool)
+    entry = None
+    if cache_dir is not None and path is not None:
+        entry = os.path.join(cache_dir, 'workflows', _sha1('{}\n{}\n{}'.format(os.path.abspath(path), wf, text)))
+        cached = load_cached(entry)
+        # A document it reaches may have changed since
+        if cached is not None and all(_file_sha1(p) == digest for p, digest in cached[0]):
+            return cached[1]
+
+    workflow = loader.load(path, text, wf)
+    if entry is not None:
+        save_cached(entry, (sorted(loader.hashes.items()), workflow))
+    return workflow
+
+
+def load_job(job):
+    """
+    :param job: Path of a job order document, or the job order itself
+    """
+    if isinstance(job, dict):
+        return job
+    with open(job) as f:
+        return _parse(f.read(), job)
+
+
+def to_dag(workflow, job):
+    """
+    :param workflow: Workflow from load_workflow
+    :param job: Job order, a dict of the workflow's inputs
+    :returns: networkx DAG of the workflow's steps, with child edges.  The tools are in G.graph['tools'].
+    """
+    G = nx.DiGraph()
+    G.graph['tools'] = dict(workflow.tools)
+    for event in _walk(workflow, '', _environment(workflow, job), {}):
+        if event[0] == 'node':
+            G.add_node(event[1], **event[2])
+        elif event[0] == 'edge':
+            G.add_edge(event[1], event[2], type='child')
+    return G
+
+
+def bind(G, workflow, job):
+    """
+    Binds the nodes of G, a DAG from to_dag or the tree it was converted to, to the inputs of another job order with
+    the same shape().
+    :returns: G
+    """
+    for event in _walk(workflow, '', _environment(workflow, job), {}):
+        if event[0] == 'node':
+            if event[1] not in G:
+                raise RuntimeError('Job order does not match the shape of the graph: no node {}'.format(event[1]))
+            G.node[event[1]].update(event[2])
+    return G
+
+
+def shape(workflow, job):
+    """
+    :returns: Everything about a job order that changes the DAG: the number of jobs of every scatter
+    """
+    return tuple((event[1], event[2]) for event in _walk(workflow, '', _environment(workflow, job), {})
+                 if event[0] == 'scatter')
+
+
+def _environment(workflow, job):
+    env = {name: job.get(name) for name in workflow.inputs}
+    for name, default in workflow.inputs.items():
+        if env[name] is None:
+            env[name] = default
+    return env
+
+
+def _walk(workflow, prefix, env, ends):
+    """
+    Expands workflow, with its inputs bound by env, into events:
+        ('node', name, attributes), ('edge', u, v), ('scatter', node, number of jobs or None if not known yet)
+
+    :param prefix: Prepended to the names of the nodes, for nested workflows
+    :param ends: Filled with 'entries', the nodes that depend on nothing else in the workflow, and 'sinks', the
+                 nodes nothing else in it depends on
+    """
+    finish, entries, needed = {}, [], set()
+    for step in workflow.steps:
+        name = prefix + step['id']
+        deps = sorted(set(source.split('/')[0] for spec in step['in'].values() for source in spec['source']
+                          if '/' in source))
+        needed.update(deps)
+        values = {}
+        for input_name, spec in step['in'].items():
+            bound = [_source(source, prefix, env) for source in spec['source']]
+            value = bound[0] if len(bound) == 1 else bound or None
+            values[input_name] = spec.get('default') if value is None else value
+        attrs = {'step': name}
+        value_from = {n: spec['valueFrom'] for n, spec in step['in'].items() if spec.get('valueFrom') is not None}
+        if value_from:
+            attrs['value_from'] = value_from
+
+        jobs = _scatter(step, name, values)
+        if step['scatter']:
+            yield 'scatter', name, len(jobs) if jobs is not None else None
+        if jobs is None:
+            attrs['scatter'] = step['scatter']
+            jobs = [(None, values)]
+
+        step_entries, step_sinks = [], []
+        for index, job_values in jobs:
+            job_name = name if index is None else '{}[{}]'.format(name, ','.join(str(i) for i in index))
+            job_attrs = dict(attrs, job=job_values)
+            if index is not None:
+                job_attrs['scatter_index'] = index
+            if step.get('workflow') is None:
+                job_attrs['tool'] = step['tool']
+                yield 'node', job_name, job_attrs
+                step_entries.append(job_name)
+                step_sinks.append(job_name)
+            else:
+                nested = step['workflow']
+                nested_env = {n: job_values.get(n) for n in nested.inputs}
+                for n, default in nested.inputs.items():
+                    if nested_env[n] is None:
+                        nested_env[n] = default
+                nested_ends = {}
+                for event in _walk(nested, job_name + '/', nested_env, nested_ends):
+                    yield event
+                step_entries += nested_ends['entries']
+                step_sinks += nested_ends['sinks']
+
+        # One node finishes the step: the job itself, or a node gathering the jobs of a scatter or nested workflow
+        if step_sinks != [name]:
+            yield 'node', name, attrs
+            for sink in step_sinks:
+                yield 'edge', sink, name
+            step_entries = step_entries or [name]
+        finish[step['id']] = name
+
+        for dep in deps:
+            for entry in step_entries:
+                yield 'edge', finish[dep], entry
+        if not deps:
+            entries.extend(step_entries)
+
+    ends['entries'] = entries
+    ends['sinks'] = [finish[step['id']] for step in workflow.steps if step['id'] not in needed]
+
+
+def _source(source, prefix, env):
+    if '/' in source:
+        step, output = source.split('/', 1)
+        return {'source': prefix + step, 'output': output}
+    return env.get(source)
+
+
+def _scatter(step, name, values):
+    """
+    :returns: [(index, values)] for every job of a scattered step, [(None, values)] if it does not scatter, or None if
+              it scatters over values only known at run time
+    """
+    if not step['scatter']:
+        return [(None, values)]
+    arrays = [values.get(n) for n in step['scatter']]
+    if any(isinstance(a, dict) and 'source' in a for a in arrays):
+        return None
+    for n, a in zip(step['scatter'], arrays):
+        if not isinstance(a, list):
+            raise RuntimeError('Step {} scatters over {}, which is not an array: {!r}'.format(name, n, a))
+
+    if step['scatter_method'] == 'dotproduct':
+        if len(set(len(a) for a in arrays)) > 1:
+            raise RuntimeError('Step {} scatters over arrays of different lengths with dotproduct'.format(name))
+        indices = [(i,) for i in xrange(len(arrays[0]))]
+    else:
+        indices = list(itertools.product(*[xrange(len(a)) for a in arrays]))
+
+    jobs = []
+    for index in indices:
+        job_values = dict(values)
+        for k, n in enumerate(step['scatter']):
+            job_values[n] = arrays[k][index[0] if len(index) == 1 else index[k]]
+        jobs.append((index, job_values))
+    return jobs
+
+
+class _Loader(object):
+    """
+    Reads a workflow and the documents its steps run, remembering the SHA-1 of each.
+    """
+    def __init__(self):
+        self.documents = {}
+        self.hashes = {}
+        self.tools = {}
+        self.root = os.getcwd()
+
+    def source(self, tool):
+        """
+        :returns: (path, text) of a document, path None for a parsed one
+        """
+        if isinstance(tool, dict):
+            return None, json.dumps(tool, sort_keys=True)
+        with open(tool) as f:
+            return tool, f.read()
+
+    def load(self, path, text, wf):
+        if path is not None:
+            path = os.path.abspath(path)
+            self.root = os.path.dirname(path)
+            self.hashes[path] = _sha1(text)
+        document = _parse(text, path)
+        self.documents[path] = document
+        process = self.process(document, wf, path)
+        if process.get('class') != 'Workflow':
+            process = self.wrap(process, path)
+        workflow = self.workflow(process, path)
+        workflow.key = _sha1('\n'.join(['{}\n{}'.format(wf, _sha1(text))] +
+                                       [self.hashes[p] for p in sorted(self.hashes)]))
+        return workflow
+
+    def process(self, document, id, path):
+        """
+        :returns: The process with id in a packed document, or the document itself
+        """
+        if '$graph' not in document:
+            return document
+        graph = document['$graph']
+        if id is None:
+            workflows = [p for p in graph if p.get('class') == 'Workflow']
+            main = [p for p in graph if p.get('id', '').lstrip('#') == 'main']
+            candidates = main or workflows
+            if len(candidates) != 1:
+                raise RuntimeError('{} holds {} workflows; pick one with wf'.format(path, len(workflows)))
+            return candidates[0]
+        for p in graph:
+            if p.get('id', '').lstrip('#') == id.lstrip('#'):
+                return p
+        raise RuntimeError('No process {} in {}'.format(id, path))
+
+    def wrap(self, tool, path):
+        """
+        A tool run on its own, as a workflow of one step with the same inputs
+        """
+        step_id = os.path.splitext(os.path.basename(path or 'tool'))[0]
+        inputs = [_short(i['id']) for i in _items(tool.get('inputs', []))]
+        return {'class': 'Workflow', 'id': '', 'inputs': [{'id': i} for i in inputs],
+                'steps': [{'id': step_id, 'run': tool, 'in': [{'id': i, 'source': i} for i in inputs]}]}
+
+    def workflow(self, process, path):
+        wid = process.get('id', '').lstrip('#')
+        inputs = {}
+        for i in _items(process.get('inputs', [])):
+            inputs[_local(i['id'], wid)] = i.get('default')
+
+        steps = {}
+        for s in _items(process.get('steps', [])):
+            step = {'id': _local(s['id'], wid), 'in': {}, 'out': [], 'tool': None, 'workflow': None}
+            for i in _items(s.get('in', s.get('inputs', [])), key='source'):
+                source = i.get('source', [])
+                spec = {'source': [_local(x, wid) for x in (source if isinstance(source, list) else [source])]}
+                for field in ('default', 'valueFrom'):
+                    if field in i:
+                        spec[field] = i[field]
+                step['in'][_short(i['id'])] = spec
+            step['out'] = [_short(o if isinstance(o, basestring) else o['id'])
+                           for o in s.get('out', s.get('outputs', []))]
+            scatter = s.get('scatter', [])
+            step['scatter'] = [_short(n) for n in (scatter if isinstance(scatter, list) else [scatter])]
+            step['scatter_method'] = s.get('scatterMethod', 'dotproduct')
+
+            run, run_path, key = self.resolve(s.get('run'), path, step['id'])
+            if run.get('class') == 'Workflow':
+                step['workflow'] = self.workflow(run, run_path)
+            else:
+                self.tools[key] = run
+                step['tool'] = key
+            steps[step['id']] = step
+
+        return Workflow(wid, inputs, _topological(steps, wid), dict(self.tools))
+
+    def resolve(self, run, path, step_id):
+        """
+        :returns: (process, path of its document, key) of a step's run field
+        """
+        base = path or os.path.join(self.root, 'inline')
+        if isinstance(run, dict):
+            return run, path, '{}#{}'.format(os.path.relpath(base, self.root), run.get('id', step_id).lstrip('#'))
+        if not isinstance(run, basestring):
+            raise RuntimeError('Step {} has no run'.format(step_id))
+        target, _, fragment = run.partition('#')
+        run_path = os.path.normpath(os.path.join(os.path.dirname(base), target)) if target else path
+        if run_path not in self.documents:
+            with open(run_path) as f:
+                text = f.read()
+            self.hashes[run_path] = _sha1(text)
+            self.documents[run_path] = _parse(text, run_path)
+        process = self.process(self.documents[run_path], fragment or None, run_path)
+        key = os.path.relpath(run_path, self.root) if run_path else 'inline'
+        return process, run_path, key + ('#' + fragment if fragment else '')
+
+
+def _items(field, key='type'):
+    """
+    CWL lists fields either as a list of dicts with ids, or as a map from id to a dict or, for short, to the value of
+    key.
+    """
+    if isinstance(field, list):
+        return field
+    return [dict(value, id=name) if isinstance(value, dict) else {'id': name, key: value}
+            for name, value in field.items()]
+
+
+def _short(id):
+    return id.lstrip('#').split('/')[-1]
+
+
+def _local(id, wid):
+    """
+    Id relative to its workflow, as in packed documents, where they look like #main/step/output
+    """
+    id = id.lstrip('#')
+    if wid and id.startswith(wid + '/'):
+        id = id[len(wid) + 1:]
+    return id
+
+
+def _topological(steps, wid):
+    """
+    :returns: The steps in an order where each comes after those whose outputs it reads
+    """
+    order, state = [], {}
+    for start in sorted(steps):
+        stack = [(start, False)]
+        while stack:
+            sid, done = stack.pop()
+            if done:
+                state[sid] = 'done'
+                order.append(steps[sid])
+                continue
+            if state.get(sid) == 'done':
+                continue
+            if state.get(sid) == 'open':
+                raise RuntimeError('Workflow {} has a cycle through step {}'.format(wid or '', sid))
+            state[sid] = 'open'
+            stack.append((sid, True))
+            for spec in steps[sid]['in'].values():
+                for source in spec['source']:
+                    dep = source.split('/')[0] if '/' in source else None
+                    if dep is not None and dep not in steps:
+                        raise RuntimeError('Step {} reads {} from an unknown step'.format(sid, source))
+                    if dep is not None and state.get(dep) != 'done':
+                        stack.append((dep, False))
+    return order
+
+
+def _parse(text, path):
+    try:
+        return json.loads(text)
+    except ValueError:
+        if yaml is None:
+            raise RuntimeError('{} is not JSON, and reading YAML needs PyYAML'.format(path))
+        return yaml.load(text, Loader=getattr(yaml, 'CSafeLoader', yaml.SafeLoader))
+
+
+def _sha1(text):
+    return hashlib.sha1(text).hexdigest()
+
+
+def _file_sha1(path):
+    try:
+        with open(path) as f:
+            return _sha1(f.read())
+    except IOError:
+        return None
+
+
+def load_cached(path):
+    try:
+        with open(path, 'rb') as f:
+            return cPickle.load(f)
+    except (IOError, EOFError, cPickle.UnpicklingError):
+        return None
+
+
+def save_cached(path, value):
+    """
+    Writes value atomically, so concurrent submissions never read a partial entry
+    """
+    try:
+        os.makedirs(os.path.dirname(path))
+    except OSError as exc:
+        if exc.errno != errno.EEXIST:
+            raise
+    tmp = '{}.{}.tmp'.format(path, os.getpid())
+    with open(tmp, 'wb') as f:
+        cPickle.dump(value, f, cPickle.HIGHEST_PROTOCOL)
+    os.rename(tmp, path)
@@ -0,0 +1,165 @@
+"""
+Load benchmark of http_server against a local client
+
+Converts a generated DAG, writes it the way the visualizations do -- node-link JSON for the force layout and the
+tree/ files of tree_layout -- and fetches them with concurrent keep-alive clients, first from a single-threaded
+SimpleHTTPServer like the one http_server used to run, then from http_server.StoppableHTTPServer, cold and revalidating
+with If-None-Match.  Reports requests per second, bytes on the wire, latency, and how long stopping the server takes.
+
+    python http_benchmark.py --clients 16 --requests 50
+"""
+import argparse
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+import httplib
+import BaseHTTPServer
+import SimpleHTTPServer
+
+from networkx.readwrite import json_graph
+
+import http_server
+from Dag2Tree import convert
+from benchmark import GENERATORS
+from tree_layout import write_tree
+
+PATHS = ['force.json', 'tree/tree.json', 'tree/tree.bin', 'tree/labels/0.json']
+
+
+class _QuietHandler(SimpleHTTPServer.SimpleHTTPRequestHandler):
+
+    def log_message(self, format, *args):
+        pass
+
+
+def write_files(directory, generator, params):
+    T = convert(GENERATORS[generator](**params))
+    with open(os.path.join(directory, 'force.json'), 'w') as f:
+        json.dump(json_graph.node_link_data(T), f, default=str)
+    os.mkdir(os.path.join(directory, 'tree'))
+    write_tree(T, os.path.join(directory, 'tree'))
+    return len(T)
+
+
+def fetch(port, clients, requests, headers):
+    """
+    Runs clients threads, each sending requests GETs for every path over one connection.
+    :returns: (seconds, [latency of every request], bytes received, {status: count})
+    """
+    latencies, received, statuses = [], [0], {}
+    lock = threading.Lock()
+    etags = {}
+
+    def client():
+        connection = httplib.HTTPConnection('127.0.0.1', port)
+        mine, size, codes = [], 0, {}
+        for _ in xrange(requests):
+            for path in PATHS:
+                h = dict(headers)
+                if 'If-None-Match' in h:
+                    h['If-None-Match'] = etags.get(path, '')
+                start = time.time()
+                connection.request('GET', '/' + path, headers=h)
+                response = connection.getresponse()
+                size += len(response.read())
+                mine.append(time.time() - start)
+                codes[response.status] = codes.get(response.status, 0) + 1
+        connection.close()
+        with lock:
+            latencies.extend(mine)
+            received[0] += size
+            for code, count in codes.items():
+                statuses[code] = statuses.get(code, 0) + count
+
+    if 'If-None-Match' in headers:
+        connection = httplib.HTTPConnection('127.0.0.1', port)
+        for path in PATHS:
+            connection.request('GET', '/' + path, headers={'Accept-Encoding': headers.get('Accept-Encoding', '')})
+            response = connection.getresponse()
+            response.read()
+            etags[path] = response.getheader('ETag') or ''
+        connection.close()
+
+    threads = [threading.Thread(target=client) for _ in xrange(clients)]
+    start = time.time()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return time.time() - start, sorted(latencies), received[0], statuses
+
+
+def run(server_name, scenario, clients, requests):
+    headers = {'Accept-Encoding': 'gzip'}
+    if scenario == 'revalidate':
+        headers['If-None-Match'] = None
+    if server_name == 'single-threaded':
+        httpd = BaseHTTPServer.HTTPServer(('127.0.0.1', 0), _QuietHandler)
+        serving = threading.Thread(target=httpd.serve_forever, kwargs={'poll_interval': 1})
+        stop = httpd.shutdown
+    else:
+        http_server.GraphRequestHandler.quiet = True
+        httpd = http_server.StoppableHTTPServer(('127.0.0.1', 0), http_server.GraphRequestHandler)
+        serving = threading.Thread(target=httpd.serve)
+        stop = httpd.stop
+    serving.start()
+    try:
+        seconds, latencies, received, statuses = fetch(httpd.server_address[1], clients, requests, headers)
+    finally:
+        # Let the accept loop settle into its wait, as it would between page loads
+        time.sleep(0.2)
+        start = time.time()
+        stop()
+        serving.join()
+        stopped = time.time() - start
+        httpd.server_close()
+    return {'server': server_name, 'scenario': scenario, 'requests': len(latencies), 'seconds': seconds,
+            'bytes': received, 'statuses': statuses,
+            'p50_ms': latencies[len(latencies) // 2] * 1000, 'p99_ms': latencies[int(len(latencies) * 0.99)] * 1000,
+            'stop_ms': stopped * 1000}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--generator', default='scatter-gather', choices=sorted(GENERATORS))
+    parser.add_argument('--param', action='append', default=[], metavar='NAME=VALUE',
+                        help='Integer parameter of the generator.  Repeatable.  Defaults to samples=200.')
+    parser.add_argument('--clients', type=int, default=8, help='Concurrent clients')
+    parser.add_argument('--requests', type=int, default=20, help='Rounds of requests per client')
+    parser.add_argument('--output', help='JSON file to write the results to')
+    args = parser.parse_args()
+    params = {name: int(value) for name, value in (p.split('=', 1) for p in args.param)}
+    if not params and args.generator == 'scatter-gather':
+        params = {'samples': 200}
+
+    directory = tempfile.mkdtemp()
+    cwd = os.getcwd()
+    try:
+        nodes = write_files(directory, args.generator, params)
+        sizes = {path: os.path.getsize(os.path.join(directory, path)) for path in PATHS}
+        print('{} nodes; {}'.format(nodes, ', '.join('{} {:.0f} KB'.format(p, sizes[p] / 1024.0) for p in PATHS)))
+        os.chdir(directory)
+        results = [run('single-threaded', 'cold', args.clients, args.requests),
+                   run('threaded', 'cold', args.clients, args.requests),
+                   run('threaded', 'revalidate', args.clients, args.requests)]
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(directory)
+
+    print('{:<17}{:<12}{:>10}{:>12}{:>10}{:>10}{:>10}'.format('server', 'scenario', 'req/s', 'wire MB', 'p50 ms',
+                                                               'p99 ms', 'stop ms'))
+    for r in results:
+        print('{:<17}{:<12}{:>10.0f}{:>12.1f}{:>10.1f}{:>10.1f}{:>10.1f}'.format(
+            r['server'], r['scenario'], r['requests'] / r['seconds'], r['bytes'] / 1024.0 ** 2, r['p50_ms'],
+            r['p99_ms'], r['stop_ms']))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,83 +1,327 @@
 # helper to load url
 # runs webserver and loads url with webbrowswer module
+#
+# The server handles each connection in its own thread, keeps connections alive, and serves files with strong ETags
+# (If-None-Match gets a 304), gzip -- or brotli, if the brotli module is installed -- for clients that accept it, and
+# single byte ranges for clients that fetch large files in pieces.  stop() returns at once: the accept loop waits on a
+# pipe as well as the listening socket, instead of polling with a timeout.
+import errno
+import os
+import select
+import shutil
 import sys
+import threading
+import zlib
+from io import BytesIO
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
 
 def load_url(path):
     PORT = 8000
     httpd = StoppableHTTPServer(("127.0.0.1",PORT), handler)
-    thread.start_new_thread(httpd.serve, ())
+    serving = threading.Thread(target=httpd.serve)
+    serving.start()
     webbrowser.open_new('http://localhost:%s/%s'%(PORT,path))
     input("Press <RETURN> to stop server\n")
     httpd.stop()
+    serving.join()
     print("To restart server run: \n%s"%server)
 
 
 if sys.version_info[0] == 2:
     import SimpleHTTPServer, BaseHTTPServer
-    import socket
-    import thread
+    import SocketServer as socketserver
     import webbrowser
-    handler = SimpleHTTPServer.SimpleHTTPRequestHandler
+    from email.utils import formatdate
+    SimpleHandler = SimpleHTTPServer.SimpleHTTPRequestHandler
+    HTTPServer = BaseHTTPServer.HTTPServer
     input = raw_input
     server = "python -m SimpleHTTPServer 8000"
 
-    class StoppableHTTPServer(BaseHTTPServer.HTTPServer):
- 
-        def server_bind(self):
-            BaseHTTPServer.HTTPServer.server_bind(self)
-            self.socket.settimeout(1)
-            self.run = True
- 
-        def get_request(self):
-            while self.run:
-                try:
-                    sock, addr = self.socket.accept()
-                    sock.settimeout(None)
-                    return (sock, addr)
-                except socket.timeout:
-                    pass
- 
-        def stop(self):
-            self.run = False
- 
-        def serve(self):
-            while self.run:
-                self.handle_request()
-
-
 else:
-    import http.server, http.server
-    import socket
-    import _thread as thread
+    import http.server
+    import socketserver
     import webbrowser
-    handler = http.server.SimpleHTTPRequestHandler
+    from email.utils import formatdate
+    SimpleHandler = http.server.SimpleHTTPRequestHandler
+    HTTPServer = http.server.HTTPServer
     server = "python -m http.server 8000"
 
-    class StoppableHTTPServer(http.server.HTTPServer):
- 
-        def server_bind(self):
-            http.server.HTTPServer.server_bind(self)
-            self.socket.settimeout(1)
-            self.run = True
- 
-        def get_request(self):
+
+# Encodings the server can produce, most preferred first
+ENCODINGS = (['br'] if brotli is not None else []) + ['gzip']
+
+# Types that are already compressed
+INCOMPRESSIBLE = ('image/png', 'image/jpeg', 'image/gif', 'application/zip', 'application/gzip',
+                  'application/x-gzip')
+
+
+class GraphRequestHandler(SimpleHandler):
+    """
+    SimpleHTTPRequestHandler with revalidation, compression and ranges, over persistent connections.
+    """
+    protocol_version = 'HTTP/1.1'
+    # Headers go out in one write, flushed after each response.  Written line by line, they stall on Nagle's
+    # algorithm and delayed ACKs for 40 ms per request on a persistent connection.
+    wbufsize = 64 * 1024
+    disable_nagle_algorithm = True
+    extensions_map = dict(SimpleHandler.extensions_map, **{'.json': 'application/json',
+                                                           '.js': 'application/javascript',
+                                                           '.bin': 'application/octet-stream'})
+    # Files smaller than this are sent as they are
+    min_compress = 1024
+    # Compressed files are kept in memory, up to this many bytes in all
+    compressed_cache_size = 256 * 1024 ** 2
+    quiet = False
+
+    _compressed = {}
+    _compressing = {}
+    _compressed_bytes = [0]
+    _lock = threading.Lock()
+
+    def send_head(self):
+        path = self.translate_path(self.path)
+        if os.path.isdir(path):
+            return SimpleHandler.send_head(self)
+        try:
+            f = open(path, 'rb')
+        except IOError:
+            self.send_error(404, "File not found")
+            return None
+        st = os.fstat(f.fileno())
+        ctype = self.guess_type(path)
+        etag = '{:x}-{:x}'.format(int(st.st_mtime * 1e6), st.st_size)
+
+        # Ranges are served from the file itself, so they stay cheap however large it is
+        ranges = self.headers.get('Range')
+        if_range = self.headers.get('If-Range')
+        if ranges and (if_range is None or if_range.strip('"') == etag):
+            return self._send_range(f, ranges, st.st_size, ctype, etag, st.st_mtime)
+
+        encoding = self._encoding(ctype, st.st_size)
+        tag = '"{}"'.format(etag if encoding is None else '{}-{}'.format(etag, encoding))
+        if self._not_modified(etag):
+            f.close()
+            self.send_response(304)
+            self.send_header('ETag', tag)
+            self.send_header('Vary', 'Accept-Encoding')
+            self.end_headers()
+            return None
+
+        if encoding is not None:
+            body = self._compress(path, f, etag, encoding)
+            f.close()
+            f = BytesIO(body)
+            length = len(body)
+        else:
+            length = st.st_size
+        self.send_response(200)
+        self.send_header('Content-Type', ctype)
+        self.send_header('Content-Length', str(length))
+        if encoding is not None:
+            self.send_header('Content-Encoding', encoding)
+        self._validators(tag, st.st_mtime)
+        self.end_headers()
+        return f
+
+    def _validators(self, tag, mtime):
+        self.send_header('ETag', tag)
+        self.send_header('Last-Modified', formatdate(mtime, usegmt=True))
+        # Converted graphs are rewritten in place, so clients revalidate every time
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Vary', 'Accept-Encoding')
+        self.send_header('Accept-Ranges', 'bytes')
+
+    def _not_modified(self, etag):
+        header = self.headers.get('If-None-Match')
+        if header is None:
+            return False
+        for tag in header.split(','):
+            tag = tag.strip()
+            if tag == '*':
+                return True
+            tag = tag[2:] if tag.startswith('W/') else tag
+            if tag.strip('"').split('-')[:2] == etag.split('-'):
+                return True
+        return False
+
+    def _encoding(self, ctype, size):
+        if size < self.min_compress or ctype in INCOMPRESSIBLE:
+            return None
+        accepted = self.headers.get('Accept-Encoding', '')
+        accepted = set(e.split(';')[0].strip() for e in accepted.split(',') if not e.strip().endswith(';q=0'))
+        return next((e for e in ENCODINGS if e in accepted), None)
+
+    def _compress(self, path, f, etag, encoding):
+        key = (path, etag, encoding)
+        with self._lock:
+            body = self._compressed.get(key)
+            compressing = self._compressing.setdefault(key, threading.Lock())
+        if body is not None:
+            return body
+        # Clients asking for the same file at once wait for one compression of it
+        with compressing:
+            body = self._compressed.get(key)
+            if body is None:
+                body = self._compress_and_cache(key, f.read())
+        with self._lock:
+            self._compressing.pop(key, None)
+        return body
+
+    def _compress_and_cache(self, key, data):
+        path, etag, encoding = key
+        if encoding == 'br':
+            body = brotli.compress(data, quality=5)
+        else:
+            compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+            body = compressor.compress(data) + compressor.flush()
+        with self._lock:
+            cache = self._compressed
+            # Older versions of a file are no use once it changed
+            for stale in [k for k in cache if k[0] == path and k[1] != etag]:
+                self._compressed_bytes[0] -= len(cache.pop(stale))
+            while cache and self._compressed_bytes[0] + len(body) > self.compressed_cache_size:
+                self._compressed_bytes[0] -= len(cache.pop(next(iter(cache))))
+            if len(body) <= self.compressed_cache_size and key not in cache:
+                cache[key] = body
+                self._compressed_bytes[0] += len(body)
+        return body
+
+    def _send_range(self, f, ranges, size, ctype, etag, mtime):
+        """
+        Serves a single byte range, bytes=start-end, bytes=start- or bytes=-suffix.  Several ranges at once get the
+        whole file.
+        """
+        unit, _, spec = ranges.partition('=')
+        if unit.strip() != 'bytes' or ',' in spec:
+            f.seek(0)
+            self.send_response(200)
+            self.send_header('Content-Type', ctype)
+            self.send_header('Content-Length', str(size))
+            self._validators('"{}"'.format(etag), mtime)
+            self.end_headers()
+            return f
+        first, _, last = spec.strip().partition('-')
+        try:
+            if first:
+                start, end = int(first), min(int(last) if last else size - 1, size - 1)
+            else:
+                start, end = max(0, size - int(last)), size - 1
+        except ValueError:
+            start, end = size, size - 1
+        if start > end or start >= size:
+            f.close()
+            self.send_response(416)
+            self.send_header('Content-Range', 'bytes */{}'.format(size))
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return None
+        f.seek(start)
+        self.send_response(206)
+        self.send_header('Content-Type', ctype)
+        self.send_header('Content-Length', str(end - start + 1))
+        self.send_header('Content-Range', 'bytes {}-{}/{}'.format(start, end, size))
+        self._validators('"{}"'.format(etag), mtime)
+        self.end_headers()
+        return _Slice(f, end - start + 1)
+
+    def copyfile(self, source, outputfile):
+        try:
+            shutil.copyfileobj(source, outputfile, 64 * 1024)
+        except (IOError, OSError) as e:
+            # The client went away
+            if e.errno not in (errno.EPIPE, errno.ECONNRESET):
+                raise
+
+    def log_message(self, format, *args):
+        if not self.quiet:
+            SimpleHandler.log_message(self, format, *args)
+
+
+class _Slice(object):
+    """
+    The next length bytes of a file
+    """
+    def __init__(self, f, length):
+        self.f = f
+        self.left = length
+
+    def read(self, size=-1):
+        size = self.left if size < 0 else min(size, self.left)
+        data = self.f.read(size)
+        self.left -= len(data)
+        return data
+
+    def close(self):
+        self.f.close()
+
+
+class StoppableHTTPServer(socketserver.ThreadingMixIn, HTTPServer):
+    """
+    HTTP server with a thread per connection, and a stop() that takes effect immediately.
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def server_bind(self):
+        HTTPServer.server_bind(self)
+        self.run = True
+        self._wake = os.pipe()
+        self._connections = set()
+        self._connections_lock = threading.Lock()
+
+    def serve(self):
+        try:
             while self.run:
                 try:
-                    sock, addr = self.socket.accept()
-                    sock.settimeout(None)
-                    return (sock, addr)
-                except socket.timeout:
+                    ready = select.select([self.socket, self._wake[0]], [], [])[0]
+                except (select.error, OSError) as e:
+                    if e.args[0] == errno.EINTR:
+                        continue
+                    raise
+                if self.run and self.socket in ready:
+                    self._handle_request_noblock()
+        finally:
+            self.server_close()
+            wake, self._wake = self._wake, None
+            for fd in wake:
+                os.close(fd)
+
+    def stop(self):
+        """
+        Stops accepting connections, and closes the ones open, without waiting for clients to hang up.
+        """
+        self.run = False
+        try:
+            os.write(self._wake[1], b'x')
+        except (TypeError, OSError):
+            # Already stopped
+            pass
+        with self._connections_lock:
+            for connection in list(self._connections):
+                try:
+                    connection.shutdown(2)
+                except (IOError, OSError):
                     pass
- 
-        def stop(self):
-            self.run = False
- 
-        def serve(self):
-            while self.run:
-                self.handle_request()
- 
 
+    def process_request(self, request, client_address):
+        with self._connections_lock:
+            self._connections.add(request)
+        socketserver.ThreadingMixIn.process_request(self, request, client_address)
+
+    def handle_error(self, request, client_address):
+        # Connections cut by stop() fail in their threads; that is expected
+        if self.run:
+            HTTPServer.handle_error(self, request, client_address)
 
- 
+    def shutdown_request(self, request):
+        with self._connections_lock:
+            self._connections.discard(request)
+        HTTPServer.shutdown_request(self, request)
 
 
+handler = GraphRequestHandler
@@ -1,5 +1,24 @@
+import gzip
+import httplib
+import json
+import os
+import random
+import shutil
+import struct
+import sys
+import tempfile
+import threading
+import time
 import unittest
+from StringIO import StringIO
 from Dag2Tree import *
+from Dag2Tree import _convert_regions
+from ancestry import AncestryIndex
+from compact import CompactDAG, convert_compact
+import benchmark
+import cwl
+import http_server
+import tree_layout
 
 
 class Dag2Tree(unittest.TestCase):
@@ -19,6 +38,566 @@ class Dag2Tree(unittest.TestCase):
         G = convert(G)
         self.assertEqual(1, len([node for node in G.nodes() if not nx.ancestors(G, node)]))
 
+    def test_diamond(self):
+        G = nx.DiGraph()
+        G.add_edges_from([(1, 2), (1, 3), (2, 4), (3, 4)], type='child')
+        G = convert(G)
+        self.assertEqual({2: 'child', 3: 'child', 4: 'follow-on'}, {n: d['type'] for n, d in G.succ[1].items()})
+
+    def test_preservesOrdering(self):
+        for seed in range(25):
+            G = random_dag(30, 0.15, seed)
+            T = convert(G.copy())
+            self.assertTrue(nx.is_tree(T))
+            self.assertTrue(set(G.nodes()) <= set(T.nodes()))
+            for u, v in G.edges():
+                self.assertTrue(finishes_before(T, u, v), 'seed {}: {} must finish before {}'.format(seed, u, v))
+
+    def test_followOnEdges(self):
+        # The MRCA 0 has a follow-on 2 that is not placed when 1's parents are looked at
+        G = nx.DiGraph()
+        G.add_edge(0, 2, type='follow-on')
+        G.add_edges_from([(0, 1), (1, 2)], type='child')
+        index = AncestryIndex()
+        index.add(0)
+        index.add(1, 0)
+        self.assertEqual(0, pseudonode_anchor(G, index, [0, 1]))
+
+        for seed in range(50):
+            G = random_dag(20, 0.2, seed, follow_ons=0.3)
+            T = convert(G.copy())
+            self.assertTrue(nx.is_tree(T))
+            for u, v in G.edges():
+                self.assertTrue(finishes_before(T, u, v), 'seed {}: {} must finish before {}'.format(seed, u, v))
+
+    def test_ladder(self):
+        G = nx.DiGraph()
+        for i in range(2000):
+            G.add_edges_from([(('a', i), ('a', i + 1)), (('b', i), ('b', i + 1)), (('a', i), ('b', i + 1))],
+                             type='child')
+        T = convert(G.copy())
+        self.assertTrue(nx.is_tree(T))
+        self.assertTrue(all(finishes_before(T, u, v) for u, v in G.edges()[:50]))
+
+    def test_criticalPathPlacement(self):
+        G = nx.DiGraph()
+        G.add_edges_from([('r', 'a'), ('a', 'long'), ('a', 'b'), ('r', 'b')], type='child')
+        G.node['long']['runtime'] = 100
+        mrca = convert(G.copy())
+        critical = convert(G.copy(), placement='critical-path')
+        self.assertEqual(['a'], critical.predecessors('b'))
+        self.assertEqual(100 + 3, mrca.graph['tree_makespan'])
+        self.assertEqual(100 + 2, critical.graph['tree_makespan'])
+        self.assertEqual(100 + 2, critical.graph['dag_makespan'])
+
+    def test_criticalPathPreservesOrdering(self):
+        for seed in range(25):
+            G = random_dag(30, 0.15, seed)
+            for node in G:
+                G.node[node]['runtime'] = random.Random(node).randint(1, 20)
+            T = convert(G.copy(), placement='critical-path')
+            self.assertTrue(nx.is_tree(T))
+            self.assertLessEqual(T.graph['dag_makespan'], T.graph['tree_makespan'])
+            for u, v in G.edges():
+                self.assertTrue(finishes_before(T, u, v), 'seed {}: {} must finish before {}'.format(seed, u, v))
+
+    def test_criticalPathFollowOnEdges(self):
+        # The MRCA 0 has a follow-on 2 that is not placed when 1's parents are looked at
+        G = nx.DiGraph()
+        G.add_edge(0, 2, type='follow-on')
+        G.add_edges_from([(0, 1), (1, 2)], type='child')
+        T = convert(G, placement='critical-path')
+        self.assertTrue(finishes_before(T, 1, 2))
+
+        for seed in range(25):
+            G = random_dag(30, 0.15, seed, follow_ons=0.3)
+            for node in G:
+                G.node[node]['runtime'] = random.Random(node).randint(1, 20)
+            T = convert(G.copy(), placement='critical-path')
+            self.assertTrue(nx.is_tree(T) and one_follow_on(T))
+            self.assertLessEqual(T.graph['dag_makespan'], T.graph['tree_makespan'])
+            for u, v in G.edges():
+                self.assertTrue(finishes_before(T, u, v), 'seed {}: {} must finish before {}'.format(seed, u, v))
+
+        G = benchmark.follow_on_chain(depth=10)
+        T = convert(G.copy(), placement='critical-path')
+        self.assertTrue(all(finishes_before(T, u, v) for u, v in G.edges()))
+
+
+class Ancestry(unittest.TestCase):
+
+    def test_mrcaWhileInserting(self):
+        rng = random.Random(0)
+        index = AncestryIndex()
+        index.add(0)
+        parents = {0: None}
+        for n in range(1, 300):
+            y = rng.choice(list(parents))
+            index.add(n, y)
+            parents[n] = y
+            # Every few nodes, insert n between y and some of y's children, the way convert inserts pseudonodes
+            if n % 3 == 0:
+                for child in [c for c in parents if parents[c] == y and c != n][:2]:
+                    index.move(child, n)
+                    parents[child] = n
+
+            nodes = rng.sample(list(parents), min(3, len(parents)))
+            lineages = [lineage(parents, x) for x in nodes]
+            expected = next(a for a in lineages[0] if all(a in l for l in lineages))
+            self.assertEqual(expected, index.mrca(nodes))
+            self.assertEqual(expected in lineages[1], index.is_ancestor(expected, nodes[1]))
+            if expected != nodes[1]:
+                self.assertEqual(lineages[1][lineages[1].index(expected) - 1], index.child_toward(expected, nodes[1]))
+
+    def test_fromTree(self):
+        T = nx.balanced_tree(2, 5, create_using=nx.DiGraph())
+        index = AncestryIndex(T)
+        self.assertEqual(0, index.mrca([31, 62]))
+        self.assertEqual(1, index.mrca([15, 16, 10]))
+        self.assertEqual(3, index.parent(7))
+
+
+class Compact(unittest.TestCase):
+
+    def test_roundTrip(self):
+        G = nx.DiGraph()
+        G.add_edges_from([(1, 2), (1, 3)], type='child')
+        G.add_edge(1, 'Z0', type='follow-on')
+        G.node['Z0']['pseudo'] = True
+        dag = CompactDAG.from_networkx(G)
+        self.assertEqual(3, dag.number_of_edges())
+        self.assertTrue(dag.is_pseudo(dag.id('Z0')))
+        self.assertFalse(dag.is_pseudo(dag.id(2)))
+        H = dag.to_networkx()
+        self.assertEqual(typed_edges(G), typed_edges(H))
+        self.assertEqual(['Z0'], [n for n in H if 'pseudo' in H.node[n]])
+
+    def test_fromEdges(self):
+        for seed in range(10):
+            G = random_dag(30, 0.15, seed)
+            tree = convert_compact(CompactDAG.from_edges(G.edges(), G)).to_networkx()
+            T = convert(G)
+            self.assertEqual(typed_edges(T), typed_edges(tree))
+
+
+class Benchmark(unittest.TestCase):
+
+    def test_generators(self):
+        for generator, params in [(benchmark.layered_dag, {'layers': 5, 'width': 6}),
+                                  (benchmark.wide_diamonds, {'width': 5, 'depth': 3}),
+                                  (benchmark.follow_on_chain, {'depth': 10}),
+                                  (benchmark.scatter_gather, {'samples': 3, 'chromosomes': 4})]:
+            G = generator(**params)
+            self.assertTrue(nx.is_directed_acyclic_graph(G))
+            T = convert(G.copy())
+            self.assertTrue(nx.is_tree(T))
+            for u, v in G.edges():
+                self.assertTrue(finishes_before(T, u, v), '{}: {} must finish before {}'.format(generator, u, v))
+
+    def test_compare(self):
+        result = benchmark.run_case('case', 'diamonds', {'width': 10})
+        self.assertTrue(set(['sources', 'resolve', 'collapse']) <= set(result['phases']))
+        slower = dict(result, seconds=result['seconds'] * 2 + 1)
+        self.assertEqual([], benchmark.compare({'results': [result]}, {'results': [result]}))
+        self.assertEqual(1, len(benchmark.compare({'results': [result]}, {'results': [slower]})))
+
+
+class Incremental(unittest.TestCase):
+
+    def test_doesNotMutateInput(self):
+        G = random_dag(20, 0.2, 0)
+        edges = sorted(G.edges())
+        IncrementalConverter(G)
+        self.assertEqual(edges, sorted(G.edges()))
+
+    def test_deltasKeepTreeValid(self):
+        rng = random.Random(0)
+        for seed in range(10):
+            converter = IncrementalConverter(random_dag(15, 0.2, seed))
+            for step in range(20):
+                u = rng.choice(converter.dag.nodes() + ['new-u{}'.format(step)])
+                v = rng.choice(converter.dag.nodes() + ['new-v{}'.format(step)])
+                if u == v or u in converter.dag and v in converter.dag and nx.has_path(converter.dag, v, u):
+                    continue
+                converter.add_edge(u, v)
+                self.assertTrue(nx.is_tree(converter.tree))
+                for a, b in converter.dag.edges():
+                    self.assertTrue(finishes_before(converter.tree, a, b))
+
+    def test_newSampleIsLocal(self):
+        converter = IncrementalConverter(random_dag(200, 0.05, 1))
+        costs = [converter.add_edge(0, 'sample'), converter.add_edge('sample', 'index'),
+                 converter.add_edge('sample', 'call'), converter.add_edge('index', 'call')]
+        self.assertEqual([1, 1, 1, 1], [cost.nodes_placed for cost in costs])
+        self.assertTrue(finishes_before(converter.tree, 'index', 'call'))
+
+    def test_followOnEdges(self):
+        # Small cases come out exactly as convert makes them
+        for edges in [[(0, 2, 'follow-on'), (0, 1, 'child'), (1, 2, 'child')],
+                      [(0, 1, 'follow-on'), (0, 2, 'child'), (1, 3, 'child'), (2, 3, 'child'), (3, 4, 'follow-on'),
+                       (1, 4, 'child')]]:
+            G = nx.DiGraph()
+            converter = IncrementalConverter()
+            for u, v, edge_type in edges:
+                G.add_edge(u, v, type=edge_type)
+                converter.add_edge(u, v, type=edge_type)
+            self.assertEqual(typed_edges(convert(G)), typed_edges(converter.tree))
+
+        # 0 gets a follow-on when the pseudonode breaking 2 collapses, then another from the DAG
+        converter = IncrementalConverter()
+        for u, v, edge_type in [(0, 1, 'child'), (0, 2, 'child'), (1, 2, 'child'), (0, 3, 'follow-on')]:
+            converter.add_edge(u, v, type=edge_type)
+        self.assertTrue(one_follow_on(converter.tree))
+        self.assertTrue(all(finishes_before(converter.tree, u, v) for u, v in converter.dag.edges()))
+
+        # Larger ones keep every ordering convert keeps, from scratch and edge by edge
+        for seed in range(30):
+            G = random_dag(20, 0.2, seed, follow_ons=0.3)
+            T = convert(G.copy())
+            converter = IncrementalConverter()
+            for node in G:
+                converter.add_node(node)
+            for u, v in G.edges():
+                converter.add_edge(u, v, type=G.edge[u][v]['type'])
+            for tree in [IncrementalConverter(G).tree, converter.tree]:
+                self.assertTrue(nx.is_tree(tree) and one_follow_on(tree))
+                self.assertEqual(set(n for n in T if 'pseudo' not in T.node[n]),
+                                 set(n for n in tree if 'pseudo' not in tree.node[n]))
+                for u, v in G.edges():
+                    self.assertTrue(finishes_before(T, u, v))
+                    self.assertTrue(finishes_before(tree, u, v), 'seed {}: {} must finish before {}'.format(seed, u, v))
+
+    def test_cycle(self):
+        converter = IncrementalConverter()
+        converter.add_edge(1, 2)
+        self.assertRaises(AssertionError, converter.add_edge, 2, 1)
+
+
+class Evaluate(unittest.TestCase):
+
+    def test_respectsDagOrder(self):
+        G = nx.DiGraph()
+        G.add_edges_from([(1, 2), (1, 3), (2, 4), (3, 4), (4, 5), (1, 5)], type='child')
+        for node in G:
+            G.node[node].update(task=time.sleep, args=(0.2,))
+        timings = {}
+        evaluate(convert(G.copy()), workers=4, timings=timings)
+        for u, v in G.edges():
+            self.assertLessEqual(timings[u][1], timings[v][0])
+        # 2 and 3 are independent, so they overlap
+        self.assertLess(timings[2][0], timings[3][1])
+        self.assertLess(timings[3][0], timings[2][1])
+
+    def test_coresHint(self):
+        G = nx.DiGraph()
+        G.add_edges_from([(0, 1), (0, 2)], type='child')
+        G.node[1].update(task=time.sleep, args=(0.2,), cores=2)
+        G.node[2].update(task=time.sleep, args=(0.2,), cores=2)
+        timings = {}
+        evaluate(G, workers=2, timings=timings)
+        self.assertTrue(timings[1][1] <= timings[2][0] or timings[2][1] <= timings[1][0])
+
+    def test_results(self):
+        G = nx.DiGraph()
+        G.add_edge('a', 'b', type='follow-on')
+        G.node['a'].update(task=pow, args=(2, 3))
+        G.node['b'].update(task=abs, args=(-1,))
+        self.assertEqual({'a': 8, 'b': 1}, evaluate(G, workers=2))
+
+    def test_failure(self):
+        G = nx.DiGraph()
+        G.add_edge('a', 'b', type='child')
+        G.node['a'].update(task=int, args=('potato',))
+        G.node['b'].update(task=abs, args=(-1,))
+        self.assertRaises(RuntimeError, evaluate, G, workers=2)
+
+
+def lineage(parents, node):
+    nodes = []
+    while node is not None:
+        nodes.append(node)
+        node = parents[node]
+    return nodes
+
+
+def one_follow_on(T):
+    return all(sum(data['type'] == 'follow-on' for data in T.succ[n].values()) <= 1 for n in T)
+
+
+def typed_edges(G):
+    return set((u, v, data['type']) for u, v, data in G.edges_iter(data=True))
+
+
+class TreeLayout(unittest.TestCase):
+
+    def test_subtreesAreContiguous(self):
+        T = convert(benchmark.scatter_gather(3, 4))
+        arrays, labels = tree_layout.tree_layout(T)
+        self.assertEqual(len(T), len(labels))
+        index = {label: i for i, label in enumerate(labels)}
+        for node in T:
+            i = index[str(node)]
+            descendants = set(index[str(d)] for d in nx.descendants(T, node))
+            self.assertEqual(set(range(i + 1, i + arrays['size'][i])), descendants)
+            self.assertTrue(arrays['xmin'][i] <= arrays['x'][i] <= arrays['xmax'][i])
+            for d in descendants:
+                self.assertTrue(arrays['xmin'][i] <= arrays['x'][d] <= arrays['xmax'][i])
+                self.assertLessEqual(arrays['depth'][d], arrays['bottom'][i])
+            for child in T.successors(node):
+                self.assertEqual(i, arrays['parent'][index[str(child)]])
+                follow_on = T[node][child]['type'] == 'follow-on'
+                self.assertEqual(follow_on, bool(arrays['flags'][index[str(child)]] & tree_layout.FOLLOW_ON))
+            self.assertEqual(bool(T.node[node].get('pseudo')), bool(arrays['flags'][i] & tree_layout.PSEUDO))
+
+    def test_write(self):
+        T = convert(benchmark.follow_on_chain(10))
+        directory = tempfile.mkdtemp()
+        try:
+            header = tree_layout.write_tree(T, directory, chunk_size=7)
+            self.assertEqual(header, json.load(open(os.path.join(directory, 'tree.json'))))
+            data = open(os.path.join(directory, 'tree.bin'), 'rb').read()
+            size = header['arrays']['size']
+            self.assertEqual(0, size['offset'] % 4)
+            self.assertEqual(len(T), struct.unpack_from('<i', data, size['offset'])[0])
+            labels = sum([json.load(open(os.path.join(directory, 'labels', '{}.json'.format(k))))
+                          for k in range(header['labels']['chunks'])], [])
+            self.assertEqual(sorted(str(n) for n in T), sorted(labels))
+        finally:
+            shutil.rmtree(directory)
+
+
+class CWL(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        tool = {'class': 'CommandLineTool', 'inputs': [{'id': 'input', 'type': 'File'}],
+                'outputs': [{'id': 'output', 'type': 'File'}]}
+        self.write('tool.cwl', tool)
+        self.write('calls.cwl', {
+            'class': 'Workflow',
+            'inputs': {'bam': 'File', 'chromosome': 'string'},
+            'steps': {'index': {'run': 'tool.cwl', 'in': {'input': 'bam'}, 'out': ['output']},
+                      'call': {'run': 'tool.cwl', 'in': {'input': 'index/output', 'region': 'chromosome'},
+                               'out': ['output']}}})
+        self.write('main.cwl', {
+            'class': 'Workflow',
+            'inputs': [{'id': 'reference', 'type': 'File'}, {'id': 'bam', 'type': 'File'},
+                       {'id': 'chromosomes', 'type': 'string[]'}, {'id': 'mode', 'default': 'fast'}],
+            'steps': [{'id': 'report', 'run': 'tool.cwl', 'in': [{'id': 'input', 'source': ['merge/output']}],
+                       'out': ['output']},
+                      {'id': 'reference_index', 'run': 'tool.cwl', 'in': [{'id': 'input', 'source': 'reference'}],
+                       'out': ['output']},
+                      {'id': 'per_chromosome', 'run': 'calls.cwl', 'scatter': 'chromosome',
+                       'in': [{'id': 'bam', 'source': 'bam'}, {'id': 'chromosome', 'source': 'chromosomes'}],
+                       'out': ['output']},
+                      {'id': 'merge', 'run': 'tool.cwl', 'out': ['output'],
+                       'in': [{'id': 'input', 'source': ['per_chromosome/output', 'reference_index/output']},
+                              {'id': 'mode', 'source': 'mode'}]}]})
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def write(self, name, document):
+        with open(os.path.join(self.dir, name), 'w') as f:
+            json.dump(document, f)
+        return os.path.join(self.dir, name)
+
+    def job(self, n):
+        return {'reference': {'class': 'File', 'path': 'ref.fa'}, 'bam': {'class': 'File', 'path': 'sample.bam'},
+                'chromosomes': ['chr{}'.format(i) for i in range(1, n + 1)]}
+
+    def test_scatterAndNesting(self):
+        G = cwl_to_dag(os.path.join(self.dir, 'main.cwl'), self.job(3))
+        self.assertTrue(nx.is_directed_acyclic_graph(G))
+        for i in range(3):
+            index, call = 'per_chromosome[{}]/index'.format(i), 'per_chromosome[{}]/call'.format(i)
+            self.assertEqual({'input': {'class': 'File', 'path': 'sample.bam'}}, G.node[index]['job'])
+            self.assertEqual('chr{}'.format(i + 1), G.node[call]['job']['region'])
+            self.assertEqual({'source': index, 'output': 'output'}, G.node[call]['job']['input'])
+            self.assertTrue(G.has_edge(index, call))
+            self.assertTrue(G.has_edge(call, 'per_chromosome'))
+        for u, v in [('per_chromosome', 'merge'), ('reference_index', 'merge'), ('merge', 'report')]:
+            self.assertTrue(G.has_edge(u, v))
+        self.assertEqual('fast', G.node['merge']['job']['mode'])
+        self.assertEqual('tool.cwl', G.node['merge']['tool'])
+        self.assertIn('tool.cwl', G.graph['tools'])
+        self.assertTrue(nx.is_tree(convert(G)))
+
+    def test_packedAndSingleTool(self):
+        packed = {'$graph': [{'class': 'CommandLineTool', 'id': '#sort', 'inputs': [{'id': '#sort/input'}]},
+                             {'class': 'Workflow', 'id': '#main', 'inputs': [{'id': '#main/files'}],
+                              'steps': [{'id': '#main/sort', 'run': '#sort', 'scatter': '#main/sort/input',
+                                         'in': [{'id': '#main/sort/input', 'source': '#main/files'}],
+                                         'out': ['#main/sort/output']},
+                                        {'id': '#main/cat', 'run': '#sort',
+                                         'in': [{'id': '#main/cat/input', 'source': '#main/sort/output'}],
+                                         'out': ['#main/cat/output']}]}]}
+        G = cwl_to_dag(self.write('packed.cwl', packed), {'files': ['a', 'b']})
+        self.assertEqual(set(['sort[0]', 'sort[1]', 'sort', 'cat']), set(G))
+        self.assertEqual('b', G.node['sort[1]']['job']['input'])
+        self.assertEqual((1,), G.node['sort[1]']['scatter_index'])
+
+        G = cwl_to_dag(os.path.join(self.dir, 'tool.cwl'), {'input': 'x'})
+        self.assertEqual({'tool': {'step': 'tool', 'tool': 'tool.cwl#tool', 'job': {'input': 'x'}}}, G.node)
+
+    def test_cache(self):
+        cache = os.path.join(self.dir, 'cache')
+        main = os.path.join(self.dir, 'main.cwl')
+        parse = cwl._parse
+        expected = typed_edges(cwl_to_tree(main, self.job(4)))
+        T = cwl_to_tree(main, self.job(4), cache_dir=cache)
+        self.assertEqual(expected, typed_edges(T))
+
+        # Another sample with as many chromosomes is neither parsed nor converted, only bound
+        module = sys.modules[cwl_to_tree.__module__]
+        try:
+            cwl._parse = module.convert = None
+            job = dict(self.job(4), chromosomes=['chrX', 'chrY', 'chrM', 'chr1'])
+            T = cwl_to_tree(main, job, cache_dir=cache)
+        finally:
+            cwl._parse, module.convert = parse, convert
+        self.assertEqual(expected, typed_edges(T))
+        self.assertEqual('chrM', T.node['per_chromosome[2]/call']['job']['region'])
+
+        # A different shape, or a changed document, is converted afresh
+        self.assertEqual(6, len([n for n in cwl_to_tree(main, self.job(6), cache_dir=cache) if '/call' in str(n)]))
+        with open(os.path.join(self.dir, 'calls.cwl')) as f:
+            calls = json.load(f)
+        del calls['steps']['index']
+        calls['steps']['call']['in']['input'] = 'bam'
+        self.write('calls.cwl', calls)
+        self.assertNotIn('per_chromosome[0]/index', cwl_to_tree(main, self.job(4), cache_dir=cache))
+
+    def test_deferredScatter(self):
+        workflow = {'class': 'Workflow', 'inputs': {'bam': 'File'},
+                    'steps': {'split': {'run': 'tool.cwl', 'in': {'input': 'bam'}, 'out': ['output']},
+                              'call': {'run': 'tool.cwl', 'scatter': 'input', 'in': {'input': 'split/output'},
+                                       'out': ['output']}}}
+        G = cwl_to_dag(self.write('deferred.cwl', workflow), {'bam': 'x'})
+        self.assertEqual(['input'], G.node['call']['scatter'])
+        self.assertEqual([('split', 'call')], G.edges())
+
+
+class Parallel(unittest.TestCase):
+
+    def test_regions(self):
+        G = benchmark.scatter_gather(10, 2)
+        head, tail, regions = shared_regions(G, hub_degree=8)
+        self.assertEqual(set(['reference', 'reference.fai', 'reference.dict']), head)
+        self.assertEqual(set(['report']), tail)
+        self.assertEqual(10, len(regions))
+        self.assertIsNone(shared_regions(benchmark.follow_on_chain(10)))
+
+    def test_stitchedTreeKeepsOrder(self):
+        for G in [benchmark.scatter_gather(40, 3), benchmark.wide_diamonds(50), random_dag(30, 0.05, 2)]:
+            for placement in ('mrca', 'critical-path'):
+                timings = {}
+                T = _convert_regions(G.copy(), shared_regions(G), placement, 'runtime', timings, 2)
+                self.assertTrue(nx.is_tree(T))
+                self.assertIn('stitch', timings)
+                self.assertEqual(set(G), set(n for n in T if 'pseudo' not in T.node[n] and n != 'S'))
+                for u, v in G.edges():
+                    self.assertTrue(finishes_before(T, u, v), '{} must finish before {}'.format(u, v))
+
+    def test_serialFallback(self):
+        # Small DAGs, and more processes than cores, convert in this process
+        G = benchmark.scatter_gather(10, 2)
+        self.assertLess(len(G), PARALLEL_MIN_NODES)
+        timings = {}
+        convert(G, timings=timings, processes=2)
+        self.assertIn('resolve', timings)
+        self.assertNotIn('regions', timings)
+
+        G = benchmark.scatter_gather(PARALLEL_MIN_NODES // 20, 24)
+        timings = {}
+        convert(G, timings=timings, processes=multiprocessing.cpu_count() + 1)
+        self.assertIn('resolve' if multiprocessing.cpu_count() == 1 else 'stitch', timings)
+
+
+class HTTP(unittest.TestCase):
+
+    def setUp(self):
+        self.cwd, self.dir = os.getcwd(), tempfile.mkdtemp()
+        self.data = json.dumps([{'id': i, 'name': 'node{}'.format(i)} for i in range(2000)])
+        with open(os.path.join(self.dir, 'graph.json'), 'w') as f:
+            f.write(self.data)
+        os.chdir(self.dir)
+        http_server.GraphRequestHandler.quiet = True
+        self.server = http_server.StoppableHTTPServer(('127.0.0.1', 0), http_server.GraphRequestHandler)
+        self.thread = threading.Thread(target=self.server.serve)
+        self.thread.start()
+        self.connection = httplib.HTTPConnection('127.0.0.1', self.server.server_address[1])
+
+    def tearDown(self):
+        self.connection.close()
+        self.server.stop()
+        self.thread.join()
+        os.chdir(self.cwd)
+        shutil.rmtree(self.dir)
+
+    def get(self, **headers):
+        self.connection.request('GET', '/graph.json', headers=headers)
+        response = self.connection.getresponse()
+        return response, response.read()
+
+    def test_gzipAndRevalidation(self):
+        response, body = self.get(**{'Accept-Encoding': 'gzip'})
+        self.assertEqual('gzip', response.getheader('Content-Encoding'))
+        self.assertEqual(self.data, gzip.GzipFile(fileobj=StringIO(body)).read())
+        response, body = self.get(**{'Accept-Encoding': 'gzip', 'If-None-Match': response.getheader('ETag')})
+        self.assertEqual((304, ''), (response.status, body))
+
+        response, body = self.get()
+        self.assertEqual((200, self.data), (response.status, body))
+        os.utime('graph.json', (time.time() + 10, time.time() + 10))
+        self.assertEqual(200, self.get(**{'If-None-Match': response.getheader('ETag')})[0].status)
+
+    def test_ranges(self):
+        response, body = self.get(Range='bytes=10-19')
+        self.assertEqual((206, self.data[10:20]), (response.status, body))
+        self.assertEqual('bytes 10-19/{}'.format(len(self.data)), response.getheader('Content-Range'))
+        self.assertEqual(self.data[-7:], self.get(Range='bytes=-7')[1])
+        self.assertEqual(416, self.get(Range='bytes={}-'.format(len(self.data)))[0].status)
+
+    def test_stopsAtOnce(self):
+        self.get()
+        start = time.time()
+        self.server.stop()
+        self.thread.join()
+        self.assertLess(time.time() - start, 0.5)
+
+
+def random_dag(n, p, seed, follow_ons=0.0):
+    """
+    :param follow_ons: Chance of an edge being a follow-on, for nodes that have none yet.  jobTree gives each target
+                       one follow-on.
+    """
+    G = nx.gnp_random_graph(n, p, seed=seed, directed=True)
+    rng = random.Random(seed)
+    D = nx.DiGraph()
+    D.add_nodes_from(G)
+    for u, v in sorted(G.edges()):
+        if u < v:
+            follow = rng.random() < follow_ons and follow_on(D, u) is None
+            D.add_edge(u, v, type='follow-on' if follow else 'child')
+    return D
+
+
+def finishes_before(T, u, v):
+    """
+    True if jobTree finishes u before it starts v in tree T.
+    """
+    if v in nx.descendants(T, u):
+        return True
+    child = u
+    while T.pred[child]:
+        parent = T.predecessors(child)[0]
+        f = follow_on(T, parent)
+        if T.edge[parent][child]['type'] == 'child' and f is not None and (f == v or v in nx.descendants(T, f)):
+            return True
+        child = parent
+    return False
+
 
 def main():
     unittest.main()
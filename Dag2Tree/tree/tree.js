@@ -0,0 +1,217 @@
+// Canvas renderer of the layout written by tree_layout.write_tree.
+//
+// Nodes are in depth-first preorder, so the subtree of node i is [i, i + size[i]).  A subtree that is off screen,
+// narrower than LOD_PX or collapsed is skipped in one step and, unless off screen, drawn as a wedge, so a frame costs
+// what is visible rather than the size of the tree.  Labels are fetched chunk by chunk, only for nodes that need them.
+
+var PSEUDO = 1,
+    FOLLOW_ON = 2,
+    LOD_PX = 3,          // Subtrees narrower than this are drawn as a wedge
+    LABEL_NODES = 400,   // Labels are drawn once no more nodes than this are on screen
+    MARGIN = 20;
+
+var canvas = document.getElementById("chart"),
+    ctx = canvas.getContext("2d"),
+    tooltip = document.getElementById("tooltip"),
+    statusBar = document.getElementById("status"),
+    collapsePseudo = document.getElementById("collapse-pseudo");
+
+var tree,                // Header from tree.json, with its arrays
+    collapsed,           // Nodes collapsed by a click
+    labels = [],         // Loaded label chunks; null while one is in flight
+    view = {kx: 1, ky: 1, tx: 0, ty: 0},
+    shown = [],          // Nodes drawn in the last frame, for hit testing
+    pending = false;
+
+function get(url, type, callback) {
+  var xhr = new XMLHttpRequest();
+  xhr.open("GET", url);
+  xhr.responseType = type;
+  xhr.onload = function() { callback(xhr.response); };
+  xhr.send();
+}
+
+get("tree.json", "json", function(header) {
+  get("tree.bin", "arraybuffer", function(buffer) {
+    tree = header;
+    for (var name in header.arrays) {
+      var a = header.arrays[name];
+      tree[name] = new window[a.type](buffer, a.offset, a.length);
+    }
+    collapsed = new Uint8Array(tree.count);
+    statusBar.textContent = tree.count + " nodes, " + tree.levels + " levels";
+    resize();
+    fit();
+  });
+});
+
+function sx(x) { return x * view.kx + view.tx; }
+function sy(depth) { return depth * view.ky + view.ty; }
+
+function fit() {
+  view.kx = canvas.width / Math.max(tree.width, 1);
+  view.ky = (canvas.height - 2 * MARGIN - 20) / Math.max(tree.levels - 1, 1);
+  view.tx = view.kx / 2;
+  view.ty = MARGIN + 20;
+  redraw();
+}
+
+function resize() {
+  canvas.width = window.innerWidth;
+  canvas.height = window.innerHeight;
+  redraw();
+}
+
+function redraw() {
+  if (!pending && tree) {
+    pending = true;
+    window.requestAnimationFrame(draw);
+  }
+}
+
+function label(i) {
+  var k = Math.floor(i / tree.labels.chunk_size), chunk = labels[k];
+  if (chunk) return chunk[i - k * tree.labels.chunk_size];
+  if (chunk === undefined) {
+    labels[k] = null;
+    get("labels/" + k + ".json", "json", function(data) { labels[k] = data; redraw(); });
+  }
+  return null;
+}
+
+function draw() {
+  pending = false;
+  var w = canvas.width, h = canvas.height,
+      x = tree.x, xmin = tree.xmin, xmax = tree.xmax, depth = tree.depth, bottom = tree.bottom,
+      parent = tree.parent, size = tree.size, flags = tree.flags,
+      collapsePseudoNodes = collapsePseudo.checked,
+      edges = [], followOns = [], nodes = [], pseudonodes = [], wedges = [];
+
+  shown = [];
+  for (var i = 0, n = tree.count; i < n;) {
+    var left = sx(xmin[i]), right = sx(xmax[i]), top = sy(depth[i]);
+    if (right < -MARGIN || left > w + MARGIN || top > h + MARGIN) {
+      i += size[i];
+      continue;
+    }
+    var p = parent[i];
+    if (p >= 0) (flags[i] & FOLLOW_ON ? followOns : edges).push(sx(x[p]), sy(depth[p]), sx(x[i]), top);
+    (flags[i] & PSEUDO ? pseudonodes : nodes).push(sx(x[i]), top);
+    shown.push(i);
+    if (size[i] > 1 && (collapsed[i] || (collapsePseudoNodes && flags[i] & PSEUDO) || right - left < LOD_PX)) {
+      wedges.push(sx(x[i]), top, left, right, sy(bottom[i]));
+      i += size[i];
+    } else {
+      i += 1;
+    }
+  }
+
+  ctx.clearRect(0, 0, w, h);
+  ctx.lineWidth = 1;
+  ctx.fillStyle = "rgba(153, 153, 153, .5)";
+  ctx.beginPath();
+  for (var j = 0; j < wedges.length; j += 5) {
+    ctx.moveTo(wedges[j], wedges[j + 1]);
+    ctx.lineTo(wedges[j + 2], wedges[j + 4]);
+    ctx.lineTo(Math.max(wedges[j + 3], wedges[j + 2] + 1), wedges[j + 4]);
+    ctx.closePath();
+  }
+  ctx.fill();
+  strokeSegments(edges, "#999");
+  strokeSegments(followOns, "red");
+
+  var r = Math.max(1, Math.min(5, view.kx / 4));
+  fillPoints(nodes, "red", r);
+  fillPoints(pseudonodes, "black", r);
+
+  if (shown.length <= LABEL_NODES) {
+    ctx.fillStyle = "black";
+    for (j = 0; j < shown.length; j++) {
+      var k = shown[j], text = label(k);
+      if (text !== null && !(flags[k] & PSEUDO)) ctx.fillText(text, sx(x[k]) + r + 2, sy(depth[k]) - r);
+    }
+  }
+}
+
+function strokeSegments(segments, colour) {
+  ctx.strokeStyle = colour;
+  ctx.beginPath();
+  for (var j = 0; j < segments.length; j += 4) {
+    ctx.moveTo(segments[j], segments[j + 1]);
+    ctx.lineTo(segments[j + 2], segments[j + 3]);
+  }
+  ctx.stroke();
+}
+
+function fillPoints(points, colour, r) {
+  ctx.fillStyle = colour;
+  ctx.beginPath();
+  for (var j = 0; j < points.length; j += 2) ctx.rect(points[j] - r, points[j + 1] - r, 2 * r, 2 * r);
+  ctx.fill();
+}
+
+// Node drawn in the last frame nearest to a point, if it is within 8px
+function nodeAt(px, py) {
+  var best = -1, bestDistance = 64;
+  for (var j = 0; j < shown.length; j++) {
+    var i = shown[j], dx = sx(tree.x[i]) - px, dy = sy(tree.depth[i]) - py, d = dx * dx + dy * dy;
+    if (d < bestDistance) { best = i; bestDistance = d; }
+  }
+  return best;
+}
+
+var drag = null;
+
+canvas.addEventListener("mousedown", function(e) {
+  drag = {x: e.clientX, y: e.clientY, tx: view.tx, ty: view.ty, moved: false};
+});
+
+window.addEventListener("mouseup", function(e) {
+  if (drag && !drag.moved && tree) {
+    var i = nodeAt(e.clientX, e.clientY);
+    if (i >= 0 && tree.size[i] > 1) {
+      collapsed[i] = !collapsed[i];
+      redraw();
+    }
+  }
+  drag = null;
+});
+
+canvas.addEventListener("mousemove", function(e) {
+  if (!tree) return;
+  if (drag) {
+    drag.moved = drag.moved || Math.abs(e.clientX - drag.x) + Math.abs(e.clientY - drag.y) > 3;
+    view.tx = drag.tx + e.clientX - drag.x;
+    view.ty = drag.ty + e.clientY - drag.y;
+    redraw();
+    return;
+  }
+  var i = nodeAt(e.clientX, e.clientY);
+  if (i < 0) {
+    tooltip.style.display = "none";
+    return;
+  }
+  var text = label(i);
+  tooltip.textContent = (text === null ? "#" + i : text) + (tree.flags[i] & PSEUDO ? " (pseudonode)" : "") +
+      (tree.size[i] > 1 ? ", " + (tree.size[i] - 1) + " descendants" : "");
+  tooltip.style.left = e.clientX + 12 + "px";
+  tooltip.style.top = e.clientY + 12 + "px";
+  tooltip.style.display = "block";
+});
+
+// The wheel zooms about the pointer; with shift held, only horizontally
+canvas.addEventListener("wheel", function(e) {
+  e.preventDefault();
+  var k = Math.pow(1.002, -e.deltaY);
+  view.tx = e.clientX - (e.clientX - view.tx) * k;
+  view.kx *= k;
+  if (!e.shiftKey) {
+    view.ty = e.clientY - (e.clientY - view.ty) * k;
+    view.ky *= k;
+  }
+  redraw();
+});
+
+collapsePseudo.addEventListener("change", redraw);
+document.getElementById("fit").addEventListener("click", function() { if (tree) fit(); });
+window.addEventListener("resize", resize);
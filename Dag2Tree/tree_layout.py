@@ -0,0 +1,129 @@
+"""
+Hierarchical layout of converted trees, and its compact serialization for the canvas renderer in tree/
+
+Nodes are numbered in depth-first preorder, so the subtree of node i is the range [i, i + size[i]).  The renderer
+relies on that to skip whole subtrees that are off screen, too small to draw or collapsed, without visiting them.
+
+    python tree_visualization.py --generator scatter-gather
+
+Output, in the directory given to write_tree:
+
+    tree.json           Header: node count, extent, and the offset and type of every array in tree.bin
+    tree.bin            Little-endian typed arrays, one value per node
+    labels/<k>.json     Node labels, chunk_size per file, fetched by the renderer only when needed
+"""
+import json
+import os
+import sys
+from array import array
+
+# Bits of the flags array
+PSEUDO = 1
+FOLLOW_ON = 2
+
+# name: (array typecode, JavaScript typed array) of every array in tree.bin
+ARRAYS = [('x', 'f', 'Float32Array'),        # Horizontal position, in leaf widths
+          ('xmin', 'f', 'Float32Array'),     # Horizontal extent of the node's subtree
+          ('xmax', 'f', 'Float32Array'),
+          ('depth', 'i', 'Int32Array'),      # Vertical position
+          ('bottom', 'i', 'Int32Array'),     # Depth of the deepest node of the subtree
+          ('parent', 'i', 'Int32Array'),     # Index of the parent, -1 for roots
+          ('size', 'i', 'Int32Array'),       # Nodes in the subtree, the node included
+          ('flags', 'B', 'Uint8Array')]      # PSEUDO, and FOLLOW_ON if the edge from the parent is a follow-on
+
+
+def tree_layout(T):
+    """
+    Lays a tree, or a forest, out in layers: leaves one unit apart in depth-first order, each parent centred over its
+    children and each node at its depth.  Children are placed before follow-ons, which run after them.
+
+    :param T: Tree from Dag2Tree.convert
+    :returns: ({name: array} for every name in ARRAYS, [label of every node]), in preorder
+    """
+    order, parent, depth, flags = [], [], [], []
+    index = {}
+    roots = [n for n in T if T.in_degree(n) == 0]
+    stack = [(root, -1, 0, 0) for root in reversed(roots)]
+    while stack:
+        node, p, d, edge = stack.pop()
+        index[node] = len(order)
+        order.append(node)
+        parent.append(p)
+        depth.append(d)
+        flags.append(edge | (PSEUDO if T.node[node].get('pseudo') else 0))
+        successors = sorted(T.successors(node), key=lambda c: T[node][c].get('type') == 'follow-on')
+        for child in reversed(successors):
+            follow_on = FOLLOW_ON if T[node][child].get('type') == 'follow-on' else 0
+            stack.append((child, index[node], d + 1, follow_on))
+
+    if len(order) != len(T):
+        raise RuntimeError('Graph is not a tree: {} of {} nodes are reachable from its roots'.format(len(order), len(T)))
+
+    n = len(order)
+    size = [1] * n
+    bottom = list(depth)
+    x = [0.0] * n
+    xmin = [None] * n
+    xmax = [None] * n
+
+    # Leaves in preorder are left to right
+    leaf = 0
+    for i in xrange(n):
+        if i + 1 == n or parent[i + 1] != i:
+            x[i] = xmin[i] = xmax[i] = float(leaf)
+            leaf += 1
+
+    # Children come after their parent in preorder, so one pass backwards sees every subtree complete
+    for i in xrange(n - 1, -1, -1):
+        if size[i] > 1:
+            x[i] = (xmin[i] + xmax[i]) / 2.0
+        p = parent[i]
+        if p >= 0:
+            size[p] += size[i]
+            bottom[p] = max(bottom[p], bottom[i])
+            xmin[p] = xmin[i] if xmin[p] is None else min(xmin[p], xmin[i])
+            xmax[p] = xmax[i] if xmax[p] is None else max(xmax[p], xmax[i])
+
+    columns = {'x': x, 'xmin': xmin, 'xmax': xmax, 'depth': depth, 'bottom': bottom, 'parent': parent, 'size': size,
+               'flags': flags}
+    arrays = {name: array(typecode, columns[name]) for name, typecode, _ in ARRAYS}
+    return arrays, [str(node) for node in order]
+
+
+def write_tree(T, directory, chunk_size=10000):
+    """
+    Writes the layout of T for the renderer in tree/.
+    :returns: The header written to tree.json
+    """
+    arrays, labels = tree_layout(T)
+    n = len(labels)
+    header = {'count': n,
+              'width': int(max(arrays['xmax'])) + 1 if n else 0,
+              'levels': max(arrays['bottom']) + 1 if n else 0,
+              'arrays': {},
+              'labels': {'chunk_size': chunk_size, 'chunks': (n + chunk_size - 1) // chunk_size}}
+
+    with open(os.path.join(directory, 'tree.bin'), 'wb') as f:
+        offset = 0
+        for name, _, js_type in ARRAYS:
+            data = arrays[name]
+            if sys.byteorder == 'big':
+                data.byteswap()
+            # Typed arrays need offsets that are a multiple of their element size
+            padding = -offset % 4
+            f.write('\0' * padding)
+            offset += padding
+            data.tofile(f)
+            header['arrays'][name] = {'type': js_type, 'offset': offset, 'length': len(data)}
+            offset += len(data) * data.itemsize
+
+    label_dir = os.path.join(directory, 'labels')
+    if not os.path.isdir(label_dir):
+        os.makedirs(label_dir)
+    for k in xrange(header['labels']['chunks']):
+        with open(os.path.join(label_dir, '{}.json'.format(k)), 'w') as f:
+            json.dump(labels[k * chunk_size:(k + 1) * chunk_size], f)
+
+    with open(os.path.join(directory, 'tree.json'), 'w') as f:
+        json.dump(header, f)
+    return header
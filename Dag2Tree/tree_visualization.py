@@ -0,0 +1,72 @@
+"""
+Tree view of a converted DAG, for graphs too large for the force layout of d3_graph_visualization.py
+
+The DAG is converted, laid out as a tree by tree_layout and written to tree/, where tree.html draws it on a canvas.
+Without arguments it shows the example graph of d3_graph_visualization.py.
+
+    python tree_visualization.py --generator scatter-gather --param samples=500
+    python tree_visualization.py --edges workflow.tsv
+
+An edge list has one edge per line: parent, child and, optionally, its type (child or follow-on), separated by tabs.
+"""
+import argparse
+import os
+
+import networkx as nx
+
+import http_server
+from Dag2Tree import convert
+from benchmark import GENERATORS
+from tree_layout import write_tree
+
+
+def read_edges(path):
+    G = nx.DiGraph()
+    with open(path) as f:
+        for line in f:
+            if not line.strip() or line.startswith('#'):
+                continue
+            fields = line.rstrip('\n').split('\t')
+            if len(fields) not in (2, 3):
+                raise RuntimeError('Expected parent, child and an optional type: {!r}'.format(line))
+            G.add_edge(fields[0], fields[1], type=fields[2] if len(fields) == 3 else 'child')
+    return G
+
+
+def example_graph():
+    G = nx.DiGraph()
+    G.add_edges_from([(1, 2), (1, 8), (1, 9), (2, 3), (2, 5), (9, 5), (8, 6), (5, 6), (3, 4), (6, 7), (6, 4)],
+                     type='child')
+    return G
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    source = parser.add_mutually_exclusive_group()
+    source.add_argument('--edges', help='Tab-separated edge list of the DAG')
+    source.add_argument('--generator', choices=sorted(GENERATORS), help='Generate the DAG with a benchmark generator')
+    parser.add_argument('--param', action='append', default=[], metavar='NAME=VALUE',
+                        help='Integer parameter of the generator.  Repeatable.')
+    parser.add_argument('--chunk_size', type=int, default=10000, help='Node labels per file')
+    parser.add_argument('--no_serve', action='store_true', help='Only write the files in tree/')
+    args = parser.parse_args()
+
+    if args.edges:
+        G = read_edges(args.edges)
+    elif args.generator:
+        params = dict(p.split('=', 1) for p in args.param)
+        G = GENERATORS[args.generator](**{name: int(value) for name, value in params.items()})
+    else:
+        G = example_graph()
+
+    T = convert(G)
+    directory = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'tree')
+    header = write_tree(T, directory, chunk_size=args.chunk_size)
+    print('Wrote the layout of {} nodes to {}'.format(header['count'], directory))
+    if not args.no_serve:
+        os.chdir(os.path.dirname(os.path.abspath(__file__)))
+        http_server.load_url('tree/tree.html')
+
+
+if __name__ == '__main__':
+    main()
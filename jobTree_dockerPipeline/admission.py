@@ -0,0 +1,126 @@
+"""
+Host-local admission control for containers
+
+jobTree packs targets from one or several pipeline runs onto a host without knowing what their containers need.  Every
+container launch reserves its declared cores and memory in a ledger shared by all the processes on the host, and waits
+in line until they are free, so containers never oversubscribe the host.
+
+    state_dir/<hostname>.json   Reservations running, and requests waiting in arrival order
+    state_dir/<hostname>.lock   flock'd while the ledger is read or changed
+
+Reservations of processes that died are dropped, so a killed target never holds resources.
+"""
+import errno
+import fcntl
+import json
+import multiprocessing
+import os
+import socket
+import time
+import uuid
+from contextlib import contextmanager
+
+from files import mkdir_p
+
+
+def physical_memory():
+    """
+    :returns: Memory of the host in GB
+    """
+    return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES') / float(1024 ** 3)
+
+
+class AdmissionController(object):
+    """
+    Queues container launches on one host until the cores and memory they declare are free.
+    """
+    def __init__(self, state_dir, cpus=None, memory=None, poll=1.0):
+        """
+        :param state_dir: Directory of the ledger.  Every process sharing the host must use the same one.
+        :param cpus: Cores that containers may use in total.  Defaults to every core of the host.
+        :param memory: Memory in GB that containers may use in total.  Defaults to all the memory of the host.
+        :param poll: Seconds between checks while waiting
+        """
+        self.state_dir = state_dir
+        self.cpus = cpus or multiprocessing.cpu_count()
+        self.memory = memory or physical_memory()
+        self.poll = poll
+        host = socket.gethostname()
+        self.ledger = os.path.join(state_dir, host + '.json')
+        self.lock = os.path.join(state_dir, host + '.lock')
+
+    @contextmanager
+    def reserve(self, cpus, memory):
+        """
+        Waits until cpus cores and memory GB are free, and holds them for the duration of the block.
+        A request larger than the host is capped to the host, so it runs alone rather than never.
+        """
+        request = {'pid': os.getpid(), 'cpus': min(cpus, self.cpus), 'memory': min(memory, self.memory)}
+        token = str(uuid.uuid4())
+        with self._ledger() as ledger:
+            ledger['waiting'].append([token, request])
+        try:
+            while not self._admit(token):
+                time.sleep(self.poll)
+            yield
+        finally:
+            with self._ledger() as ledger:
+                ledger['running'].pop(token, None)
+                ledger['waiting'] = [w for w in ledger['waiting'] if w[0] != token]
+
+    def usage(self):
+        """
+        :returns: (cores, memory in GB) reserved by running containers
+        """
+        with self._ledger() as ledger:
+            running = ledger['running'].values()
+        return sum(r['cpus'] for r in running), sum(r['memory'] for r in running)
+
+    def _admit(self, token):
+        """
+        Admits the request of token if it is first in line and fits.  Strict arrival order keeps large requests from
+        being starved by a stream of small ones.
+        """
+        with self._ledger() as ledger:
+            if not ledger['waiting'] or ledger['waiting'][0][0] != token:
+                return False
+            request = ledger['waiting'][0][1]
+            running = ledger['running'].values()
+            if running and (sum(r['cpus'] for r in running) + request['cpus'] > self.cpus or
+                            sum(r['memory'] for r in running) + request['memory'] > self.memory):
+                return False
+            ledger['waiting'].pop(0)
+            ledger['running'][token] = request
+            return True
+
+    @contextmanager
+    def _ledger(self):
+        """
+        Yields the ledger, locked, with the entries of dead processes removed, and saves it afterwards.
+        """
+        mkdir_p(self.state_dir)
+        with open(self.lock, 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                try:
+                    with open(self.ledger) as f:
+                        ledger = json.load(f)
+                except (IOError, ValueError):
+                    ledger = {'running': {}, 'waiting': []}
+                ledger['running'] = {t: r for t, r in ledger['running'].items() if _alive(r['pid'])}
+                ledger['waiting'] = [w for w in ledger['waiting'] if _alive(w[1]['pid'])]
+                yield ledger
+                tmp = self.ledger + '.tmp'
+                with open(tmp, 'w') as f:
+                    json.dump(ledger, f)
+                os.rename(tmp, self.ledger)
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError as e:
+        return e.errno == errno.EPERM
+    return True
@@ -0,0 +1,119 @@
+"""
+Warm containers for tool calls
+
+Instead of a fresh `docker run` per call, each tool image gets one long-lived container per work_dir, with the
+work_dir mounted at /data, and commands run in it with `docker exec`.  That takes container creation and volume
+mounting out of every call after the first.
+
+Containers are named after the work_dir, image and resource limits, so every target process on a host finds the same
+ones.  They are started with the limits of one call: concurrent calls of a tool share its container's limits, so
+together they never use more than one call declared.  A container is checked, and started if need be, under a flock
+per host and container, so one target never replaces a container another just started.  Containers keep themselves
+alive with `sleep` for a limited lifetime and are started with --rm, so containers left behind by a run that never
+reached its cleanup go away on their own.
+
+    state_dir/.pool.<hostname>.<container name>.lock   flock'd while the container is checked and started
+
+Calls run with docker exec share their container's cgroup, so unlike `docker run` they report no peak memory or CPU
+time of their own.
+"""
+import hashlib
+import os
+import socket
+import subprocess
+
+from files import flocked, mkdir_p
+
+
+class ContainerPool(object):
+    """
+    One running container per tool image, shared by the targets on a host.
+    """
+    def __init__(self, work_dir, docker=('sudo', 'docker'), lifetime=24 * 3600, state_dir=None):
+        """
+        :param work_dir: Directory mounted at /data in every container
+        :param docker: Command that runs the docker CLI
+        :param lifetime: Seconds a container lives, at most
+        :param state_dir: Directory of the locks.  Defaults to work_dir.
+        """
+        self.work_dir = work_dir
+        self.docker = list(docker)
+        self.lifetime = lifetime
+        self.state_dir = state_dir or work_dir
+        self.label = 'bd2k.pool=' + work_dir
+
+    def name(self, image, cpus=None, memory=None):
+        """
+        :param cpus: Cores the container may use, unlimited if None
+        :param memory: Memory in GB the container may use, unlimited if None
+        """
+        key = '{}\n{}\n{}\n{}'.format(self.work_dir, image, cpus, memory)
+        return 'bd2k-pool-' + hashlib.sha1(key).hexdigest()[:16]
+
+    def running(self, image, cpus=None, memory=None):
+        """
+        Health check.
+        :returns: True if the container of image is up
+        """
+        return self._state(self.name(image, cpus, memory)) == 'true'
+
+    def ensure(self, image, cpus=None, memory=None):
+        """
+        Starts the container of image, limited to cpus and memory, unless it is already up.  A stopped container of
+        the same name is replaced; a running one never is.
+        """
+        name = self.name(image, cpus, memory)
+        with self._lock(name):
+            state = self._state(name)
+            if state == 'true':
+                return
+            limits = ['--cpus={}'.format(cpus)] if cpus else []
+            limits += ['--memory={}m'.format(int(memory * 1024))] if memory else []
+            with open(os.devnull, 'w') as devnull:
+                if state is not None:
+                    subprocess.call(self.docker + ['rm', '-f', name], stdout=devnull, stderr=devnull)
+                subprocess.check_call(self.docker + ['run', '-d', '--rm', '--name', name, '--label', self.label] +
+                                      limits + ['-v', '{}:/data'.format(self.work_dir), '--entrypoint', 'sleep',
+                                                image, str(self.lifetime)], stdout=devnull)
+
+    def execute(self, image, command, cpus=None, memory=None):
+        """
+        Runs command, a list of arguments, in the container of image, from /data.  If the container died under it,
+        the container is restarted and the command run once more.
+        :raises subprocess.CalledProcessError: If the command fails
+        """
+        self.ensure(image, cpus, memory)
+        exec_command = self.docker + ['exec', '-w', '/data', self.name(image, cpus, memory)] + command
+        try:
+            subprocess.check_call(exec_command)
+        except subprocess.CalledProcessError:
+            if self.running(image, cpus, memory):
+                raise
+            self.ensure(image, cpus, memory)
+            subprocess.check_call(exec_command)
+
+    def close(self):
+        """
+        Removes every container of this work_dir on the host
+        """
+        try:
+            ids = subprocess.check_output(self.docker + ['ps', '-aq', '--filter', 'label=' + self.label]).split()
+        except (subprocess.CalledProcessError, OSError):
+            return
+        if ids:
+            with open(os.devnull, 'w') as devnull:
+                subprocess.call(self.docker + ['rm', '-f'] + ids, stdout=devnull, stderr=devnull)
+
+    def _state(self, name):
+        """
+        :returns: 'true' if the container is running, 'false' if it is stopped, None if there is none
+        """
+        with open(os.devnull, 'w') as devnull:
+            inspect = subprocess.Popen(self.docker + ['inspect', '-f', '{{.State.Running}}', name],
+                                       stdout=subprocess.PIPE, stderr=devnull)
+            output = inspect.communicate()[0]
+        return output.strip() if inspect.returncode == 0 else None
+
+    def _lock(self, name):
+        mkdir_p(self.state_dir)
+        return flocked(os.path.join(self.state_dir, '.pool.{}.{}.lock'.format(socket.gethostname(), name)))
@@ -0,0 +1,117 @@
+"""
+Node-local, content-addressed cache for the static inputs of the pipeline
+
+Every run downloads the same reference, dbSNP and COSMIC files and MuTect jar into a fresh work_dir.  The cache keeps
+one copy of each per host, keyed by URL plus the server's ETag (or a checksum supplied by the caller), and hard-links
+it into each run's work_dir.  Its layout and eviction are those of object_store, with downloads in progress at
+
+    cache_dir/tmp/<key>.part    Renamed into objects/ once complete and verified
+"""
+import hashlib
+import os
+import subprocess
+
+from object_store import ObjectStore
+from staging import stage_file
+from tee import MD5Sink, feed_file
+
+
+def curl_download(url, path, consumers=()):
+    """
+    Downloads url to path with curl, feeding the bytes to consumers (see tee) as they arrive.
+    """
+    try:
+        curl = subprocess.Popen(['curl', '-fs', url], stdout=subprocess.PIPE)
+    except OSError:
+        raise RuntimeError('Failed to find "curl". Install via "apt-get install curl"')
+    with open(path, 'wb') as f:
+        for block in iter(lambda: curl.stdout.read(1 << 20), b''):
+            f.write(block)
+            for consumer in consumers:
+                consumer.update(block)
+    if curl.wait() != 0:
+        raise RuntimeError('\nNecessary file could not be acquired: {}. Check input URL'.format(url))
+
+
+def url_validator(url):
+    """
+    Identifies the current version of the file at url from the headers of a HEAD request: its ETag, or failing that
+    its Last-Modified date and Content-Length.
+    :returns: The validator, or None if the server sent neither
+    """
+    try:
+        headers = subprocess.check_output(['curl', '-fsIL', url])
+    except (subprocess.CalledProcessError, OSError):
+        return None
+
+    # With redirects followed, the headers of the last response overwrite the earlier ones
+    fields = {}
+    for line in headers.splitlines():
+        name, sep, value = line.partition(':')
+        if sep:
+            fields[name.strip().lower()] = value.strip()
+    if 'etag' in fields:
+        return 'etag:' + fields['etag']
+    if 'last-modified' in fields:
+        return 'modified:{}:{}'.format(fields['last-modified'], fields.get('content-length'))
+    return None
+
+
+class DownloadCache(ObjectStore):
+    """
+    Shares downloads between all the targets, and all the runs, on one host.
+    """
+    def __init__(self, cache_dir, budget=None, download=curl_download):
+        """
+        :param cache_dir: Directory of the cache.  Keep it on the same filesystem as the work dirs so files can be
+                          hard-linked instead of copied.
+        :param budget: Disk budget in bytes.  Least recently used files are evicted above it.  Unlimited if None.
+        :param download: Function (url, path, consumers=()) that downloads url to path, feeding its bytes to consumers
+        """
+        super(DownloadCache, self).__init__(cache_dir, budget)
+        self.download = download
+
+    def fetch(self, url, dest, checksum=None, consumers=()):
+        """
+        Places the file at url at dest, downloading it only if no earlier run on this host has.
+
+        :param checksum: Optional MD5 of the file, as hex or "md5:<hex>".  When given it replaces the ETag in the key,
+                         so no HEAD request is made, and downloads are verified against it.
+        :param consumers: Fed the file's bytes (see tee): from the download, or from the cached copy on a hit
+        :returns: dest
+        """
+        self._makedirs()
+        checksum = checksum.split(':', 1)[-1].lower() if checksum else None
+        key = self.key(url, checksum)
+        path = self._object(key)
+
+        with self._lock(key):
+            downloaded = not os.path.exists(path)
+            if downloaded:
+                self._download(key, url, checksum, consumers)
+            else:
+                os.utime(path, None)
+            stage_file(path, dest)
+        if not downloaded and consumers:
+            feed_file(dest, consumers)
+
+        if downloaded:
+            self.evict(keep=key)
+        return dest
+
+    def key(self, url, checksum=None):
+        validator = 'md5:' + checksum if checksum else url_validator(url) or ''
+        return hashlib.sha1('{}\n{}'.format(url, validator)).hexdigest()
+
+    def _download(self, key, url, checksum, consumers):
+        # Only the holder of the key's lock writes here, so a partial file left by a failed attempt can be resumed by
+        # downloaders that support it
+        tmp = os.path.join(self.root, 'tmp', key + '.part')
+        md5 = MD5Sink()
+        self.download(url, tmp, consumers=list(consumers) + ([md5] if checksum is not None else []))
+        if checksum is not None and md5.hexdigest() != checksum:
+            os.remove(tmp)
+            raise RuntimeError('Download of {} does not match its checksum: {}'.format(url, checksum))
+        # Objects are hard-linked into work dirs, so a tool writing to its input must not corrupt the cache
+        os.chmod(tmp, 0o444)
+        os.rename(tmp, self._object(key))
@@ -0,0 +1,34 @@
+"""
+Filesystem helpers shared by the pipeline and its modules
+"""
+import errno
+import fcntl
+import os
+from contextlib import contextmanager
+
+
+def mkdir_p(path):
+    """
+    The equivalent of mkdir -p
+    https://github.com/BD2KGenomics/bd2k-python-lib/blob/master/src/bd2k/util/files.py
+    """
+    try:
+        os.makedirs(path)
+    except OSError as exc:
+        if exc.errno == errno.EEXIST and os.path.isdir(path):
+            pass
+        else:
+            raise
+
+
+@contextmanager
+def flocked(path):
+    """
+    Holds an exclusive flock on path, created if need be, for the length of the with block
+    """
+    with open(path, 'a') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
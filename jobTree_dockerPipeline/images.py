@@ -0,0 +1,120 @@
+"""
+Tool images, pulled once per host before the tools run
+
+Left to `docker run`, every image is pulled inline by the first call that needs it, inside a timed tool step, and
+targets sharing a host pull the same image at the same time.  ImageStager makes each image present on the host first:
+one process per host pulls it, under a lock, while the others wait for it, and several images are pulled in parallel.
+
+    state_dir/<hostname>.<image hash>.lock   flock'd while an image is checked and pulled or loaded
+
+Clusters without access to a registry load images from a directory of tarballs made by `docker save`, named after the
+image as tarball() names them:
+
+    docker save -o jvivian_samtools_1.2.tar jvivian/samtools:1.2
+"""
+import fcntl
+import hashlib
+import os
+import socket
+import subprocess
+from contextlib import contextmanager
+from multiprocessing.pool import ThreadPool
+
+from files import mkdir_p
+
+
+def tarball(image):
+    """
+    :returns: File name of the tarball of image, e.g. jvivian_samtools_1.2.tar
+    """
+    return image.replace('/', '_').replace(':', '_') + '.tar'
+
+
+class ImageStager(object):
+    """
+    Pulls, or loads from tarballs, the images a host needs, each once.
+    """
+    def __init__(self, state_dir, docker=('sudo', 'docker'), tarball_dir=None):
+        """
+        :param state_dir: Directory of the locks.  Every process sharing the host must use the same one.
+        :param docker: Command that runs the docker CLI
+        :param tarball_dir: Directory of image tarballs, loaded in preference to pulling
+        """
+        self.state_dir = state_dir
+        self.docker = list(docker)
+        self.tarball_dir = tarball_dir
+        self.staged = set()
+
+    def __getstate__(self):
+        # Images staged here say nothing of the host the unpickled copy runs on
+        state = dict(self.__dict__)
+        state['staged'] = set()
+        return state
+
+    def present(self, image):
+        """
+        :returns: True if image is on this host
+        """
+        with open(os.devnull, 'w') as devnull:
+            try:
+                images = subprocess.Popen(self.docker + ['images', '-q', image], stdout=subprocess.PIPE,
+                                          stderr=devnull)
+            except OSError:
+                raise RuntimeError('docker not found on system. Install on all nodes.')
+            output = images.communicate()[0]
+        return images.returncode == 0 and bool(output.strip())
+
+    def stage(self, image):
+        """
+        Makes image present on this host: loaded from its tarball if there is one, else pulled.
+        :returns: 'present', 'loaded' or 'pulled'
+        """
+        if image in self.staged:
+            return 'present'
+        with self._lock(image):
+            if self.present(image):
+                how = 'present'
+            else:
+                path = os.path.join(self.tarball_dir, tarball(image)) if self.tarball_dir else None
+                if path and os.path.exists(path):
+                    how, command = 'loaded', ['load', '-i', path]
+                else:
+                    how, command = 'pulled', ['pull', image]
+                with open(os.devnull, 'w') as devnull:
+                    try:
+                        subprocess.check_call(self.docker + command, stdout=devnull)
+                    except subprocess.CalledProcessError:
+                        raise RuntimeError('docker {} of {} failed. Check error logs.'.format(command[0], image))
+                    except OSError:
+                        raise RuntimeError('docker not found on system. Install on all nodes.')
+        self.staged.add(image)
+        return how
+
+    def stage_all(self, images, parallelism=None):
+        """
+        Stages several images at once.
+        :param parallelism: Images staged at once.  Defaults to all of them.
+        :returns: {image: 'present', 'loaded' or 'pulled'}
+        """
+        images = sorted(set(images) - self.staged)
+        if not images:
+            return {}
+        pool = ThreadPool(max(1, min(parallelism or len(images), len(images))))
+        try:
+            how = pool.map(self.stage, images)
+        finally:
+            pool.close()
+            pool.join()
+        return dict(zip(images, how))
+
+    @contextmanager
+    def _lock(self, image):
+        mkdir_p(self.state_dir)
+        path = os.path.join(self.state_dir, '{}.{}.lock'.format(socket.gethostname(),
+                                                                hashlib.sha1(image).hexdigest()[:16]))
+        with open(path, 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
@@ -0,0 +1,341 @@
+"""
+Timing and I/O instrumentation of pipeline targets, and the run report built from it
+
+Every target records how long it ran and the spans inside it: image pulls, downloads, FileStore reads and updates,
+container start, the tool itself and teardown, with the bytes they moved and, for containers, peak memory and CPU time.
+Records are written to report_dir/targets/, one JSON file per target, which must be shared by every host for a complete
+report.
+
+A record knows the target that created it, because the creator's id travels in the pickled SupportClass.  That is
+enough to rebuild the critical path: from the last target to finish, step back to whatever it waited for last.
+
+Targets also note the most disk their work_dir used while they ran, and the report gives the peak of each host.
+"""
+import calendar
+import json
+import os
+import socket
+import subprocess
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime
+
+from files import mkdir_p
+
+# Categories of spans, in the order the summary lists them
+CATEGORIES = ['image_pull', 'download', 'filestore_read', 'filestore_update', 'admission_wait', 'container_start',
+              'tool', 'memo_hit', 'teardown']
+
+
+class Instrumentation(object):
+    """
+    Records the targets of one run.  It travels with SupportClass, so each target works on its own unpickled copy.
+    """
+    def __init__(self, report_dir):
+        self.report_dir = report_dir
+        self.current = None
+        self.record = None
+        self.lock = threading.Lock()
+
+    def __getstate__(self):
+        # Only the id of the running target passes to the targets it creates
+        return {'report_dir': self.report_dir, 'current': self.current}
+
+    def __setstate__(self, state):
+        self.__init__(state['report_dir'])
+        self.current = state['current']
+
+    @contextmanager
+    def target(self, name, label=''):
+        """
+        Records a target from start to end, and writes its record when it ends, even if it fails.
+        A target function called directly from another target gets its own record, nested in the caller's.
+        """
+        outer = self.current, self.record
+        self.current = str(uuid.uuid4())
+        record = self.record = {'id': self.current, 'parent': outer[0], 'name': name, 'label': label or name,
+                                'host': socket.gethostname(), 'pid': os.getpid(), 'start': time.time(), 'spans': []}
+        try:
+            yield record
+            record['status'] = 'ok'
+        except:
+            record['status'] = 'failed'
+            raise
+        finally:
+            record['end'] = time.time()
+            self._write(record)
+            # A target's own id stays current after it ends, for children jobTree pickles once it has returned
+            if outer[1] is not None:
+                self.current, self.record = outer
+
+    @contextmanager
+    def span(self, category, name=''):
+        """
+        Records a span of the current target.  The yielded dict takes attributes, like bytes.
+        """
+        span = {'category': category, 'name': name, 'start': time.time()}
+        try:
+            yield span
+        finally:
+            span['end'] = time.time()
+            self.add(span)
+
+    def add(self, span):
+        if self.record is not None:
+            with self.lock:
+                self.record['spans'].append(span)
+
+    def disk(self, usage):
+        """
+        Notes a sample of the bytes used by work_dir, of which the record keeps the largest.
+        """
+        if self.record is not None:
+            with self.lock:
+                self.record['disk_peak'] = max(self.record.get('disk_peak', 0), usage)
+
+    @contextmanager
+    def container(self, name, cidfile):
+        """
+        Records a container run, launched with --cidfile cidfile, as the time docker took to start it and the time
+        the tool ran, with the container's peak memory and CPU time sampled from its cgroup.
+        """
+        monitor = _ContainerMonitor(cidfile)
+        launched = time.time()
+        try:
+            yield
+        finally:
+            ended = time.time()
+            monitor.stop()
+            started, finished = _container_times(monitor.cid)
+            tool = {'category': 'tool', 'name': name, 'start': launched, 'end': ended,
+                    'peak_rss': monitor.peak_rss, 'cpu_seconds': monitor.cpu_seconds}
+            if started is not None and launched <= started <= ended:
+                self.add({'category': 'container_start', 'name': name, 'start': launched, 'end': started})
+                tool.update(start=started, end=min(finished or ended, ended))
+            self.add(tool)
+
+    def _write(self, record):
+        directory = os.path.join(self.report_dir, 'targets')
+        mkdir_p(directory)
+        path = os.path.join(directory, record['id'] + '.json')
+        with open(path + '.tmp', 'w') as f:
+            json.dump(record, f)
+        os.rename(path + '.tmp', path)
+
+
+class _ContainerMonitor(object):
+    """
+    Samples a running container's cgroup in a thread.  Its id is read from the cidfile docker writes.
+    """
+    def __init__(self, cidfile, interval=0.5):
+        self.cidfile = cidfile
+        self.interval = interval
+        self.cid = None
+        self.peak_rss = None
+        self.cpu_seconds = None
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+        self._sample()
+
+    def _run(self):
+        while not self.stopped.wait(self.interval):
+            self._sample()
+
+    def _sample(self):
+        if self.cid is None:
+            try:
+                with open(self.cidfile) as f:
+                    self.cid = f.read().strip() or None
+            except IOError:
+                return
+        if self.cid is None:
+            return
+        memory, cpu = cgroup_stats(self.cid)
+        if memory is not None:
+            self.peak_rss = max(memory, self.peak_rss or 0)
+        if cpu is not None:
+            self.cpu_seconds = max(cpu, self.cpu_seconds or 0)
+
+
+def cgroup_stats(cid):
+    """
+    :returns: (peak memory in bytes, CPU seconds) of a running container, from cgroup v1 or v2.  Either is None when
+              the cgroup is gone or does not expose it.
+    """
+    v1 = '/sys/fs/cgroup/{}/docker/' + cid
+    v2 = '/sys/fs/cgroup/system.slice/docker-{}.scope/'.format(cid)
+    memory = _read_int(os.path.join(v1.format('memory'), 'memory.max_usage_in_bytes'),
+                       os.path.join(v2, 'memory.peak'),
+                       os.path.join(v2, 'memory.current'))
+    cpu = _read_int(os.path.join(v1.format('cpuacct'), 'cpuacct.usage'),
+                    os.path.join(v1.format('cpu,cpuacct'), 'cpuacct.usage'))
+    if cpu is not None:
+        cpu /= 1e9
+    else:
+        try:
+            with open(os.path.join(v2, 'cpu.stat')) as f:
+                stats = dict(line.split() for line in f if line.strip())
+            cpu = int(stats['usage_usec']) / 1e6
+        except (IOError, KeyError, ValueError):
+            pass
+    return memory, cpu
+
+
+def _read_int(*paths):
+    for path in paths:
+        try:
+            with open(path) as f:
+                return int(f.read().split()[0])
+        except (IOError, IndexError, ValueError):
+            continue
+    return None
+
+
+def _container_times(cid):
+    """
+    :returns: (StartedAt, FinishedAt) of a container as epoch seconds, or Nones when docker cannot tell
+    """
+    if cid is None:
+        return None, None
+    try:
+        output = subprocess.check_output(['sudo', 'docker', 'inspect', '-f',
+                                          '{{.State.StartedAt}} {{.State.FinishedAt}}', cid])
+        return tuple(_docker_time(t) for t in output.split())
+    except (subprocess.CalledProcessError, OSError, ValueError):
+        return None, None
+
+
+def _docker_time(text):
+    """
+    Parses docker's RFC 3339 UTC times, like 2015-05-09T12:00:00.123456789Z
+    """
+    main, _, fraction = text.rstrip('Z').partition('.')
+    seconds = calendar.timegm(datetime.strptime(main, '%Y-%m-%dT%H:%M:%S').timetuple())
+    return seconds + float('0.' + fraction) if fraction else float(seconds)
+
+
+def load_records(report_dir):
+    records = []
+    directory = os.path.join(report_dir, 'targets')
+    for name in sorted(os.listdir(directory)) if os.path.isdir(directory) else []:
+        if name.endswith('.json'):
+            with open(os.path.join(directory, name)) as f:
+                records.append(json.load(f))
+    return records
+
+
+def critical_path(records):
+    """
+    Walks back from the last target to finish.  A target waited on its creator, or, as a follow-on, on the targets its
+    creator created; of those that finished before it started, the one that finished last is the one it waited for.
+    :returns: Records on the critical path, first to last
+    """
+    if not records:
+        return []
+    by_id = {r['id']: r for r in records}
+    created = {}
+    for r in records:
+        created.setdefault(r['parent'], []).append(r)
+
+    def subtree(record):
+        stack, found = [record], []
+        while stack:
+            r = stack.pop()
+            found.append(r)
+            stack.extend(created.get(r['id'], []))
+        return found
+
+    path = [max(records, key=lambda r: r['end'])]
+    while path[-1]['parent'] in by_id:
+        current = path[-1]
+        creator = by_id[current['parent']]
+        candidates = [r for r in subtree(creator) if r is not current and r['end'] <= current['start'] + 1e-3]
+        path.append(max(candidates, key=lambda r: r['end']) if candidates else creator)
+    return path[::-1]
+
+
+def build_report(report_dir):
+    """
+    :returns: The run report: every target, totals per category, the peak disk usage of each host and the critical path
+    """
+    records = sorted(load_records(report_dir), key=lambda r: r['start'])
+    totals = {}
+    disk_peak = {}
+    for record in records:
+        if 'disk_peak' in record:
+            disk_peak[record['host']] = max(disk_peak.get(record['host'], 0), record['disk_peak'])
+        for span in record['spans']:
+            total = totals.setdefault(span['category'], {'seconds': 0.0, 'bytes': 0, 'count': 0})
+            total['seconds'] += span['end'] - span['start']
+            total['bytes'] += span.get('bytes') or 0
+            total['count'] += 1
+
+    path = critical_path(records)
+    steps = []
+    for previous, record in zip([None] + path[:-1], path):
+        steps.append({'id': record['id'], 'label': record['label'], 'host': record['host'],
+                      'seconds': record['end'] - record['start'],
+                      'waited': max(0.0, record['start'] - previous['end']) if previous else 0.0})
+    return {'start': records[0]['start'] if records else None,
+            'end': max(r['end'] for r in records) if records else None,
+            'targets': records,
+            'totals': totals,
+            'disk_peak': disk_peak,
+            'critical_path': steps}
+
+
+def summary_table(report):
+    """
+    :returns: The report as text: time and bytes per category, peak disk usage, the slowest targets and the critical
+              path
+    """
+    lines = []
+    if report['start'] is not None:
+        lines.append('Run wall time: {:.1f} s, {} targets'.format(report['end'] - report['start'],
+                                                                len(report['targets'])))
+    lines += ['', '{:<18}{:>12}{:>14}{:>8}'.format('Category', 'Seconds', 'MB', 'Count')]
+    categories = CATEGORIES + sorted(set(report['totals']) - set(CATEGORIES))
+    for category in categories:
+        if category in report['totals']:
+            t = report['totals'][category]
+            lines.append('{:<18}{:>12.1f}{:>14.1f}{:>8}'.format(category, t['seconds'], t['bytes'] / 1024.0 ** 2,
+                                                                 t['count']))
+
+    if report.get('disk_peak'):
+        lines += ['', 'Peak work_dir disk usage']
+        for host, peak in sorted(report['disk_peak'].items()):
+            lines.append('  {:<40}{:>10.1f} MB'.format(host, peak / 1024.0 ** 2))
+
+    lines += ['', 'Slowest targets']
+    slowest = sorted(report['targets'], key=lambda r: r['start'] - r['end'])[:10]
+    for r in slowest:
+        peak = max([s.get('peak_rss') or 0 for s in r['spans']] or [0])
+        lines.append('  {:<40}{:>10.1f} s{:>10.0f} MB peak  {}'.format(r['label'], r['end'] - r['start'],
+                                                                      peak / 1024.0 ** 2, r['status']))
+
+    lines += ['', 'Critical path']
+    for step in report['critical_path']:
+        lines.append('  {:<40}{:>10.1f} s   waited {:.1f} s'.format(step['label'], step['seconds'], step['waited']))
+    return '\n'.join(lines)
+
+
+def write_report(report_dir):
+    """
+    Writes report.json and summary.txt into report_dir.
+    :returns: The summary table
+    """
+    report = build_report(report_dir)
+    with open(os.path.join(report_dir, 'report.json'), 'w') as f:
+        json.dump(report, f, indent=1)
+    summary = summary_table(report)
+    with open(os.path.join(report_dir, 'summary.txt'), 'w') as f:
+        f.write(summary + '\n')
+    return summary
@@ -0,0 +1,110 @@
+"""
+Splits a reference into interval shards for scatter-gather variant calling, and merges the per-shard outputs back.
+
+Shards follow the order of the reference's sequence dictionary, so concatenating sorted per-shard outputs in shard
+order keeps them sorted.
+"""
+import math
+
+
+def read_fai(path):
+    """
+    :returns: [(contig, length)] from a samtools .fai index, in reference order
+    """
+    contigs = []
+    with open(path) as f:
+        for line in f:
+            fields = line.rstrip('\n').split('\t')
+            if len(fields) >= 2:
+                contigs.append((fields[0], int(fields[1])))
+    return contigs
+
+
+def read_dict(path):
+    """
+    :returns: [(contig, length)] from the @SQ lines of a Picard .dict, in reference order
+    """
+    contigs = []
+    with open(path) as f:
+        for line in f:
+            if not line.startswith('@SQ'):
+                continue
+            tags = dict(field.split(':', 1) for field in line.rstrip('\n').split('\t')[1:] if ':' in field)
+            contigs.append((tags['SN'], int(tags['LN'])))
+    return contigs
+
+
+def shard_intervals(contigs, shards=1, shard_size=None):
+    """
+    Cuts the reference into shards of balanced length.  Contigs are split across shards where needed, and small
+    contigs are packed together.
+
+    :param contigs: [(contig, length)] in reference order
+    :param shards: Number of shards
+    :param shard_size: Bases per shard.  If given, it sets the number of shards instead.
+    :returns: List of shards, each a list of (contig, start, end) intervals, 1-based and inclusive
+    """
+    total = sum(length for _, length in contigs)
+    if shard_size:
+        shards = int(math.ceil(float(total) / shard_size))
+    shards = max(1, min(shards, total))
+
+    result = []
+    current = []
+    filled = 0
+    for contig, length in contigs:
+        start = 1
+        while start <= length:
+            # Shard i ends at base round(total * (i + 1) / shards), so rounding errors never pile up on the last one
+            boundary = int(round(float(total) * (len(result) + 1) / shards))
+            take = min(length - start + 1, boundary - filled)
+            if take > 0:
+                current.append((contig, start, start + take - 1))
+                start += take
+                filled += take
+            if filled >= boundary and current:
+                result.append(current)
+                current = []
+    if current:
+        result.append(current)
+    return result
+
+
+def format_interval(interval):
+    """
+    :returns: The interval as GATK's -L syntax, contig:start-end
+    """
+    return '{}:{}-{}'.format(*interval)
+
+
+def merge_text(paths, output, is_header):
+    """
+    Concatenates files, keeping the leading header lines of the first file only.
+    :param is_header: Function that tells whether a line is part of a file's header
+    """
+    with open(output, 'w') as out:
+        for i, path in enumerate(paths):
+            with open(path) as f:
+                in_header = True
+                for line in f:
+                    if in_header and is_header(line):
+                        if i == 0:
+                            out.write(line)
+                        continue
+                    in_header = False
+                    out.write(line)
+
+
+def merge_vcfs(paths, output):
+    """
+    Merges VCFs of consecutive shards into one, with a single header.
+    """
+    merge_text(paths, output, lambda line: line.startswith('#'))
+
+
+def merge_call_stats(paths, output):
+    """
+    Merges MuTect call stats (--out) or coverage (--coverage_file) files of consecutive shards, with a single header:
+    the comment, track and column header lines that lead each file.
+    """
+    merge_text(paths, output, lambda line: line.startswith(('#', 'track', 'contig')))
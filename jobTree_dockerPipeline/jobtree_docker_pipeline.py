@@ -4,28 +4,58 @@
 """
 Pipeline for Tumor/Normal Variant Calling
 
-    Pull Tool Images
+    Pull Tool Images                              Stage shared inputs
+    (each once per host, all in parallel,         (each downloaded and stored once,
+     or loaded from --image_dir)                   the reference indexed as it downloads)
+        |                                             |
+        +---------------------------------------------+
         |
         v
-    Prepare bams/ref
-        |
-        v
-      MuTect
+    Pairs, in --concurrent_pairs lanes run in parallel:
+        Stage BAMs (indexed as they download)
+            |
+            v
+        MuTect (one per interval shard)
+            |
+            v
+        Merge VCFs/coverage
+
+Pairs come from --normal and --tumor, or many at once from a --manifest.
 
 1. Given the use of containerized tools, all input/output should be directed to/from: os.path.join(/data, filename)
-2. target.updateGlobalFile() should be to:  os.path.join(work_dir, filename)
+2. target.updateGlobalFile() should be to:  os.path.join(work_dir, filename), through sclass.update_global_file()
+3. Targets are @instrumented; the run report (report.json, summary.txt) is written to --report_dir at the end
+4. Files in work_dir are reference counted (see refcount): each is removed once the last target reading it is done
 """
 import argparse
+import functools
 import os
+import re
 import multiprocessing
 import shutil
 import subprocess
+import tempfile
+import time
 import uuid
-import errno
+
+from multiprocessing.pool import ThreadPool
 
 from jobTree.stack import Stack
 from jobTree.target import Target
 
+from admission import AdmissionController
+from container_pool import ContainerPool
+from download_cache import DownloadCache
+from files import flocked, mkdir_p
+from images import ImageStager
+from instrument import Instrumentation, write_report
+from memo import ArtifactStore
+from intervals import format_interval, merge_call_stats, merge_vcfs, read_dict, shard_intervals
+from parallel_download import ParallelDownloader, manifest_path
+from refcount import RefCounts
+from staging import stage_file
+from tee import FastaIndexer, MD5Sink, PipeSink, Tee, feed_file
+
 
 def build_parser():
     """
@@ -33,55 +63,170 @@ def build_parser():
     """
     parser = argparse.ArgumentParser()
     parser.add_argument('-r', '--reference', required=True, help="Reference Genome URL")
-    parser.add_argument('-n', '--normal', required=True, help='Normal BAM URL. Format: UUID.normal.bam')
-    parser.add_argument('-t', '--tumor', required=True, help='Tumor BAM URL. Format: UUID.tumor.bam')
+    parser.add_argument('-n', '--normal', help='Normal BAM URL. Format: UUID.normal.bam')
+    parser.add_argument('-t', '--tumor', help='Tumor BAM URL. Format: UUID.tumor.bam')
+    parser.add_argument('-m', '--manifest',
+                        help='TSV of tumor/normal pairs to run together instead of --normal and --tumor. '
+                             'Columns: pair UUID, normal BAM URL, tumor BAM URL')
+    parser.add_argument('--concurrent_pairs', type=int, default=4, help='Number of pairs processed at once')
     parser.add_argument('-d', '--dbsnp', required=True, help='dbsnp_132_b37.leftAligned.vcf URL')
     parser.add_argument('-c', '--cosmic', required=True, help='b37_cosmic_v54_120711.vcf URL')
     parser.add_argument('-u', '--mutect', required=True, help='Mutect.jar')
     parser.add_argument('-w', '--work_dir', required=True, help='Where you wanna work from? (full path please)')
+    parser.add_argument('--cache_dir', default=None,
+                        help='Node-local cache of the reference, dbsnp, cosmic and mutect inputs shared by every run. '
+                             'Default: <work_dir>/bd2k-cache')
+    parser.add_argument('--cache_budget', type=float, default=50, help='Disk budget of the cache, in GB')
+    parser.add_argument('--connections', type=int, default=8, help='Concurrent Range requests per download')
+    parser.add_argument('--shards', type=int, default=multiprocessing.cpu_count(),
+                        help='Number of interval shards MuTect is scattered over. Default: number of cores')
+    parser.add_argument('--shard_size', type=float, default=None,
+                        help='Size of each MuTect shard in Mb. Overrides --shards')
+    parser.add_argument('--max_rate', type=float, default=None, help='Throughput limit per download, in MB/s')
+    parser.add_argument('--staging_threads', type=int, default=4,
+                        help='Inputs a target stages from the FileStore at once')
+    parser.add_argument('--max_cores', type=int, default=None,
+                        help='Cores the containers of all runs on a host may use together. Default: every core')
+    parser.add_argument('--max_memory', type=float, default=None,
+                        help='Memory in GB the containers of all runs on a host may use together. Default: all of it')
+    parser.add_argument('--artifact_dir', default=None,
+                        help='Node-local store of the outputs of tool steps, reused when a step is rerun on identical '
+                             'inputs. Default: <work_dir>/bd2k-artifacts')
+    parser.add_argument('--artifact_budget', type=float, default=100, help='Disk budget of the artifact store, in GB')
+    parser.add_argument('--warm_containers', action='store_true',
+                        help='Run tools with docker exec in one long-lived container per tool image and resource '
+                             'limits, instead of a new container per call. Tool runs then report no peak memory or '
+                             'CPU time')
+    parser.add_argument('--report_dir', default=None,
+                        help='Where targets record their timings, and the run report is written. Shared by all hosts. '
+                             'Default: <work_dir>/bd2k-reports/<run>')
+    parser.add_argument('--admission_dir', default=None,
+                        help='Host-local directory where runs sharing a host reserve cores and memory. '
+                             'Default: <work_dir>/bd2k-admission')
+    parser.add_argument('--image_dir', default=None,
+                        help='Directory of tool image tarballs made by docker save, loaded instead of pulling, for '
+                             'clusters without access to a registry. Names: see images.tarball()')
 
     return parser
 
 
+def parse_manifest(path):
+    """
+    Reads a manifest of tumor/normal pairs: one pair per line, as tab-separated pair UUID, normal URL and tumor URL.
+    Blank lines and lines starting with # are skipped.
+    :returns: [(pair, normal URL, tumor URL)] in manifest order
+    """
+    pairs = []
+    with open(path) as f:
+        for number, line in enumerate(f, 1):
+            if not line.strip() or line.startswith('#'):
+                continue
+            fields = line.rstrip('\n').split('\t')
+            if len(fields) != 3:
+                raise RuntimeError('Line {} of {} does not have 3 tab-separated columns'.format(number, path))
+            if not re.match(r'^[\w-]+$', fields[0]):
+                raise RuntimeError('Pair UUID on line {} of {} is not a valid file name: {}'.format(number, path,
+                                                                                                  fields[0]))
+            pairs.append(tuple(fields))
+    if len(set(pair for pair, _, _ in pairs)) != len(pairs):
+        raise RuntimeError('Pair UUIDs in {} are not unique'.format(path))
+    return pairs
+
+
 class SupportClass(object):
     """
     Container for necessary information and methods that is passed through the pipeline
     """
-    def __init__(self, target, args, input_urls):
+    def __init__(self, target, args, input_urls, pairs):
         """
         Variables and datatypes
+        :input_urls: URLs of the inputs shared by every pair
+        :pairs: [(pair, normal URL, tumor URL)]
         """
         # TODO: self.target doesn't appear to work so I have to pass it around. Not sure why that is.
         self.target = target
         self.args = args
-        self.input_urls = input_urls
+        self.shared_inputs = sorted(input_urls)
+        self.pairs = [pair for pair, _, _ in pairs]
         self.cpu_count = multiprocessing.cpu_count()
 
+        # Inputs of a pair are named after it: <pair>.normal.bam, <pair>.tumor.bam
+        self.input_urls = dict(input_urls)
+        for pair, normal, tumor in pairs:
+            self.input_urls['{}.normal.bam'.format(pair)] = normal
+            self.input_urls['{}.tumor.bam'.format(pair)] = tumor
+
         # work_dir has following naming convenction: <user supplied dir>/<bd2k-<file_name>/<Random UUID4>/
         self.work_dir = os.path.join(str(self.args.work_dir),
                                      'bd2k-{}'.format(os.path.basename(__file__).split('.')[0]),
                                      str(uuid.uuid4()))
 
+        # Timings and I/O of every target, for the run report
+        self.instrument = Instrumentation(self.args.report_dir or os.path.join(
+            str(self.args.work_dir), 'bd2k-reports', os.path.basename(self.work_dir)))
+
         # Symbolic names for all inputs in the pipeline.
-        self.symbolic_inputs = self.input_urls.keys() + ['ref.fai', 'ref.dict', 'normal.bai', 'tumor.bai', 'mutect.vcf']
+        self.symbolic_inputs = self.input_urls.keys() + ['ref.fai', 'ref.dict']
+        for pair in self.pairs:
+            self.symbolic_inputs += ['{}.{}'.format(pair, x) for x in ['normal.bai', 'tumor.bai', 'mutect.vcf']]
+
+        # File names in work_dir of symbolic inputs whose name is not their file name.  Tools expect indexes there.
+        self.file_names = {'ref.fai': 'ref.fasta.fai'}
+        for pair in self.pairs:
+            for sample in ['normal', 'tumor']:
+                self.file_names['{}.{}.bai'.format(pair, sample)] = '{}.{}.bam.bai'.format(pair, sample)
 
         # Dictionary of all FileStoreIds for all input files used in the pipeline
         self.ids = {x: target.getEmptyFileStoreID() for x in self.symbolic_inputs}
 
+        # Inputs are fetched with parallel Range requests, resuming partial downloads
+        self.download = ParallelDownloader(connections=self.args.connections,
+                                           max_rate=self.args.max_rate and self.args.max_rate * 1024 ** 2)
+
+        # Static inputs, identical across runs, are shared through a node-local cache and hard-linked into work_dir
+        self.cache = DownloadCache(self.args.cache_dir or os.path.join(str(self.args.work_dir), 'bd2k-cache'),
+                                   budget=int(self.args.cache_budget * 1024 ** 3), download=self.download)
+        self.cached_inputs = {'ref.fasta', 'dbsnp.vcf', 'cosmic.vcf', 'mutect.jar'}
+
+        # Outputs of tool steps, keyed by image, command and input contents, survive teardown and new work_dirs
+        self.artifacts = ArtifactStore(self.args.artifact_dir or os.path.join(str(self.args.work_dir), 'bd2k-artifacts'),
+                                       budget=int(self.args.artifact_budget * 1024 ** 3))
+
         # Dictionary of all tools and their associated docker image
         self.tools = {'samtools': 'jvivian/samtools:1.2',
                       'picard': 'jvivian/picardtools:1.113',
                       'mutect': 'jvivian/mutect:1.1.7'}
 
+        # Cores and memory (GB) each tool's container is limited to, and reserves on its host before it starts
+        self.resources = {'samtools': {'cpus': 1, 'memory': 2},
+                          'picard': {'cpus': 1, 'memory': 4},
+                          'mutect': {'cpus': 1, 'memory': 6}}
+
+        # Containers wait until their resources are free on the host, across targets and runs
+        self.admission = AdmissionController(
+            self.args.admission_dir or os.path.join(str(self.args.work_dir), 'bd2k-admission'),
+            cpus=self.args.max_cores or self.cpu_count, memory=self.args.max_memory)
+
+        # Tool images are made present on a host, each pulled or loaded once, before its first container starts
+        self.images = ImageStager(os.path.join(str(self.args.work_dir), 'bd2k-images'),
+                                  tarball_dir=self.args.image_dir)
+
+        # Optional warm containers, one per tool image, that tool calls exec into
+        self.pool = ContainerPool(self.work_dir) if self.args.warm_containers else None
+
+        # Remaining consumers of the files in work_dir, which are removed when they have none left
+        self.refs = RefCounts(self.work_dir)
+
         # TODO: Should this be a jobTree method of target? "Given a key, tell me if a file is linked to it"
         # Set of symbolic_inputs that have a FileStoreID linked to a file -- removed as not useful.
         # self.StoredSet = set()
 
-    def unavoidable_download_method(self, target, name):
+    def unavoidable_download_method(self, target, name, consumers=()):
         """
         Downloads file if not present from supplied URL.
         Updates the FileStoreID to point to a file.
         :name: Key from self.input_urls.
+        :consumers: Fed the bytes of the file as it downloads (see tee), or from disk if it is already there
         :returns: Path to file (work_dir path)
         :rtype: str
         """
@@ -91,37 +236,179 @@ class SupportClass(object):
         # Create necessary directories if not present
         self.mkdir_p(self.work_dir)
 
-        # Check if file exists, download if not presente
-        if not os.path.exists(file_path):
-            try:
-                subprocess.check_call(['curl', '-fs', self.input_urls[name], '-o', file_path])
-            except subprocess.CalledProcessError:
-                raise RuntimeError('\nNecessary file could not be acquired: {}. Check input URL')
-            except OSError:
-                raise RuntimeError('Failed to find "curl". Install via "apt-get install curl"')
+        # Check if file exists, download if not presente.  A file with a manifest is a partial download to resume.
+        if not os.path.exists(file_path) or os.path.exists(manifest_path(file_path)):
+            with self.instrument.span('download', name) as span:
+                if name in self.cached_inputs:
+                    self.cache.fetch(self.input_urls[name], file_path, consumers=consumers)
+                else:
+                    self.download(self.input_urls[name], file_path, consumers=consumers)
+                span['bytes'] = os.path.getsize(file_path)
+        elif consumers:
+            feed_file(file_path, consumers)
 
         assert os.path.exists(file_path)
 
         # Update FileStoreID
-        target.updateGlobalFile(self.ids[name], file_path)
+        self.update_global_file(target, name, file_path)
+
+        return file_path
 
+    def staged_input(self, target, name):
+        """
+        Returns the path in work_dir of a file already in the FileStore: an input staged by stage_input, or an index.
+        On the host that stored it the file is already in work_dir; elsewhere it is read from the FileStore once.
+        :name: Key from self.ids
+        :rtype: str
+        """
+        file_path = self.local_path(name)
+        self.mkdir_p(self.work_dir)
+        # Targets sharing work_dir that need the same file wait for the first to read it, rather than each reading it
+        lock = os.path.join(self.work_dir, '.{}.lock'.format(os.path.basename(file_path)))
+        with flocked(lock):
+            if not os.path.exists(file_path):
+                self.read_and_rename_global_file(target, self.ids[name], os.path.splitext(file_path)[1], file_path)
         return file_path
 
-    def docker_call(self, tool_command, tool_name):
+    def stage_inputs(self, target, names, parallelism=None):
+        """
+        Stages several files like staged_input, concurrently, so a target waits for the slowest of them rather than
+        for all of them in turn.
+        :names: Keys from self.ids
+        :parallelism: Files staged at once.  Defaults to --staging_threads.
+        :returns: {name: path in work_dir}
+        :rtype: dict
+        """
+        names = list(names)
+        pool = ThreadPool(max(1, min(parallelism or self.args.staging_threads, len(names))))
+        try:
+            paths = pool.map(lambda name: self.staged_input(target, name), names)
+        finally:
+            pool.close()
+            pool.join()
+        return dict(zip(names, paths))
+
+    def consumers(self):
+        """
+        Consumers of the inputs, from the targets laid out by start_node: every pair reads the shared inputs and the
+        reference's indexes, and releases them when its shards are done, as it does its own BAMs and their indexes.
+        :returns: {file name in work_dir: consumers}
+        """
+        counts = {}
+        for name in self.shared_inputs + ['ref.fai', 'ref.dict']:
+            counts[os.path.basename(self.local_path(name))] = len(self.pairs)
+        for pair in self.pairs:
+            for name in self.pair_inputs(pair):
+                counts[os.path.basename(self.local_path(name))] = 1
+        return counts
+
+    @staticmethod
+    def pair_inputs(pair):
+        """
+        :returns: Symbolic names of the inputs of a pair: its BAMs and their indexes
+        """
+        return ['{}.{}.{}'.format(pair, sample, ext) for sample in ['normal', 'tumor'] for ext in ['bam', 'bai']]
+
+    def release(self, names):
+        """
+        Releases files in work_dir that a target is done with, removing those no other target will read.
+        :names: Keys from self.ids
+        """
+        freed = self.refs.release([os.path.basename(self.local_path(name)) for name in names])
+        self.instrument.disk(self.refs.sample())
+        return freed
+
+    def local_path(self, name):
+        """
+        :name: Key from self.ids
+        :returns: Where the file of name goes in work_dir
+        """
+        return os.path.join(self.work_dir, self.file_names.get(name, name))
+
+    def stream_indexers(self, name):
+        """
+        Consumers that build the indexes of an input from its download stream.
+        :name: Key from self.input_urls
+        :returns: {symbolic name of the index: consumer}.  One consumer may build several indexes.
+        """
+        file_path = self.local_path(name)
+        if name == 'ref.fasta':
+            fasta = FastaIndexer(self.local_path('ref.fai'), self.local_path('ref.dict'),
+                                 'file:' + self.docker_path(file_path))
+            return {'ref.fai': fasta, 'ref.dict': fasta}
+        if name.endswith(('.normal.bam', '.tumor.bam')):
+            # samtools reads the BAM through a named pipe in work_dir, where the container can see it
+            index = name[:-len('.bam')] + '.bai'
+            fifo = file_path + '.stream'
+            command = 'samtools index {} {}'.format(self.docker_path(fifo), self.docker_path(self.local_path(index)))
+            return {index: PipeSink(fifo, lambda: self.docker_call(command, tool_name='samtools'))}
+        return {}
+
+    def java_heap(self, tool_name):
+        """
+        JVM heap for a Java tool: its declared memory less headroom for the JVM's own overhead.
+        :returns: Heap size for -Xmx, e.g. '4915m'
+        """
+        return '{}m'.format(int(self.resources[tool_name]['memory'] * 1024 * 0.8))
+
+    def docker_call(self, tool_command, tool_name, inputs=(), outputs=()):
         """
         Makes subprocess call of a command to a docker container.
         Abstracts away the docker commands needed to run the tool.
+        The container is limited to the tool's declared resources, and only starts once they are free on the host.
+        With --warm_containers the command is exec'd in the tool's warm container instead, started with the same
+        limits.  Its tool span then has no peak memory or CPU time: the container's cgroup is shared by every call
+        exec'd in it.
+        A call that declares its outputs is memoized: when the same image and command already ran on inputs with the
+        same contents, the stored outputs are staged instead.
         :type tool_command: str
         :type tool_name: str
         :param tool_name: a key to the dictionary self.tools
+        :param inputs: work_dir paths of the files the command reads
+        :param outputs: work_dir paths of the files the command writes
         """
-        base_docker_call = 'sudo docker run -v {}:/data'.format(self.work_dir)
+        if outputs:
+            key = self.artifacts.key(self.tools[tool_name], tool_command, inputs)
+            start = time.time()
+            if self.artifacts.memoize(key, outputs, lambda: self.docker_call(tool_command, tool_name)):
+                self.instrument.add({'category': 'memo_hit', 'name': tool_name, 'start': start, 'end': time.time()})
+            return
+
+        self.stage_images()
+        resources = self.resources[tool_name]
+        image = self.tools[tool_name]
+        cid_dir = tempfile.mkdtemp()
+        base_docker_call = 'sudo docker run --cidfile {} --cpus={} --memory={}m -v {}:/data'.format(
+            os.path.join(cid_dir, 'cid'), resources['cpus'], int(resources['memory'] * 1024), self.work_dir)
         try:
-            subprocess.check_call(base_docker_call.split() + [self.tools[tool_name]] + tool_command.split())
+            queued = time.time()
+            with self.admission.reserve(resources['cpus'], resources['memory']):
+                self.instrument.add({'category': 'admission_wait', 'name': tool_name, 'start': queued,
+                                     'end': time.time()})
+                if self.pool is not None:
+                    with self.instrument.span('container_start', tool_name):
+                        self.pool.ensure(image, resources['cpus'], resources['memory'])
+                    with self.instrument.span('tool', tool_name):
+                        self.pool.execute(image, tool_command.split(), resources['cpus'], resources['memory'])
+                else:
+                    with self.instrument.container(tool_name, os.path.join(cid_dir, 'cid')):
+                        subprocess.check_call(base_docker_call.split() + [image] + tool_command.split())
         except subprocess.CalledProcessError:
             raise RuntimeError('docker command returned a non-zero exit status. Check error logs.')
         except OSError:
             raise RuntimeError('docker not found on system. Install on all nodes.')
+        finally:
+            shutil.rmtree(cid_dir)
+
+    def stage_images(self):
+        """
+        Makes every tool image present on this host, pulling those that are not in parallel.  The first target on a
+        host to call it pulls them; others on the host wait for it rather than pulling them again.
+        """
+        if set(self.tools.values()) <= self.images.staged:
+            return
+        with self.instrument.span('image_pull') as span:
+            span['images'] = self.images.stage_all(self.tools.values())
 
     @staticmethod
     def docker_path(filepath):
@@ -133,150 +420,315 @@ class SupportClass(object):
         :new_extension: Adds an extension to the file at the file_path.
         :alternate_name: A path to a filename that you want to use. (allows directory control as well as name)
         """
-        name = target.readGlobalFile(file_store_id)
-        new_name = os.path.splitext(name if alternate_name is None else alternate_name)[0] + new_extension
-        #new_name = os.path.splitext(name if diff_name is None else os.path.join(self.work_dir, os.path.basename(diff_name)))[0] + new_extension
-        shutil.move(name, new_name)
+        with self.instrument.span('filestore_read', os.path.basename(alternate_name or '')) as span:
+            name = target.readGlobalFile(file_store_id)
+            new_name = os.path.splitext(name if alternate_name is None else alternate_name)[0] + new_extension
 
-        # Move to work_dir so docker mount works
-        shutil.move(new_name, os.path.join(self.work_dir, os.path.basename(new_name)))
+            # Stage straight into work_dir under the new name, so docker mount works: hard link, reflink or one copy
+            file_path = os.path.join(self.work_dir, os.path.basename(new_name))
+            copied = stage_file(name, file_path)
+            span.update(bytes=os.path.getsize(file_path), copied=copied)
 
-        return os.path.join(self.work_dir, os.path.basename(new_name))
+            # A copy leaves jobTree's own copy behind in the target's temp dir until the target ends
+            if copied and name.startswith(target.getLocalTempDir()):
+                os.remove(name)
+        self.instrument.disk(self.refs.sample())
+        target.logToMaster('Staged {}: {} bytes copied'.format(file_path, copied))
 
-    @staticmethod
-    def mkdir_p(path):
+        return file_path
+
+    def update_global_file(self, target, name, file_path):
         """
-        The equivalent of mkdir -p
-        https://github.com/BD2KGenomics/bd2k-python-lib/blob/master/src/bd2k/util/files.py
+        Stores file_path in the FileStoreID of name
+        :name: Key from self.ids
         """
-        try:
-            os.makedirs(path)
-        except OSError as exc:
-            if exc.errno == errno.EEXIST and os.path.isdir(path):
-                pass
-            else:
-                raise
+        with self.instrument.span('filestore_update', name) as span:
+            target.updateGlobalFile(self.ids[name], file_path)
+            span['bytes'] = os.path.getsize(file_path)
+        self.instrument.disk(self.refs.sample())
+
+    mkdir_p = staticmethod(mkdir_p)
+
+
+def instrumented(func):
+    """
+    Records a target function's timings and I/O with sclass.instrument.  The record is labelled with the target's
+    arguments, like "mutect_shard P0 3".
+    """
+    @functools.wraps(func)
+    def wrapper(target, sclass, *args):
+        label = ' '.join([func.__name__] + [str(a) for a in args if not isinstance(a, (list, tuple))])
+        with sclass.instrument.target(func.__name__, label):
+            return func(target, sclass, *args)
+    return wrapper
+
+
+def start_node(target, args, input_urls, pairs):
+    sclass = SupportClass(target, args, input_urls, pairs)
+
+    with sclass.instrument.target('start_node'):
+        # Consumers of every input are counted before any is staged
+        sclass.refs.add(sclass.consumers())
+
+        # Tool images are pulled while the shared inputs download, and before the pairs' tool targets are released
+        target.addChildTargetFn(pull_images, (sclass,))
+
+        # Inputs shared by every pair, and the reference's indexes, are downloaded and stored exactly once
+        for name in sclass.shared_inputs:
+            target.addChildTargetFn(stage_input, (sclass, name))
+        target.setFollowOnTargetFn(start_pairs, (sclass,))
+
+
+@instrumented
+def pull_images(target, sclass):
+    """
+    Pulls the image of every tool, or loads it from --image_dir, on this host.  Other hosts stage them the same way,
+    once each, before their first tool call.
+    """
+    sclass.stage_images()
+    target.logToMaster('Tool images: {}'.format(', '.join(sorted(sclass.tools.values()))))
+
+
+@instrumented
+def start_pairs(target, sclass):
+    """
+    Deals the pairs out to --concurrent_pairs lanes.  Lanes run in parallel, and each runs its pairs one after another.
+    """
+    lanes = max(1, min(sclass.args.concurrent_pairs, len(sclass.pairs)))
+    for lane in xrange(lanes):
+        target.addChildTargetFn(run_lane, (sclass, sclass.pairs[lane::lanes]))
+    target.setFollowOnTargetFn(teardown, (sclass,))
+
+
+@instrumented
+def run_lane(target, sclass, pairs):
+    target.addChildTargetFn(start_pair, (sclass, pairs[0]))
+    if pairs[1:]:
+        target.setFollowOnTargetFn(run_lane, (sclass, pairs[1:]))
 
 
-def start_node(target, args, input_urls):
-    sclass = SupportClass(target, args, input_urls)
+@instrumented
+def start_pair(target, sclass, pair):
+    for sample in ['normal', 'tumor']:
+        target.addChildTargetFn(stage_input, (sclass, '{}.{}.bam'.format(pair, sample)))
+    target.setFollowOnTargetFn(mutect_scatter, (sclass, pair))
 
-    target.addChildTargetFn(create_reference_index, (sclass,))
-    target.addChildTargetFn(create_reference_dict, (sclass,))
-    target.addChildTargetFn(create_normal_index, (sclass,))
-    target.addChildTargetFn(create_tumor_index, (sclass,))
-    target.setFollowOnTargetFn(mutect, (sclass,))
+
+@instrumented
+def stage_input(target, sclass, name):
+    """
+    Downloads one input and stores it in its FileStoreID.  The indexes of the reference and the BAMs are built from
+    the download as it streams in, and stored too, so they are ready when it finishes.  An index that could not be
+    built that way is made by its tool instead.
+    """
+    sclass.mkdir_p(sclass.work_dir)
+    indexers = sclass.stream_indexers(name)
+    tee = Tee(set(indexers.values()))
+    md5 = MD5Sink()
+    file_path = sclass.unavoidable_download_method(target, name, consumers=[tee, md5])
+    tee.close()
+
+    # The content hash that keys the tool steps reading this input, without reading it again
+    sclass.artifacts.record_hash(file_path, md5.hexdigest())
+
+    for index, indexer in indexers.items():
+        if tee.failed(indexer):
+            target.logToMaster('Building {} from the stream failed, running its tool: {}'.format(
+                index, tee.errors[indexer]))
+            if index in index_tools:
+                index_tools[index](target, sclass)
+            else:
+                create_bam_index(target, sclass, name)
+        else:
+            sclass.update_global_file(target, index, sclass.local_path(index))
 
 
+@instrumented
 def create_reference_index(target, sclass):
     """
     Uses Samtools to create reference index file (.fasta.fai)
     """
-    # Retrieve reference & store in FileStoreID
-    ref_path = sclass.unavoidable_download_method(target, 'ref.fasta')
+    # Retrieve staged reference
+    ref_path = sclass.staged_input(target, 'ref.fasta')
 
     # Tool call
     command = 'samtools faidx {}'.format(sclass.docker_path(ref_path))
-    sclass.docker_call(command, tool_name='samtools')
+    sclass.docker_call(command, tool_name='samtools', inputs=[ref_path], outputs=[ref_path + '.fai'])
 
     # Update FileStoreID of output
-    target.updateGlobalFile(sclass.ids['ref.fai'], ref_path + '.fai')
+    sclass.update_global_file(target, 'ref.fai', ref_path + '.fai')
 
 
+@instrumented
 def create_reference_dict(target, sclass):
     """
     Uses Picardtools to create reference dictionary (.dict)
     """
-    # Retrieve reference & store in FileStoreID
-    ref_path = sclass.unavoidable_download_method(target, 'ref.fasta')
+    # Retrieve staged reference
+    ref_path = sclass.staged_input(target, 'ref.fasta')
 
     # Tool call
     output = os.path.splitext(sclass.docker_path(ref_path))[0]
     command = 'picard-tools CreateSequenceDictionary R={} O={}.dict'.format(sclass.docker_path(ref_path), output)
-    sclass.docker_call(command, tool_name='picard')
+    sclass.docker_call(command, tool_name='picard', inputs=[ref_path],
+                       outputs=[os.path.splitext(ref_path)[0] + '.dict'])
 
     # Update FileStoreID
-    target.updateGlobalFile(sclass.ids['ref.dict'], os.path.splitext(ref_path)[0] + '.dict')
+    sclass.update_global_file(target, 'ref.dict', os.path.splitext(ref_path)[0] + '.dict')
 
 
-def create_normal_index(target, sclass):
-    # Retrieve normal bam
-    normal_path = sclass.unavoidable_download_method(target, 'normal.bam')
+@instrumented
+def create_bam_index(target, sclass, name):
+    """
+    Uses Samtools to index a staged BAM (.bam.bai)
+    :name: Symbolic name of the BAM, <pair>.normal.bam or <pair>.tumor.bam
+    """
+    # Retrieve staged bam
+    bam_path = sclass.staged_input(target, name)
 
     # Tool call
-    command = 'samtools index {}'.format(sclass.docker_path(normal_path))
-    sclass.docker_call(command, tool_name='samtools')
+    command = 'samtools index {}'.format(sclass.docker_path(bam_path))
+    sclass.docker_call(command, tool_name='samtools', inputs=[bam_path], outputs=[bam_path + '.bai'])
 
     # Update FileStoreID
-    target.updateGlobalFile(sclass.ids['normal.bai'], normal_path + '.bai')
+    sclass.update_global_file(target, name[:-len('.bam')] + '.bai', bam_path + '.bai')
 
 
-def create_tumor_index(target, sclass):
-    # Retrieve tumor bam
-    tumor_path = sclass.unavoidable_download_method(target, 'tumor.bam')
+# Tools that build an index of the reference, when it could not be built from the download stream
+index_tools = {'ref.fai': create_reference_index,
+               'ref.dict': create_reference_dict}
 
-    # Tool call
-    command = 'samtools index {}'.format(sclass.docker_path(tumor_path))
-    sclass.docker_call(command, tool_name='samtools')
 
-    # Update FileStoreID
-    target.updateGlobalFile(sclass.ids['tumor.bai'], tumor_path + '.bai')
-
-
-def mutect(target, sclass):
-    # Retrieve inputs that are not in FileStore
-    mutect_path = sclass.docker_path(sclass.unavoidable_download_method(target, 'mutect.jar'))
-    dbsnp_path = sclass.docker_path(sclass.unavoidable_download_method(target, 'dbsnp.vcf'))
-    cosmic_path = sclass.docker_path(sclass.unavoidable_download_method(target, 'cosmic.vcf'))
-
-    # TODO: Figure out how to refactor... the renaming convention makes it difficult.
-    # TODO: Otherwise, I would just iterate over the sclass.StoredSet() object.
-    normal_bam = sclass.read_and_rename_global_file(target, sclass.ids['normal.bam'], '.bam')
-    tumor_bam = sclass.read_and_rename_global_file(target, sclass.ids['tumor.bam'], '.bam')
-    ref_fasta = sclass.read_and_rename_global_file(target, sclass.ids['ref.fasta'], '.fasta')
-    sclass.read_and_rename_global_file(target, sclass.ids['normal.bai'], '.bai', normal_bam)
-    sclass.read_and_rename_global_file(target, sclass.ids['tumor.bai'], '.bai', tumor_bam)
-    sclass.read_and_rename_global_file(target, sclass.ids['ref.fai'], '.fasta.fai', ref_fasta)
-    sclass.read_and_rename_global_file(target, sclass.ids['ref.dict'], '.dict', ref_fasta)
-
-    # TODO: Fix this... having to recast these variables is clunky.
-    normal_bam = sclass.docker_path(normal_bam)
-    tumor_bam = sclass.docker_path(tumor_bam)
-    ref_fasta = sclass.docker_path(ref_fasta)
+@instrumented
+def mutect_scatter(target, sclass, pair):
+    """
+    Splits the reference into balanced interval shards, from its sequence dictionary, and runs MuTect on each one.
+    """
+    contigs = read_dict(sclass.staged_input(target, 'ref.dict'))
+    shard_size = sclass.args.shard_size and int(sclass.args.shard_size * 10 ** 6)
+    shards = shard_intervals(contigs, sclass.args.shards, shard_size)
 
-    # Output VCF
-    normal_uuid = sclass.input_urls['normal.bam'].split('/')[-1].split('.')[0]
-    tumor_uuid = sclass.input_urls['tumor.bam'].split('/')[-1].split('.')[0]
-    output = sclass.docker_path('{}-normal:{}-tumor.vcf'.format(normal_uuid, tumor_uuid))
-    mut_out = sclass.docker_path('mutect.out')
-    mut_cov = sclass.docker_path('mutect.cov')
+    # FileStoreIDs for the outputs of every shard, added before sclass is passed on
+    for i in xrange(len(shards)):
+        for output in ['vcf', 'out', 'cov']:
+            sclass.ids['{}.mutect-{}.{}'.format(pair, i, output)] = target.getEmptyFileStoreID()
 
-    # Tool call
-    command = 'java -Xmx{0}g -jar {1} ' \
+    # The outputs of the shards are read by the gather alone
+    sclass.refs.add({'{}.mutect-{}.{}'.format(pair, i, output): 1
+                     for i in xrange(len(shards)) for output in ['vcf', 'out', 'cov']})
+
+    for i, intervals in enumerate(shards):
+        target.addChildTargetFn(mutect_shard, (sclass, pair, i, intervals))
+    target.setFollowOnTargetFn(mutect_gather, (sclass, pair, len(shards)))
+
+
+@instrumented
+def mutect_shard(target, sclass, pair, shard, intervals):
+    """
+    Runs MuTect over one shard's intervals
+    """
+    # Retrieve staged inputs and their indexes, all at once
+    names = ['mutect.jar', 'dbsnp.vcf', 'cosmic.vcf', '{}.normal.bam'.format(pair), '{}.tumor.bam'.format(pair),
+             'ref.fasta', '{}.normal.bai'.format(pair), '{}.tumor.bai'.format(pair), 'ref.fai', 'ref.dict']
+    staged = sclass.stage_inputs(target, names)
+    inputs = [staged[name] for name in names]
+    mutect_path, dbsnp_path, cosmic_path, normal_bam, tumor_bam, ref_fasta = map(sclass.docker_path, inputs[:6])
+
+    # Interval list for GATK's -L
+    interval_list = os.path.join(sclass.work_dir, '{}.mutect-{}.intervals'.format(pair, shard))
+    with open(interval_list, 'w') as f:
+        f.write('\n'.join(format_interval(interval) for interval in intervals) + '\n')
+    inputs.append(interval_list)
+
+    # Outputs of this shard
+    outputs = {output: '{}.mutect-{}.{}'.format(pair, shard, output) for output in ['vcf', 'out', 'cov']}
+
+    # Tool call.  The heap follows the memory declared for MuTect; shards wait for it to be free on their host.
+    heap = sclass.java_heap('mutect')
+    command = 'java -Xmx{0} -jar {1} ' \
               '--analysis_type MuTect ' \
               '--reference_sequence {2} ' \
               '--cosmic {3} ' \
               '--dbsnp {4} ' \
               '--input_file:normal {5} ' \
               '--input_file:tumor {6} ' \
+              '--intervals {7} ' \
               '--tumor_lod 10 ' \
-              '--out {7} ' \
-              '--coverage_file {8} ' \
-              '--vcf {9} '.format(15, mutect_path, ref_fasta, cosmic_path, dbsnp_path, normal_bam,
-                                  tumor_bam, mut_out, mut_cov, output)
-    sclass.docker_call(command, tool_name='mutect')
+              '--out {8} ' \
+              '--coverage_file {9} ' \
+              '--vcf {10} '.format(heap, mutect_path, ref_fasta, cosmic_path, dbsnp_path, normal_bam, tumor_bam,
+                                   sclass.docker_path(interval_list), sclass.docker_path(outputs['out']),
+                                   sclass.docker_path(outputs['cov']), sclass.docker_path(outputs['vcf']))
+    sclass.docker_call(command, tool_name='mutect', inputs=inputs,
+                       outputs=[os.path.join(sclass.work_dir, name) for name in outputs.values()])
+
+    # Update FileStoreIDs
+    for name in outputs.values():
+        sclass.update_global_file(target, name, os.path.join(sclass.work_dir, name))
+    os.remove(interval_list)
+
+
+@instrumented
+def mutect_gather(target, sclass, pair, shards):
+    """
+    Merges the VCFs, call stats and coverage of every shard, in shard order, which is reference order.
+    The shards are done with the pair's inputs and the pair's share of the shared inputs, which are released first.
+    """
+    sclass.release(sclass.pair_inputs(pair) + sclass.shared_inputs + ['ref.fai', 'ref.dict'])
+
+    names = {output: ['{}.mutect-{}.{}'.format(pair, i, output) for i in xrange(shards)]
+             for output in ['vcf', 'out', 'cov']}
+    staged = sclass.stage_inputs(target, sum(names.values(), []))
+
+    def shard_outputs(output):
+        return [staged[name] for name in names[output]]
+
+    # Output VCF
+    normal_uuid = sclass.input_urls['{}.normal.bam'.format(pair)].split('/')[-1].split('.')[0]
+    tumor_uuid = sclass.input_urls['{}.tumor.bam'.format(pair)].split('/')[-1].split('.')[0]
+    output = os.path.join(sclass.work_dir, '{}-normal:{}-tumor.vcf'.format(normal_uuid, tumor_uuid))
+
+    merge_vcfs(shard_outputs('vcf'), output)
+    merge_call_stats(shard_outputs('out'), os.path.join(sclass.work_dir, '{}.mutect.out'.format(pair)))
+    merge_call_stats(shard_outputs('cov'), os.path.join(sclass.work_dir, '{}.mutect.cov'.format(pair)))
 
     # Update FileStoreID
-    target.updateGlobalFile(sclass.ids['mutect.vcf'],
-                            os.path.join(sclass.work_dir, '{}-normal:{}-tumor.vcf'.format(normal_uuid, tumor_uuid)))
+    sclass.update_global_file(target, '{}.mutect.vcf'.format(pair), output)
+    sclass.release(sum(names.values(), []))
+
+    target.addChildTargetFn(teardown_pair, (sclass, pair))
 
-    target.addChildTargetFn(teardown, (sclass,))
+
+@instrumented
+def teardown_pair(target, sclass, pair):
+    """
+    Removes whatever files of a finished pair are left, like those no one counted on a host that does not share
+    work_dir
+    """
+    with sclass.instrument.span('teardown', pair):
+        for f in os.listdir(sclass.work_dir):
+            if f.startswith(pair + '.'):
+                os.remove(os.path.join(sclass.work_dir, f))
 
 
+@instrumented
 def teardown(target, sclass):
-    files = [os.path.join(sclass.work_dir, f) for f in os.listdir(sclass.work_dir) if 'tumor.vcf' not in f]
-    for f in files:
-        os.remove(f)
+    with sclass.instrument.span('teardown'):
+        files = [os.path.join(sclass.work_dir, f) for f in os.listdir(sclass.work_dir) if 'tumor.vcf' not in f]
+        for f in files:
+            os.remove(f)
+        if sclass.pool is not None:
+            sclass.pool.close()
+
+    target.addChildTargetFn(report, (sclass,))
+
+
+def report(target, sclass):
+    """
+    Writes the run report, from the records of every target, and logs its summary table
+    """
+    summary = write_report(sclass.instrument.report_dir)
+    target.logToMaster('Run report in {}\n{}'.format(sclass.instrument.report_dir, summary))
 
 
 if __name__ == '__main__':
@@ -285,19 +737,28 @@ if __name__ == '__main__':
     Stack.addJobTreeOptions(parser)
     args = parser.parse_args()
 
-    # URLs to rerieve initial input files
+    # URLs to rerieve initial input files shared by every pair
     input_urls = {'ref.fasta': args.reference,
-                  'normal.bam': args.normal,
-                  'tumor.bam': args.tumor,
                   'dbsnp.vcf': args.dbsnp,
                   'cosmic.vcf': args.cosmic,
                   'mutect.jar': args.mutect}
 
+    # Tumor/normal pairs: from the manifest, or the single pair given by --normal and --tumor
+    if args.manifest:
+        if args.normal or args.tumor:
+            parser.error('Give either --manifest or --normal and --tumor, not both')
+        pairs = parse_manifest(args.manifest)
+    elif args.normal and args.tumor:
+        pairs = [(args.normal.split('/')[-1].split('.')[0], args.normal, args.tumor)]
+    else:
+        parser.error('Give --normal and --tumor, or a --manifest of pairs')
+
     # Ensure user supplied URLs to files and that BAMs are in the appropriate format
-    for bam in [args.normal, args.tumor]:
-        if len(bam.split('/')[-1].split('.')) != 3:
-            raise RuntimeError('{} BAM is not in the appropriate format: \
-            UUID.normal.bam or UUID.tumor.bam'.format(str(bam).split('.')[1]))
+    for _, normal, tumor in pairs:
+        for bam in [normal, tumor]:
+            if len(bam.split('/')[-1].split('.')) != 3:
+                raise RuntimeError('{} BAM is not in the appropriate format: \
+                UUID.normal.bam or UUID.tumor.bam'.format(str(bam).split('.')[1]))
 
     # Create JobTree Stack which launches the jobs starting at the "Start Node"
-    i = Stack(Target.wrapTargetFn(start_node, args, input_urls)).startJobTree(args)
+    i = Stack(Target.wrapTargetFn(start_node, args, input_urls, pairs)).startJobTree(args)
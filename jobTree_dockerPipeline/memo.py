@@ -0,0 +1,136 @@
+"""
+Persistent memoization of tool steps
+
+A step is keyed by its docker image, its command with whitespace and JVM heap sizes normalized away, and the contents
+of its inputs.  Its outputs are kept in a local artifact store, so rerunning the pipeline after a late failure, in a new
+work_dir, finds the steps that already succeeded and stages their outputs instead of running them again.  The store
+has the layout and eviction of object_store, with a directory of outputs per step, locked while the step runs.
+
+    store_dir/tmp/<key>/        Outputs being stored, renamed into objects/ once all are in.
+    store_dir/hashes/<stat>     Content hash of a file, keyed by its device, inode, size and mtime, so that a file
+                                is only hashed once however many steps read it.  Holds the hash and the file's
+                                path.
+
+Every run stages its inputs into a new work_dir, under new inodes, so a hash is of no use once its file is removed, at
+teardown if not before.  Hashes of files that are gone or changed are evicted with the steps.
+"""
+import hashlib
+import os
+import shutil
+
+from files import mkdir_p
+from object_store import ObjectStore
+from staging import stage_file
+from tee import MD5Sink, feed_file
+
+
+class ArtifactStore(ObjectStore):
+    """
+    Outputs of tool steps, shared by every run on a host.
+    """
+    def key(self, image, command, inputs):
+        """
+        :param image: Docker image of the tool, with its tag
+        :param command: Command run in the container
+        :param inputs: Paths of the files the command reads
+        """
+        # Heap sizes do not change what a JVM tool writes, and raising one after an OOM must not invalidate the rest
+        words = [word for word in command.split() if not word.startswith(('-Xmx', '-Xms'))]
+        lines = [image, ' '.join(words)]
+        lines += sorted('{} {}'.format(os.path.basename(path), self.content_hash(path)) for path in inputs)
+        return hashlib.sha1('\n'.join(lines)).hexdigest()
+
+    def content_hash(self, path):
+        """
+        :returns: MD5 of the file at path, read from disk only if it is not already known
+        """
+        memo = self._hash_path(path)
+        try:
+            with open(memo) as f:
+                return f.readline().strip()
+        except IOError:
+            pass
+        md5 = MD5Sink()
+        feed_file(path, [md5])
+        self.record_hash(path, md5.hexdigest())
+        return md5.hexdigest()
+
+    def record_hash(self, path, digest):
+        """
+        Records the MD5 of a file computed elsewhere, for instance while it downloaded.
+        """
+        mkdir_p(os.path.join(self.root, 'hashes'))
+        memo = self._hash_path(path)
+        with open(memo + '.tmp', 'w') as f:
+            f.write('{}\n{}\n'.format(digest, os.path.abspath(path)))
+        os.rename(memo + '.tmp', memo)
+
+    def memoize(self, key, outputs, run):
+        """
+        Stages the outputs of the step key if it is stored, else runs it and stores its outputs.
+
+        :param outputs: Paths the step writes.  They are placed there on a hit.
+        :param run: Function that runs the step
+        :returns: True on a hit
+        """
+        self._makedirs()
+        path = self._object(key)
+
+        with self._lock(key):
+            hit = os.path.isdir(path)
+            if hit:
+                os.utime(path, None)
+                for output in outputs:
+                    stage_file(os.path.join(path, os.path.basename(output)), output)
+            else:
+                run()
+                self._store(key, outputs)
+
+        if not hit:
+            self.evict(keep=key)
+        return hit
+
+    def evict(self, keep=None):
+        """
+        Evicts steps as ObjectStore.evict does, and the hashes of files that are gone or have changed.
+        """
+        super(ArtifactStore, self).evict(keep)
+        hashes = os.path.join(self.root, 'hashes')
+        for name in os.listdir(hashes) if os.path.isdir(hashes) else []:
+            memo = os.path.join(hashes, name)
+            try:
+                with open(memo) as f:
+                    f.readline()
+                    path = f.readline().strip()
+                stale = not path or not os.path.exists(path) or self._hash_path(path) != memo
+            except (IOError, OSError):
+                continue
+            if stale:
+                try:
+                    os.remove(memo)
+                except OSError:
+                    pass
+
+    def _store(self, key, outputs):
+        tmp = os.path.join(self.root, 'tmp', key)
+        if os.path.exists(tmp):
+            shutil.rmtree(tmp)
+        os.mkdir(tmp)
+        for output in outputs:
+            if not os.path.exists(output):
+                shutil.rmtree(tmp)
+                raise RuntimeError('Step did not write its output {}'.format(output))
+            stored = os.path.join(tmp, os.path.basename(output))
+            stage_file(output, stored)
+            # Outputs are hard-linked into work dirs, so a tool writing to its input must not corrupt the store.
+            # Files written by a container may belong to root, in which case they cannot be changed anyway.
+            try:
+                os.chmod(stored, 0o444)
+            except OSError:
+                pass
+        os.rename(tmp, self._object(key))
+
+    def _hash_path(self, path):
+        st = os.stat(path)
+        return os.path.join(self.root, 'hashes', '{}-{}-{}-{!r}'.format(st.st_dev, st.st_ino, st.st_size,
+                                                                        st.st_mtime))
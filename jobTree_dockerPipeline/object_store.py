@@ -0,0 +1,102 @@
+"""
+Base of the host-local stores of the pipeline: the download cache and the artifact store
+
+Each keeps its objects, files or directories, under one directory, and evicts the least recently used above a budget:
+
+    root/objects/<key>     Completed objects, read-only.  mtime is the time of last use, for LRU eviction.
+    root/locks/<key>       flock'd while a key is filled or staged, so one host fills a key only once.
+    root/tmp/              Objects being filled, renamed into objects/ once complete.
+"""
+import errno
+import fcntl
+import os
+import shutil
+from contextlib import contextmanager
+
+from files import mkdir_p
+
+
+class ObjectStore(object):
+    """
+    Objects keyed by content, shared by all the targets, and all the runs, on one host.
+    """
+    def __init__(self, root, budget=None):
+        """
+        :param root: Directory of the store.  Keep it on the same filesystem as the work dirs so objects can be
+                     hard-linked instead of copied.
+        :param budget: Disk budget in bytes.  Least recently used objects are evicted above it.  Unlimited if None.
+        """
+        self.root = root
+        self.budget = budget
+
+    def size(self):
+        """
+        :returns: Bytes used by completed objects
+        """
+        return sum(size for _, size, _ in self._entries())
+
+    def evict(self, keep=None):
+        """
+        Removes least recently used objects until the store fits its budget.  Objects locked by another target are
+        skipped, and so is keep.
+        """
+        if self.budget is None:
+            return
+        entries = sorted(self._entries())
+        total = sum(size for _, size, _ in entries)
+        for _, size, key in entries:
+            if total <= self.budget:
+                break
+            if key == keep:
+                continue
+            with self._lock(key, blocking=False) as locked:
+                path = self._object(key)
+                if locked and os.path.lexists(path):
+                    if os.path.isdir(path):
+                        shutil.rmtree(path)
+                    else:
+                        os.remove(path)
+                    total -= size
+
+    def _makedirs(self):
+        for directory in ('objects', 'locks', 'tmp'):
+            mkdir_p(os.path.join(self.root, directory))
+
+    def _entries(self):
+        """
+        :returns: (time of last use, size, key) of every completed object
+        """
+        objects = os.path.join(self.root, 'objects')
+        entries = []
+        for key in os.listdir(objects) if os.path.isdir(objects) else []:
+            path = os.path.join(objects, key)
+            try:
+                if os.path.isdir(path):
+                    size = sum(os.path.getsize(os.path.join(path, f)) for f in os.listdir(path))
+                else:
+                    size = os.path.getsize(path)
+                entries.append((os.path.getmtime(path), size, key))
+            except OSError:
+                continue
+        return entries
+
+    def _object(self, key):
+        return os.path.join(self.root, 'objects', key)
+
+    @contextmanager
+    def _lock(self, key, blocking=True):
+        """
+        Yields True once the key's lock is held, or False if blocking is False and another target holds it.
+        """
+        with open(os.path.join(self.root, 'locks', key), 'a') as f:
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except IOError as e:
+                if e.errno not in (errno.EAGAIN, errno.EACCES):
+                    raise
+                yield False
+                return
+            try:
+                yield True
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
@@ -0,0 +1,286 @@
+"""
+Parallel, resumable HTTP downloads for large pipeline inputs
+
+A file is split into chunks that are fetched concurrently with HTTP Range requests and written in place into a
+preallocated file.  Finished chunks are recorded in a sidecar manifest (<path>.manifest), so a download that fails
+near the end of a 100 GB BAM only refetches the chunks it was missing.  The size, and the MD5 when it is known, are
+verified at the end.  Servers that ignore Range requests get a single stream.
+
+Consumers (see tee) are fed the file in order while it downloads: each chunk as soon as it and all the chunks before
+it are on disk, read back while it is still in the page cache.
+"""
+import json
+import os
+import re
+import threading
+import time
+import urllib2
+from collections import namedtuple
+
+from tee import MD5Sink
+
+RemoteFile = namedtuple('RemoteFile', ['size', 'etag', 'ranges'])
+
+_MB = 1024 ** 2
+
+
+def manifest_path(path):
+    return path + '.manifest'
+
+
+def probe(url, timeout=60):
+    """
+    Asks for the first byte of url, which tells in one request whether the server honours Range requests, the size of
+    the file and its ETag.  Unlike HEAD, this also works for presigned URLs signed for GET.
+    :rtype: RemoteFile
+    """
+    response = urllib2.urlopen(urllib2.Request(url, headers={'Range': 'bytes=0-0'}), timeout=timeout)
+    try:
+        headers = response.info()
+        content_range = headers.get('Content-Range', '')
+        match = re.match(r'bytes 0-0/(\d+)', content_range)
+        if response.getcode() == 206 and match:
+            return RemoteFile(int(match.group(1)), headers.get('ETag'), True)
+        length = headers.get('Content-Length')
+        return RemoteFile(int(length) if length is not None else None, headers.get('ETag'), False)
+    finally:
+        response.close()
+
+
+class ParallelDownloader(object):
+    """
+    Downloads a URL to a path: download(url, path, md5=None, consumers=())
+    """
+    def __init__(self, connections=8, chunk_size=64 * _MB, max_rate=None, retries=3, timeout=60):
+        """
+        :param connections: Number of concurrent Range requests
+        :param chunk_size: Bytes per Range request, and the unit of resumption
+        :param max_rate: Limit on the total throughput in bytes per second.  Unlimited if None.
+        :param retries: Attempts per chunk before the download fails (and can be resumed later)
+        :param timeout: Socket timeout in seconds
+        """
+        self.connections = connections
+        self.chunk_size = chunk_size
+        self.max_rate = max_rate
+        self.retries = retries
+        self.timeout = timeout
+
+    def __call__(self, url, path, md5=None, consumers=()):
+        """
+        :param md5: Expected MD5 of the file, as hex.  Defaults to the ETag when it is a plain MD5, as for S3 objects
+                    uploaded in one part.
+        :param consumers: Fed the bytes of the file in order as it downloads
+        :returns: path
+        """
+        try:
+            remote = probe(url, self.timeout)
+        except (IOError, urllib2.URLError) as e:
+            raise RuntimeError('\nNecessary file could not be acquired: {}. {}'.format(url, e))
+        throttle = _Throttle(self.max_rate)
+        etag = (remote.etag or '').strip('"').lower()
+        md5 = md5 or (etag if re.match(r'^[0-9a-f]{32}$', etag) else None)
+        checksum = MD5Sink()
+        consumers = list(consumers) + ([checksum] if md5 is not None else [])
+
+        if remote.ranges and remote.size:
+            self._ranged(url, path, remote, throttle, consumers)
+        else:
+            self._stream(url, path, throttle, consumers)
+
+        size = os.path.getsize(path)
+        if remote.size is not None and size != remote.size:
+            raise RuntimeError('Downloaded {} bytes of {}, expected {}'.format(size, url, remote.size))
+        if md5 is not None and checksum.hexdigest() != md5.lower():
+            os.remove(path)
+            raise RuntimeError('Download of {} does not match its MD5: {}'.format(url, md5))
+        return path
+
+    def _ranged(self, url, path, remote, throttle, consumers):
+        chunks = [(start, min(start + self.chunk_size, remote.size) - 1)
+                  for start in xrange(0, remote.size, self.chunk_size)]
+        manifest = _Manifest(path, url, remote, self.chunk_size)
+        pending = [i for i in xrange(len(chunks)) if i not in manifest.done]
+
+        # Preallocate, so every chunk can be written in place as soon as it arrives
+        with open(path, 'r+b' if os.path.exists(path) else 'wb') as f:
+            f.truncate(remote.size)
+
+        lock = threading.Lock()
+        failures = []
+        feed = _InOrder(path, chunks, consumers)
+        for i in sorted(manifest.done):
+            feed.completed(i)
+
+        def worker():
+            with open(path, 'r+b') as f:
+                while True:
+                    with lock:
+                        if not pending or failures:
+                            return
+                        i = pending.pop(0)
+                    try:
+                        self._fetch_chunk(url, f, chunks[i], throttle)
+                    except Exception as e:
+                        with lock:
+                            failures.append('bytes {}-{}: {}'.format(chunks[i][0], chunks[i][1], e))
+                        return
+                    manifest.mark(i)
+                    try:
+                        feed.completed(i)
+                    except Exception as e:
+                        with lock:
+                            failures.append('feeding bytes {}-{}: {}'.format(chunks[i][0], chunks[i][1], e))
+                        return
+
+        threads = [threading.Thread(target=worker) for _ in xrange(min(self.connections, len(pending)))]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        if failures:
+            raise RuntimeError('Download of {} failed, rerun to resume it. {}'.format(url, failures[0]))
+        manifest.remove()
+
+    def _fetch_chunk(self, url, f, chunk, throttle):
+        start, end = chunk
+        for attempt in xrange(self.retries):
+            try:
+                request = urllib2.Request(url, headers={'Range': 'bytes={}-{}'.format(start, end)})
+                response = urllib2.urlopen(request, timeout=self.timeout)
+                try:
+                    if response.getcode() != 206:
+                        raise IOError('server ignored the Range request')
+                    offset = start
+                    while offset <= end:
+                        block = response.read(min(_MB, end + 1 - offset))
+                        if not block:
+                            raise IOError('connection closed after {} bytes'.format(offset - start))
+                        throttle.consume(len(block))
+                        f.seek(offset)
+                        f.write(block)
+                        offset += len(block)
+                finally:
+                    response.close()
+                f.flush()
+                os.fsync(f.fileno())
+                return
+            except (IOError, urllib2.URLError):
+                if attempt == self.retries - 1:
+                    raise
+                time.sleep(2 ** attempt)
+
+    def _stream(self, url, path, throttle, consumers):
+        """
+        Single-stream download for servers without Range support.  It cannot be resumed.
+        """
+        for attempt in xrange(self.retries):
+            try:
+                response = urllib2.urlopen(url, timeout=self.timeout)
+                try:
+                    with open(path, 'wb') as f:
+                        for block in iter(lambda: response.read(_MB), b''):
+                            throttle.consume(len(block))
+                            f.write(block)
+                            for consumer in consumers:
+                                consumer.update(block)
+                finally:
+                    response.close()
+                return
+            except (IOError, urllib2.URLError) as e:
+                # Consumers have seen part of the file and cannot be rewound
+                if attempt == self.retries - 1 or consumers:
+                    raise RuntimeError('\nNecessary file could not be acquired: {}. {}'.format(url, e))
+                time.sleep(2 ** attempt)
+
+
+class _Manifest(object):
+    """
+    Sidecar file recording the chunks of a download that are on disk.  It is only trusted for the same URL, size,
+    ETag and chunk size.
+    """
+    def __init__(self, path, url, remote, chunk_size):
+        self.path = manifest_path(path)
+        self.header = {'url': url, 'size': remote.size, 'etag': remote.etag, 'chunk_size': chunk_size}
+        self.done = set()
+        self.lock = threading.Lock()
+        if os.path.exists(self.path) and os.path.exists(path):
+            try:
+                with open(self.path) as f:
+                    saved = json.load(f)
+            except ValueError:
+                saved = {}
+            if all(saved.get(k) == v for k, v in self.header.items()):
+                self.done = set(saved['done'])
+        self._write()
+
+    def mark(self, chunk):
+        with self.lock:
+            self.done.add(chunk)
+            self._write()
+
+    def remove(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def _write(self):
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(dict(self.header, done=sorted(self.done)), f)
+        os.rename(tmp, self.path)
+
+
+class _InOrder(object):
+    """
+    Feeds consumers the chunks of a ranged download in file order, whatever order they complete in.
+    """
+    def __init__(self, path, chunks, consumers):
+        self.path = path
+        self.chunks = chunks
+        self.consumers = consumers
+        self.done = set()
+        self.next = 0
+        self.lock = threading.Lock()
+
+    def completed(self, i):
+        if not self.consumers:
+            return
+        # Whichever worker completes the next chunk in order feeds every completed chunk after it
+        with self.lock:
+            self.done.add(i)
+            with open(self.path, 'rb') as f:
+                while self.next in self.done:
+                    start, end = self.chunks[self.next]
+                    f.seek(start)
+                    remaining = end + 1 - start
+                    while remaining:
+                        block = f.read(min(_MB, remaining))
+                        if not block:
+                            raise IOError('{} is shorter than expected'.format(self.path))
+                        remaining -= len(block)
+                        for consumer in self.consumers:
+                            consumer.update(block)
+                    self.done.discard(self.next)
+                    self.next += 1
+
+
+class _Throttle(object):
+    """
+    Token bucket shared by all the connections of one download.
+    """
+    def __init__(self, rate):
+        self.rate = rate
+        self.lock = threading.Lock()
+        self.next = time.time()
+
+    def consume(self, n):
+        if not self.rate:
+            return
+        with self.lock:
+            now = time.time()
+            self.next = max(self.next, now) + float(n) / self.rate
+            delay = self.next - now
+        if delay > 0:
+            time.sleep(delay)
+
@@ -0,0 +1,147 @@
+"""
+Reference counts of the files in a run's work_dir, so each is removed as soon as nothing left to run reads it
+
+The consumers of every staged file are known when the targets are laid out: each pair reads the shared inputs, a
+pair's shards read its BAMs and their indexes, and its gather reads the outputs of the shards.  They are counted up front
+with add(), and each consumer release()s the files it is done with.  A file whose count drops to zero is removed.
+
+    work_dir/.refcounts.json   Remaining consumers per file name, and the disk usage of work_dir: current and peak
+    work_dir/.refcounts.lock   flock'd while the ledger is read or changed
+
+The ledger lives in work_dir, so counting is complete when work_dir is on scratch shared by the hosts of a run.  A host
+that does not see the ledger written by start_node has no counts, and keeps its files until teardown, as it would
+without counting.
+
+Disk usage is measured by listing work_dir under the ledger's lock, so each process samples it at most once per
+interval, and release() samples it before removing anything, when it peaks.
+"""
+import errno
+import fcntl
+import json
+import os
+import time
+from contextlib import contextmanager
+
+from files import mkdir_p
+
+LEDGER = '.refcounts.json'
+LOCK = '.refcounts.lock'
+
+
+class RefCounts(object):
+    """
+    Remaining consumers of the files of one work_dir, shared by the targets that use it
+    """
+    def __init__(self, work_dir, interval=5.0):
+        """
+        :param work_dir: Directory of the files, and of the ledger
+        :param interval: Least seconds between two samples of disk usage by one process
+        """
+        self.work_dir = work_dir
+        self.ledger = os.path.join(work_dir, LEDGER)
+        self.lock = os.path.join(work_dir, LOCK)
+        self.interval = interval
+        self.sampled = None
+
+    def add(self, counts):
+        """
+        :param counts: {file name in work_dir: consumers to add}
+        """
+        with self._ledger() as ledger:
+            for name, count in counts.items():
+                ledger['counts'][name] = ledger['counts'].get(name, 0) + count
+
+    def release(self, names):
+        """
+        Drops one consumer of each file, and removes those that have none left.
+        :param names: File names in work_dir
+        :returns: Bytes freed
+        """
+        freed = 0
+        with self._ledger() as ledger:
+            self._sample(ledger)
+            for name in names:
+                # Files no one counted, like those on a host that does not share work_dir, are left to teardown
+                if name not in ledger['counts']:
+                    continue
+                ledger['counts'][name] -= 1
+                if ledger['counts'][name] > 0:
+                    continue
+                del ledger['counts'][name]
+                path = os.path.join(self.work_dir, name)
+                try:
+                    st = os.stat(path)
+                    os.remove(path)
+                    ledger['usage'] = max(0, ledger['usage'] - _allocated(st))
+                    freed += _allocated(st) if st.st_nlink == 1 else 0
+                except OSError as e:
+                    if e.errno != errno.ENOENT:
+                        raise
+        return freed
+
+    def sample(self):
+        """
+        Measures the disk usage of work_dir, and keeps the peak.  Within interval of this process's last sample, that
+        sample is returned instead.
+        :returns: Bytes used now
+        """
+        if self.sampled is not None and time.time() - self.sampled[0] < self.interval:
+            return self.sampled[1]
+        with self._ledger() as ledger:
+            self._sample(ledger)
+            usage = ledger['usage']
+        self.sampled = time.time(), usage
+        return usage
+
+    def peak(self):
+        """
+        :returns: Most bytes work_dir used at any sample
+        """
+        with self._ledger() as ledger:
+            return ledger['peak']
+
+    def _sample(self, ledger):
+        ledger['usage'] = disk_usage(self.work_dir)
+        ledger['peak'] = max(ledger['peak'], ledger['usage'])
+
+    @contextmanager
+    def _ledger(self):
+        """
+        Yields the ledger, locked, and saves it afterwards.
+        """
+        mkdir_p(self.work_dir)
+        with open(self.lock, 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                try:
+                    with open(self.ledger) as f:
+                        ledger = json.load(f)
+                except (IOError, ValueError):
+                    ledger = {'counts': {}, 'usage': 0, 'peak': 0}
+                yield ledger
+                tmp = self.ledger + '.tmp'
+                with open(tmp, 'w') as f:
+                    json.dump(ledger, f)
+                os.rename(tmp, self.ledger)
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def disk_usage(directory):
+    """
+    :returns: Bytes allocated to the files in directory.  Hard links to one file count once.  Files also linked from
+              outside directory, like those of the download cache, count too: the run needs them as much as the
+              rest, although removing them from directory frees nothing.
+    """
+    files = {}
+    for name in os.listdir(directory) if os.path.isdir(directory) else []:
+        try:
+            st = os.lstat(os.path.join(directory, name))
+        except OSError:
+            continue
+        files[st.st_ino] = st
+    return sum(_allocated(st) for st in files.values())
+
+
+def _allocated(st):
+    return getattr(st, 'st_blocks', 0) * 512 or st.st_size
@@ -0,0 +1,62 @@
+"""
+Places files into a work_dir without copying them when the filesystem allows it.
+"""
+import errno
+import fcntl
+import os
+import shutil
+
+# ioctl that makes a file share the extents of another (copy-on-write), on btrfs, XFS and other reflink filesystems
+FICLONE = 0x40049409
+
+# Errors of os.link meaning "not here", as opposed to a real failure
+_NO_LINK = (errno.EXDEV, errno.EPERM, errno.EMLINK, errno.ENOTSUP, errno.EOPNOTSUPP)
+
+
+def stage_file(src, dest):
+    """
+    Puts the contents of src at dest, leaving src in place: a hard link where possible, else a reflink, else one copy.
+    The file is staged under a temporary name and renamed to dest, so dest is replaced if it exists and is never seen
+    partly written.
+    :returns: Number of bytes copied, 0 when no data was copied
+    """
+    tmp = '{}.tmp.{}'.format(dest, os.getpid())
+    if os.path.lexists(tmp):
+        os.remove(tmp)
+    try:
+        copied = _stage(src, tmp)
+        os.rename(tmp, dest)
+    finally:
+        # Renaming a link over another link to the same file leaves both in place
+        if os.path.lexists(tmp):
+            os.remove(tmp)
+    return copied
+
+
+def _stage(src, dest):
+    try:
+        os.link(src, dest)
+        return 0
+    except OSError as e:
+        if e.errno not in _NO_LINK:
+            raise
+    if reflink(src, dest):
+        return 0
+    shutil.copyfile(src, dest)
+    return os.path.getsize(dest)
+
+
+def reflink(src, dest):
+    """
+    Clones src to dest, sharing their data blocks.
+    :returns: True if the filesystem supports it, else False with dest left absent
+    """
+    with open(src, 'rb') as s:
+        with open(dest, 'wb') as d:
+            try:
+                fcntl.ioctl(d.fileno(), FICLONE, s.fileno())
+                return True
+            except (IOError, OSError):
+                pass
+    os.remove(dest)
+    return False
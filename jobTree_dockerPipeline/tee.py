@@ -0,0 +1,232 @@
+"""
+Consumers fed with a download as it streams in, so checksums and indexes are ready when it finishes, without a second
+pass over the file.
+
+A consumer has update(block), called with the file's bytes in order, and close().
+"""
+import errno
+import fcntl
+import hashlib
+import os
+import string
+import threading
+import time
+
+_UPPER = string.maketrans(string.ascii_lowercase, string.ascii_uppercase)
+_MB = 1024 ** 2
+
+
+class Tee(object):
+    """
+    Feeds every block to several consumers.  A consumer that raises is dropped and its error kept, so a failing
+    indexer never fails the download it is fed from.
+    """
+    def __init__(self, consumers):
+        self.consumers = list(consumers)
+        self.errors = {}
+
+    def update(self, block):
+        for consumer in self.consumers:
+            if consumer not in self.errors:
+                try:
+                    consumer.update(block)
+                except Exception as e:
+                    self.errors[consumer] = e
+
+    def close(self):
+        for consumer in self.consumers:
+            try:
+                consumer.close()
+            except Exception as e:
+                self.errors.setdefault(consumer, e)
+
+    def failed(self, consumer):
+        return consumer in self.errors
+
+
+def feed_file(path, consumers, block_size=_MB):
+    """
+    Feeds a file already on disk to consumers.
+    """
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            for consumer in consumers:
+                consumer.update(block)
+
+
+class MD5Sink(object):
+
+    def __init__(self):
+        self.md5 = hashlib.md5()
+
+    def update(self, block):
+        self.md5.update(block)
+
+    def close(self):
+        pass
+
+    def hexdigest(self):
+        return self.md5.hexdigest()
+
+
+class FastaIndexer(object):
+    """
+    Builds the samtools .fai index and the Picard .dict sequence dictionary of a FASTA file from its bytes.
+    Sequence lines are counted in bulk rather than parsed one at a time, so it keeps up with a download.
+    """
+    def __init__(self, fai_path=None, dict_path=None, uri=None):
+        """
+        :param fai_path: Where to write the .fai, if wanted
+        :param dict_path: Where to write the .dict, if wanted
+        :param uri: Location of the FASTA recorded in the .dict's UR fields
+        """
+        self.fai_path = fai_path
+        self.dict_path = dict_path
+        self.uri = uri
+        self.offset = 0
+        self.header = None
+        self.sequence = None
+        self.sequences = []
+
+    def update(self, block):
+        pos, n = 0, len(block)
+        while pos < n:
+            if self.header is not None:
+                # Inside a header line
+                end = block.find('\n', pos)
+                end = n if end == -1 else end + 1
+                self.header.append(block[pos:end])
+                self.offset += end - pos
+                pos = end
+                if self.header[-1].endswith('\n'):
+                    self._start(''.join(self.header))
+                    self.header = None
+            else:
+                # Sequence lines, up to the next header.  '>' only ever starts a header line.
+                start = block.find('>', pos)
+                end = n if start == -1 else start
+                if end > pos:
+                    self._bases(block[pos:end])
+                    self.offset += end - pos
+                pos = end
+                if start != -1:
+                    self._finish()
+                    self.header = []
+
+    def close(self):
+        if self.header is not None:
+            self._start(''.join(self.header))
+        self._finish()
+        if self.fai_path:
+            with open(self.fai_path, 'w') as f:
+                for s in self.sequences:
+                    f.write('{name}\t{length}\t{offset}\t{line_bases}\t{line_width}\n'.format(**s))
+        if self.dict_path:
+            with open(self.dict_path, 'w') as f:
+                f.write('@HD\tVN:1.4\tSO:unsorted\n')
+                for s in self.sequences:
+                    f.write('@SQ\tSN:{name}\tLN:{length}\tM5:{md5}'.format(**s))
+                    f.write('\tUR:{}\n'.format(self.uri) if self.uri else '\n')
+
+    def _start(self, header):
+        self.sequence = {'name': header[1:].split()[0], 'offset': self.offset, 'bytes': 0, 'newlines': 0,
+                         'returns': 0, 'first_line': 0, 'first_done': False, 'md5': hashlib.md5()}
+
+    def _bases(self, data):
+        s = self.sequence
+        if s is None:
+            if data.strip():
+                raise ValueError('FASTA does not start with a header line')
+            return
+        position = s['bytes']
+        s['bytes'] += len(data)
+        s['newlines'] += data.count('\n')
+        s['returns'] += data.count('\r')
+        if not s['first_done']:
+            i = data.find('\n')
+            s['first_line'] += len(data) if i == -1 else i + 1
+            s['first_done'] = i != -1
+        if s['first_done']:
+            # samtools needs every line but the last to be as long as the first: a newline every line width
+            width = s['first_line']
+            ends = data[(width - 1 - position) % width::width]
+            if ends.count('\n') != len(ends):
+                raise ValueError('Lines of FASTA sequence {} are not all the same length'.format(s['name']))
+        if self.dict_path:
+            s['md5'].update(data.translate(_UPPER, '\r\n'))
+
+    def _finish(self):
+        s = self.sequence
+        if s is None:
+            return
+        self.sequence = None
+        length = s['bytes'] - s['newlines'] - s['returns']
+        terminator = 2 if s['returns'] else 1
+        line_bases = max(0, s['first_line'] - terminator) if s['first_done'] else length
+        line_width = s['first_line'] if s['first_done'] else length
+
+        if line_bases:
+            lines = -(-length // line_bases)
+            if s['newlines'] not in (lines, lines - 1):
+                raise ValueError('Lines of FASTA sequence {} are not all the same length'.format(s['name']))
+        self.sequences.append({'name': s['name'], 'length': length, 'offset': s['offset'], 'line_bases': line_bases,
+                               'line_width': line_width, 'md5': s['md5'].hexdigest()})
+
+
+class PipeSink(object):
+    """
+    Streams the bytes into a command that reads them from a named pipe, like an indexer running in a container.
+    """
+    def __init__(self, fifo, command):
+        """
+        :param fifo: Path of the named pipe to create
+        :param command: Function, run in a thread with no arguments, that reads the whole of fifo
+        """
+        self.fifo = fifo
+        self.error = None
+        self.pipe = None
+        if os.path.lexists(fifo):
+            os.remove(fifo)
+        os.mkfifo(fifo)
+        self.thread = threading.Thread(target=self._run, args=(command,))
+        self.thread.daemon = True
+        self.thread.start()
+
+    def update(self, block):
+        if self.pipe is None:
+            self.pipe = self._open()
+        self.pipe.write(block)
+
+    def close(self):
+        try:
+            if self.pipe is None:
+                self.pipe = self._open()
+            self.pipe.close()
+        finally:
+            self.thread.join()
+            os.remove(self.fifo)
+        if self.error is not None:
+            raise self.error
+
+    def _run(self, command):
+        try:
+            command()
+        except Exception as e:
+            self.error = e
+
+    def _open(self):
+        """
+        Opens the pipe once the command opens its end, without hanging if the command dies first.
+        """
+        while True:
+            try:
+                fd = os.open(self.fifo, os.O_WRONLY | os.O_NONBLOCK)
+            except OSError as e:
+                if e.errno != errno.ENXIO:
+                    raise
+                if not self.thread.is_alive():
+                    raise RuntimeError('Command exited before reading {}: {}'.format(self.fifo, self.error))
+                time.sleep(0.1)
+                continue
+            fcntl.fcntl(fd, fcntl.F_SETFL, fcntl.fcntl(fd, fcntl.F_GETFL) & ~os.O_NONBLOCK)
+            return os.fdopen(fd, 'wb')
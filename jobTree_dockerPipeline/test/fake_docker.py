@@ -0,0 +1,114 @@
+"""
+Stand-in for the docker CLI, shared by the tests of the modules that call it
+
+Containers, images on the host and images in the registry live in a JSON file next to the script, with every call
+made.  exec runs the command on the host.  A pull takes a while, so concurrent pulls overlap.
+"""
+import json
+import os
+import stat
+import sys
+
+SCRIPT = '''#!{python}
+import fcntl, json, os, subprocess, sys, time
+here = os.path.dirname(os.path.abspath(__file__))
+state_path = os.path.join(here, 'state.json')
+lock = open(os.path.join(here, 'state.lock'), 'a')
+
+def update(change):
+    fcntl.flock(lock, fcntl.LOCK_EX)
+    with open(state_path) as f:
+        state = json.load(f)
+    result = change(state)
+    with open(state_path, 'w') as f:
+        json.dump(state, f)
+    fcntl.flock(lock, fcntl.LOCK_UN)
+    return result
+
+def start(state):
+    if name in state['containers']:
+        return False
+    state['containers'][name] = {{'image': args[-2], 'running': True, 'label': args[args.index('--label') + 1]}}
+    return True
+
+args = sys.argv[1:]
+state = update(lambda state: state['calls'].append(args) or state)
+containers = state['containers']
+code = 0
+if args[0] == 'run':
+    name = args[args.index('--name') + 1]
+    if update(start):
+        print(name)
+    else:
+        sys.stderr.write('Conflict. The name is already in use\\n')
+        code = 125
+elif args[0] == 'inspect':
+    if args[-1] in containers:
+        print('true' if containers[args[-1]]['running'] else 'false')
+    else:
+        code = 1
+elif args[0] == 'exec':
+    name = args[3]
+    if not containers.get(name, {{}}).get('running'):
+        sys.stderr.write('Container is not running\\n')
+        code = 1
+    else:
+        code = subprocess.call(args[4:])
+elif args[0] == 'rm':
+    update(lambda state: [state['containers'].pop(name, None) for name in args[2:]])
+elif args[0] == 'ps':
+    label = args[-1].split('=', 1)[1]
+    for name, container in containers.items():
+        if container['label'] == label:
+            print(name)
+elif args[0] == 'images':
+    if args[-1] in state['images']:
+        print('0123456789ab')
+elif args[0] == 'pull':
+    if args[1] not in state['registry']:
+        sys.stderr.write('Error: image not found\\n')
+        code = 1
+    else:
+        update(lambda state: state['pulling'].append(args[1]))
+        time.sleep({delay})
+        update(lambda state: state['overlap'].append(len(state['pulling'])) or state['pulling'].remove(args[1]) or
+                             state['images'].append(args[1]))
+elif args[0] == 'load':
+    with open(args[2]) as f:
+        image = f.read().strip()
+    update(lambda state: state['images'].append(image))
+sys.exit(code)
+'''
+
+
+class FakeDocker(object):
+    """
+    The fake docker CLI, written to a directory, and the state it keeps there
+    """
+    def __init__(self, directory, delay=0, **state):
+        """
+        :param delay: Seconds a pull takes
+        :param state: Initial containers, images and registry
+        """
+        self.directory = directory
+        self.path = os.path.join(directory, 'docker')
+        with open(self.path, 'w') as f:
+            f.write(SCRIPT.format(python=sys.executable, delay=delay))
+        os.chmod(self.path, os.stat(self.path).st_mode | stat.S_IEXEC)
+        initial = {'containers': {}, 'images': [], 'registry': [], 'calls': [], 'pulling': [], 'overlap': []}
+        initial.update(state)
+        self.write_state(initial)
+
+    def state(self):
+        with open(os.path.join(self.directory, 'state.json')) as f:
+            return json.load(f)
+
+    def write_state(self, state):
+        with open(os.path.join(self.directory, 'state.json'), 'w') as f:
+            json.dump(state, f)
+
+    def calls(self, command):
+        """
+        :returns: Arguments of every call of command, in order
+        """
+        return [call for call in self.state()['calls'] if call[0] == command]
@@ -0,0 +1,112 @@
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from admission import AdmissionController
+
+
+class AdmissionControllerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.controller = AdmissionController(os.path.join(self.dir, 'admission'), cpus=4, memory=8, poll=0.01)
+        self.admitted = []
+        self.threads = []
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def waiting(self):
+        with self.controller._ledger() as ledger:
+            return [request for _, request in ledger['waiting']]
+
+    def request(self, name, cpus, memory, release):
+        """
+        Reserves in a thread of its own, like a target sharing the host, and holds the reservation until release is set
+        """
+        def run():
+            with self.controller.reserve(cpus, memory):
+                self.admitted.append(name)
+                release.wait()
+        waiting = len(self.waiting())
+        thread = threading.Thread(target=run)
+        thread.daemon = True
+        thread.start()
+        self.threads.append(thread)
+        self.until(lambda: len(self.waiting()) > waiting or name in self.admitted)
+
+    def until(self, condition, timeout=10):
+        deadline = time.time() + timeout
+        while not condition():
+            self.assertLess(time.time(), deadline, 'Timed out')
+            time.sleep(0.01)
+
+    def join(self):
+        for thread in self.threads:
+            thread.join(10)
+            self.assertFalse(thread.is_alive())
+
+    def test_fifo(self):
+        first, large, small = threading.Event(), threading.Event(), threading.Event()
+        self.request('first', 2, 1, first)
+        self.until(lambda: self.admitted == ['first'])
+
+        # The small request fits beside the first, but waits behind the large one that arrived before it
+        self.request('large', 3, 1, large)
+        self.request('small', 2, 1, small)
+        time.sleep(0.2)
+        self.assertEqual(['first'], self.admitted)
+        self.assertEqual((2, 1), self.controller.usage())
+
+        first.set()
+        self.until(lambda: self.admitted == ['first', 'large'])
+        self.assertEqual((3, 1), self.controller.usage())
+        large.set()
+        self.until(lambda: self.admitted == ['first', 'large', 'small'])
+        small.set()
+        self.join()
+        self.assertEqual((0, 0), self.controller.usage())
+        self.assertEqual([], self.waiting())
+
+    def test_capacity(self):
+        # A request larger than the host is capped to it, so it runs alone rather than never
+        big, small = threading.Event(), threading.Event()
+        self.request('big', 16, 100, big)
+        self.until(lambda: self.admitted == ['big'])
+        self.assertEqual((4, 8), self.controller.usage())
+
+        self.request('small', 1, 1, small)
+        time.sleep(0.2)
+        self.assertEqual(['big'], self.admitted)
+        big.set()
+        self.until(lambda: self.admitted == ['big', 'small'])
+        small.set()
+        self.join()
+
+    def test_dead_processes(self):
+        dead = subprocess.Popen(['true'])
+        dead.wait()
+        os.makedirs(self.controller.state_dir)
+        request = {'pid': dead.pid, 'cpus': 4, 'memory': 8}
+        with open(self.controller.ledger, 'w') as f:
+            json.dump({'running': {'killed': request}, 'waiting': [['queued', request]]}, f)
+
+        # Neither the reservation nor the place in line of a process that died holds anything
+        self.assertEqual((0, 0), self.controller.usage())
+        self.assertEqual([], self.waiting())
+        release = threading.Event()
+        self.request('alive', 4, 8, release)
+        self.until(lambda: self.admitted == ['alive'])
+        release.set()
+        self.join()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,93 @@
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from container_pool import ContainerPool
+from fake_docker import FakeDocker
+
+
+class ContainerPoolTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.docker = FakeDocker(self.dir)
+        self.pool = ContainerPool(os.path.join(self.dir, 'work'), docker=[self.docker.path])
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_reuse(self):
+        for _ in xrange(3):
+            self.pool.execute('jvivian/samtools:1.2', ['true'])
+        self.assertEqual(1, len(self.docker.calls('run')))
+        self.assertEqual(3, len(self.docker.calls('exec')))
+        self.assertEqual(['-w', '/data'], self.docker.calls('exec')[0][1:3])
+
+        self.pool.execute('jvivian/picardtools:1.113', ['true'])
+        self.assertEqual(2, len(self.docker.calls('run')))
+
+    def test_failure(self):
+        self.assertRaises(subprocess.CalledProcessError, self.pool.execute, 'jvivian/samtools:1.2', ['false'])
+        self.assertEqual(1, len(self.docker.calls('exec')), 'A failing tool must not be retried')
+
+    def test_restart(self):
+        self.pool.execute('jvivian/samtools:1.2', ['true'])
+        state = self.docker.state()
+        state['containers'][self.pool.name('jvivian/samtools:1.2')]['running'] = False
+        self.docker.write_state(state)
+
+        self.pool.execute('jvivian/samtools:1.2', ['true'])
+        self.assertEqual(2, len(self.docker.calls('run')))
+        self.assertTrue(self.pool.running('jvivian/samtools:1.2'))
+
+    def test_concurrent(self):
+        # Targets sharing a host reach a missing container at once, each with its own pool
+        failures = []
+
+        def execute():
+            try:
+                ContainerPool(os.path.join(self.dir, 'work'), docker=[self.docker.path]).execute(
+                    'jvivian/mutect:1.1.7', ['sleep', '0.1'])
+            except Exception as e:
+                failures.append(e)
+        threads = [threading.Thread(target=execute) for _ in xrange(6)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual([], failures)
+        self.assertEqual(1, len(self.docker.calls('run')))
+        self.assertEqual([], self.docker.calls('rm'), 'A running container must never be removed')
+        self.assertEqual(6, len(self.docker.calls('exec')))
+
+    def test_limits(self):
+        self.pool.execute('jvivian/mutect:1.1.7', ['true'], cpus=2, memory=4)
+        self.pool.execute('jvivian/mutect:1.1.7', ['true'], cpus=2, memory=4)
+        run = self.docker.calls('run')
+        self.assertEqual(1, len(run))
+        self.assertIn('--cpus=2', run[0])
+        self.assertIn('--memory=4096m', run[0])
+
+        # Other limits get a container of their own
+        self.pool.execute('jvivian/mutect:1.1.7', ['true'], cpus=1, memory=2)
+        self.assertEqual(2, len(self.docker.calls('run')))
+        self.assertTrue(self.pool.running('jvivian/mutect:1.1.7', cpus=2, memory=4))
+        self.assertFalse(self.pool.running('jvivian/mutect:1.1.7'))
+
+    def test_close(self):
+        other = ContainerPool(os.path.join(self.dir, 'other'), docker=[self.docker.path])
+        self.pool.execute('jvivian/samtools:1.2', ['true'])
+        self.pool.execute('jvivian/mutect:1.1.7', ['true'])
+        other.execute('jvivian/samtools:1.2', ['true'])
+
+        self.pool.close()
+        self.assertEqual([other.name('jvivian/samtools:1.2')], self.docker.state()['containers'].keys())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,77 @@
+import os
+import pickle
+import shutil
+import sys
+import tempfile
+import threading
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from fake_docker import FakeDocker
+from images import ImageStager, tarball
+
+
+class ImageStagerTest(unittest.TestCase):
+
+    images = ['jvivian/samtools:1.2', 'jvivian/picardtools:1.113', 'jvivian/mutect:1.1.7']
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.docker = FakeDocker(self.dir, delay=0.5, registry=self.images)
+        self.state_dir = os.path.join(self.dir, 'locks')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def stager(self, tarball_dir=None):
+        return ImageStager(self.state_dir, docker=[self.docker.path], tarball_dir=tarball_dir)
+
+    def test_parallel(self):
+        state = self.docker.state()
+        state['images'] = ['jvivian/samtools:1.2']
+        self.docker.write_state(state)
+
+        how = self.stager().stage_all(self.images)
+        self.assertEqual({'jvivian/samtools:1.2': 'present', 'jvivian/picardtools:1.113': 'pulled',
+                          'jvivian/mutect:1.1.7': 'pulled'}, how)
+        self.assertEqual(sorted(self.images), sorted(self.docker.state()['images']))
+        self.assertEqual(2, len(self.docker.calls('pull')))
+        self.assertEqual(2, max(self.docker.state()['overlap']), 'Missing images should be pulled at the same time')
+
+    def test_once_per_host(self):
+        # Targets sharing a host, each with its own stager
+        threads = [threading.Thread(target=self.stager().stage_all, args=(self.images,)) for _ in xrange(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(sorted(self.images), sorted(call[1] for call in self.docker.calls('pull')))
+
+        stager = self.stager()
+        stager.stage_all(self.images)
+        self.assertEqual(3, len(self.docker.calls('pull')))
+        calls = len(self.docker.state()['calls'])
+        self.assertEqual({}, stager.stage_all(self.images))
+        self.assertEqual(calls, len(self.docker.state()['calls']), 'Staged images are not checked again')
+
+        # A copy pickled for a target that may run on another host checks again
+        self.assertEqual(set(), pickle.loads(pickle.dumps(stager)).staged)
+
+    def test_tarball(self):
+        tarballs = os.path.join(self.dir, 'tarballs')
+        os.mkdir(tarballs)
+        with open(os.path.join(tarballs, tarball('jvivian/mutect:1.1.7')), 'w') as f:
+            f.write('jvivian/mutect:1.1.7')
+        state = self.docker.state()
+        state['registry'] = []
+        self.docker.write_state(state)
+
+        stager = self.stager(tarballs)
+        self.assertEqual('loaded', stager.stage('jvivian/mutect:1.1.7'))
+        self.assertEqual(['jvivian/mutect:1.1.7'], self.docker.state()['images'])
+        self.assertEqual([], self.docker.calls('pull'))
+        self.assertRaises(RuntimeError, stager.stage, 'jvivian/samtools:1.2')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,80 @@
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from instrument import build_report, critical_path, load_records, write_report
+
+# A run laid out like the pipeline's: start_node downloads the inputs in children, and its follow-on, a pair, waits
+# for all of them.  The pair's shards run as its children, and the gather, its follow-on, waits for the shards.
+# (id, parent, host, start, end, spans)
+RUN = [('start', None, 'node1', 0.0, 1.0, [('download', 0.2, 0.9, 100)]),
+       ('download_ref', 'start', 'node1', 1.0, 5.0, [('download', 1.0, 5.0, 3000)]),
+       ('download_dbsnp', 'start', 'node2', 1.0, 9.0, [('download', 1.0, 9.0, 5000)]),
+       ('pair', 'start', 'node2', 9.2, 10.0, [('filestore_read', 9.2, 9.5, 200)]),
+       ('shard0', 'pair', 'node1', 10.0, 14.0, [('tool', 10.5, 13.5, None)]),
+       ('shard1', 'pair', 'node2', 10.0, 20.0, [('container_start', 10.0, 10.5, None), ('tool', 10.5, 19.0, None),
+                                               ('filestore_update', 19.0, 20.0, 400)]),
+       ('gather', 'pair', 'node1', 20.1, 21.0, [('tool', 20.1, 20.6, None)])]
+
+
+class ReportTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        os.mkdir(os.path.join(self.dir, 'targets'))
+        disk = {'download_ref': 3000, 'shard0': 5000, 'shard1': 7000}
+        for target, parent, host, start, end, spans in RUN:
+            record = {'id': target, 'parent': parent, 'name': target, 'label': target, 'host': host, 'pid': 1,
+                      'start': start, 'end': end, 'status': 'ok',
+                      'spans': [{'category': category, 'name': target, 'start': s, 'end': e, 'bytes': size}
+                                for category, s, e, size in spans]}
+            if target in disk:
+                record['disk_peak'] = disk[target]
+            with open(os.path.join(self.dir, 'targets', target + '.json'), 'w') as f:
+                json.dump(record, f)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_critical_path(self):
+        records = load_records(self.dir)
+        self.assertEqual(len(RUN), len(records))
+        # The gather and the pair are follow-ons: each waited on the last of its creator's children to finish
+        self.assertEqual(['start', 'download_dbsnp', 'pair', 'shard1', 'gather'],
+                         [r['id'] for r in critical_path(records)])
+        self.assertEqual([], critical_path([]))
+
+    def test_report(self):
+        report = build_report(self.dir)
+        self.assertEqual((0.0, 21.0), (report['start'], report['end']))
+        starts = [r['start'] for r in report['targets']]
+        self.assertEqual(sorted(starts), starts)
+        download = report['totals']['download']
+        self.assertEqual((12.7, 8100, 3), (round(download['seconds'], 6), download['bytes'], download['count']))
+        self.assertEqual(3, report['totals']['tool']['count'])
+        self.assertEqual({'node1': 5000, 'node2': 7000}, report['disk_peak'])
+
+        steps = report['critical_path']
+        self.assertEqual(['start', 'download_dbsnp', 'pair', 'shard1', 'gather'], [s['id'] for s in steps])
+        self.assertEqual([1.0, 8.0, 0.8, 10.0, 0.9], [round(s['seconds'], 6) for s in steps])
+        self.assertEqual([0.0, 0.0, 0.2, 0.0, 0.1], [round(s['waited'], 6) for s in steps])
+
+        summary = write_report(self.dir)
+        self.assertTrue(summary.startswith('Run wall time: 21.0 s, 7 targets'))
+        self.assertIn('Peak work_dir disk usage', summary)
+        with open(os.path.join(self.dir, 'report.json')) as f:
+            self.assertEqual(steps, json.load(f)['critical_path'])
+
+    def test_empty(self):
+        shutil.rmtree(os.path.join(self.dir, 'targets'))
+        report = build_report(self.dir)
+        self.assertEqual(([], []), (report['targets'], report['critical_path']))
+        write_report(self.dir)
+
+
+if __name__ == '__main__':
+    unittest.main()
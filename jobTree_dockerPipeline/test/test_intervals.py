@@ -0,0 +1,96 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from intervals import format_interval, merge_call_stats, merge_vcfs, read_dict, read_fai, shard_intervals
+
+CONTIGS = [('chr1', 1000), ('chr2', 750), ('chrM', 17), ('chrUn_1', 3), ('chrX', 400)]
+
+VCF_HEADER = '##fileformat=VCFv4.1\n##source=MuTect\n#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\n'
+
+
+class IntervalsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def write(self, name, contents):
+        path = os.path.join(self.dir, name)
+        with open(path, 'w') as f:
+            f.write(contents)
+        return path
+
+    def test_read(self):
+        fai = self.write('ref.fasta.fai', ''.join('{}\t{}\t0\t60\t61\n'.format(*c) for c in CONTIGS))
+        ref_dict = self.write('ref.dict', '@HD\tVN:1.4\tSO:unsorted\n' +
+                              ''.join('@SQ\tSN:{}\tLN:{}\tM5:0\tUR:ref.fasta\n'.format(*c) for c in CONTIGS))
+        self.assertEqual(CONTIGS, read_fai(fai))
+        self.assertEqual(CONTIGS, read_dict(ref_dict))
+
+    def test_shards_cover_reference(self):
+        total = sum(length for _, length in CONTIGS)
+        for shards in (1, 2, 3, 7, 50, total, total + 10):
+            result = shard_intervals(CONTIGS, shards)
+            self.assertEqual(min(shards, total), len(result))
+
+            # Every base once, in dict order: each contig's intervals run on from 1 to its length
+            intervals = [interval for shard in result for interval in shard]
+            expected = []
+            for contig, length in CONTIGS:
+                covered = [(start, end) for c, start, end in intervals if c == contig]
+                self.assertEqual(1, covered[0][0])
+                self.assertEqual(length, covered[-1][1])
+                for (_, end), (start, _) in zip(covered, covered[1:]):
+                    self.assertEqual(end + 1, start)
+                expected += [contig] * len(covered)
+            self.assertEqual(expected, [contig for contig, _, _ in intervals])
+
+            # Balanced to within a base
+            sizes = [sum(end - start + 1 for _, start, end in shard) for shard in result]
+            self.assertEqual(total, sum(sizes))
+            self.assertLessEqual(max(sizes) - min(sizes), 1)
+
+    def test_shard_size(self):
+        self.assertEqual(5, len(shard_intervals(CONTIGS, shard_size=500)))
+        self.assertEqual(1, len(shard_intervals(CONTIGS, shards=4, shard_size=10 ** 6)))
+        self.assertEqual('chrUn_1:1-3', format_interval(('chrUn_1', 1, 3)))
+
+    def test_merge_vcfs(self):
+        shards = shard_intervals(CONTIGS, 4)
+        paths, records = [], []
+        for i, shard in enumerate(shards):
+            lines = ['{}\t{}\t.\tA\tT\t.\tPASS\t.\n'.format(contig, pos)
+                     for contig, start, end in shard for pos in sorted({start, (start + end) // 2, end})]
+            records += lines
+            paths.append(self.write('shard{}.vcf'.format(i), VCF_HEADER + ''.join(lines)))
+        paths.append(self.write('empty.vcf', VCF_HEADER))
+
+        merged = os.path.join(self.dir, 'merged.vcf')
+        merge_vcfs(paths, merged)
+        with open(merged) as f:
+            lines = f.readlines()
+        self.assertEqual(VCF_HEADER, ''.join(lines[:3]))
+        self.assertFalse(any(line.startswith('#') for line in lines[3:]))
+        self.assertEqual(records, lines[3:])
+
+        order = [contig for contig, _ in CONTIGS]
+        keys = [(order.index(line.split('\t')[0]), int(line.split('\t')[1])) for line in lines[3:]]
+        self.assertEqual(sorted(keys), keys)
+
+    def test_merge_call_stats(self):
+        header = '## muTector v1.0.47986\ncontig\tposition\tjudgement\n'
+        paths = [self.write('a.out', header + 'chr1\t5\tKEEP\n'), self.write('b.out', header + 'chr2\t9\tREJECT\n')]
+        merged = os.path.join(self.dir, 'merged.out')
+        merge_call_stats(paths, merged)
+        with open(merged) as f:
+            self.assertEqual(header + 'chr1\t5\tKEEP\nchr2\t9\tREJECT\n', f.read())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,112 @@
+import fcntl
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from memo import ArtifactStore
+
+
+class ArtifactStoreTest(unittest.TestCase):
+
+    image = 'jvivian/mutect:1.1.7'
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.store = ArtifactStore(os.path.join(self.dir, 'store'), budget=None)
+        self.work_dir = self.new_work_dir()
+        self.input = self.write(os.path.join(self.work_dir, 'normal.bam'), 'reads')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def new_work_dir(self):
+        return tempfile.mkdtemp(dir=self.dir)
+
+    def write(self, path, contents):
+        with open(path, 'w') as f:
+            f.write(contents)
+        return path
+
+    def read(self, path):
+        with open(path) as f:
+            return f.read()
+
+    def test_key(self):
+        key = self.store.key(self.image, 'java -Xmx4g -jar mutect.jar -I normal.bam', [self.input])
+        self.assertEqual(key, self.store.key(self.image, 'java  -Xmx15g -Xms1g -jar mutect.jar\n-I normal.bam',
+                                             [self.input]))
+        # Inputs count by name and contents, not by where they are
+        copy = self.write(os.path.join(self.new_work_dir(), 'normal.bam'), 'reads')
+        self.assertEqual(key, self.store.key(self.image, 'java -Xmx4g -jar mutect.jar -I normal.bam', [copy]))
+
+        self.assertNotEqual(key, self.store.key('jvivian/mutect:1.1.5', 'java -Xmx4g -jar mutect.jar -I normal.bam',
+                                                [self.input]))
+        self.assertNotEqual(key, self.store.key(self.image, 'java -Xmx4g -jar mutect.jar -I tumor.bam', [self.input]))
+        self.write(copy, 'other reads')
+        self.assertNotEqual(key, self.store.key(self.image, 'java -Xmx4g -jar mutect.jar -I normal.bam', [copy]))
+
+    def test_hit_and_miss(self):
+        runs = []
+
+        def step(work_dir):
+            output = os.path.join(work_dir, 'mutect.vcf')
+            return output, lambda: runs.append(self.write(output, 'calls'))
+
+        key = self.store.key(self.image, 'mutect', [self.input])
+        output, run = step(self.work_dir)
+        self.assertFalse(self.store.memoize(key, [output], run))
+        self.assertEqual(1, len(runs))
+
+        # A rerun in a new work_dir stages the stored output instead of running the step
+        output, run = step(self.new_work_dir())
+        self.assertTrue(self.store.memoize(key, [output], run))
+        self.assertEqual(1, len(runs))
+        self.assertEqual('calls', self.read(output))
+
+        # A step that does not write its outputs is not stored
+        other = self.store.key(self.image, 'mutect --other', [self.input])
+        self.assertRaises(RuntimeError, self.store.memoize, other, [os.path.join(self.work_dir, 'missing.vcf')],
+                          lambda: None)
+        self.assertFalse(os.path.exists(self.store._object(other)))
+
+    def test_evict(self):
+        for i, name in enumerate(['oldest', 'older', 'newest']):
+            output = self.write(os.path.join(self.work_dir, name), 'x' * 100)
+            self.store.memoize(name, [output], lambda: None)
+            os.utime(self.store._object(name), (i, i))
+        self.assertEqual(300, self.store.size())
+
+        # Another target holds the lock of the oldest, and the caller keeps the next
+        self.store.budget = 100
+        with open(os.path.join(self.store.root, 'locks', 'oldest'), 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            self.store.evict(keep='older')
+            fcntl.flock(lock, fcntl.LOCK_UN)
+        self.assertEqual(['older', 'oldest'], sorted(os.listdir(os.path.join(self.store.root, 'objects'))))
+
+        self.store.evict()
+        self.assertEqual(['older'], os.listdir(os.path.join(self.store.root, 'objects')))
+        self.assertEqual(100, self.store.size())
+
+    def test_evict_hashes(self):
+        hashes = os.path.join(self.store.root, 'hashes')
+        # Inputs of earlier runs, in work_dirs removed at their teardown
+        for i in xrange(3):
+            work_dir = self.new_work_dir()
+            self.store.content_hash(self.write(os.path.join(work_dir, 'normal.bam'), 'run {}'.format(i)))
+            shutil.rmtree(work_dir)
+        changed = self.write(os.path.join(self.work_dir, 'tumor.bam'), 'reads')
+        self.store.content_hash(changed)
+        os.utime(changed, (1, 1))
+        self.assertEqual(4, len(os.listdir(hashes)))
+
+        key = self.store.key(self.image, 'mutect', [self.input])
+        self.store.memoize(key, [self.write(os.path.join(self.work_dir, 'mutect.vcf'), 'calls')], lambda: None)
+        self.assertEqual([os.path.basename(self.store._hash_path(self.input))], os.listdir(hashes))
+        self.assertEqual(self.store.content_hash(self.input), self.store.content_hash(self.input))
+
+if __name__ == '__main__':
+    unittest.main()
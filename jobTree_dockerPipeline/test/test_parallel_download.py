@@ -0,0 +1,126 @@
+import BaseHTTPServer
+import SocketServer
+import hashlib
+import os
+import re
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from parallel_download import ParallelDownloader, manifest_path
+
+
+class StandIn(object):
+    """
+    What the local server serves, and how it misbehaves.
+    """
+    data = os.urandom(300 * 1024)
+    ranges = True
+    etag = None
+    fail_starts = set()    # Range starts whose responses are cut off halfway
+    requests = []
+
+
+class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        data = StandIn.data
+        match = re.match(r'bytes=(\d+)-(\d+)', self.headers.get('Range', ''))
+        StandIn.requests.append(self.headers.get('Range'))
+        if match and StandIn.ranges:
+            start, end = int(match.group(1)), int(match.group(2))
+            self.send_response(206)
+            self.send_header('Content-Range', 'bytes {}-{}/{}'.format(start, end, len(data)))
+        else:
+            start, end = 0, len(data) - 1
+            self.send_response(200)
+        self.send_header('Content-Length', str(end + 1 - start))
+        if StandIn.etag:
+            self.send_header('ETag', StandIn.etag)
+        self.end_headers()
+
+        body = data[start:end + 1]
+        if start in StandIn.fail_starts:
+            self.wfile.write(body[:len(body) // 2])
+            return
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+
+class ParallelDownload(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = Server(('127.0.0.1', 0), Handler)
+        threading.Thread(target=cls.server.serve_forever).start()
+        cls.url = 'http://127.0.0.1:{}/file.bam'.format(cls.server.server_address[1])
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'file.bam')
+        StandIn.ranges, StandIn.etag, StandIn.fail_starts, StandIn.requests = True, None, set(), []
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def read(self):
+        with open(self.path, 'rb') as f:
+            return f.read()
+
+    def test_ranged(self):
+        ParallelDownloader(connections=4, chunk_size=32 * 1024)(self.url, self.path)
+        self.assertEqual(StandIn.data, self.read())
+        self.assertEqual(1 + 10, len(StandIn.requests))
+        self.assertFalse(os.path.exists(manifest_path(self.path)))
+
+    def test_resume(self):
+        StandIn.fail_starts = {64 * 1024, 256 * 1024}
+        download = ParallelDownloader(connections=2, chunk_size=64 * 1024, retries=1)
+        self.assertRaises(RuntimeError, download, self.url, self.path)
+        self.assertTrue(os.path.exists(manifest_path(self.path)))
+
+        StandIn.fail_starts, StandIn.requests = set(), []
+        download(self.url, self.path)
+        self.assertEqual(StandIn.data, self.read())
+        self.assertLess(len(StandIn.requests) - 1, 5, 'Chunks already on disk must not be fetched again')
+        self.assertFalse(os.path.exists(manifest_path(self.path)))
+
+    def test_md5(self):
+        StandIn.etag = '"{}"'.format(hashlib.md5(StandIn.data).hexdigest())
+        ParallelDownloader(chunk_size=100 * 1024)(self.url, self.path)
+        self.assertEqual(StandIn.data, self.read())
+
+        StandIn.etag = '"{}"'.format('0' * 32)
+        self.assertRaises(RuntimeError, ParallelDownloader(chunk_size=100 * 1024), self.url, self.path)
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_withoutRanges(self):
+        StandIn.ranges = False
+        ParallelDownloader(chunk_size=32 * 1024)(self.url, self.path)
+        self.assertEqual(StandIn.data, self.read())
+        self.assertEqual(2, len(StandIn.requests))
+
+    def test_maxRate(self):
+        start = time.time()
+        ParallelDownloader(connections=4, chunk_size=32 * 1024, max_rate=1024 ** 2)(self.url, self.path)
+        self.assertGreater(time.time() - start, 0.25)
+        self.assertEqual(StandIn.data, self.read())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,83 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from refcount import RefCounts, disk_usage
+
+
+class RefCountsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.work_dir = os.path.join(self.dir, 'work')
+        os.mkdir(self.work_dir)
+        self.refs = RefCounts(self.work_dir, interval=0)
+        # The ledger takes its own place in work_dir
+        self.refs.add({})
+        self.ledger = disk_usage(self.work_dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def write(self, name, size, directory=None):
+        path = os.path.join(directory or self.work_dir, name)
+        with open(path, 'wb') as f:
+            f.write(os.urandom(size))
+        return path
+
+    def test_release(self):
+        for name in ('ref.fasta', 'normal.bam', 'tumor.bam'):
+            self.write(name, 8192)
+        self.refs.add({'ref.fasta': 2, 'normal.bam': 1})
+        self.refs.add({'ref.fasta': 1})
+
+        # Removed once its last consumer releases it, and not before
+        self.assertEqual(0, self.refs.release(['ref.fasta', 'ref.fasta']))
+        self.assertTrue(os.path.exists(os.path.join(self.work_dir, 'ref.fasta')))
+        self.assertGreaterEqual(self.refs.release(['ref.fasta', 'normal.bam']), 2 * 8192)
+        self.assertEqual(['tumor.bam'], sorted(f for f in os.listdir(self.work_dir) if not f.startswith('.')))
+
+        # Files no one counted are left to teardown, and a released file that is already gone is not an error
+        self.refs.add({'gone.vcf': 1})
+        self.assertEqual(0, self.refs.release(['tumor.bam', 'gone.vcf', 'ref.fasta']))
+        self.assertTrue(os.path.exists(os.path.join(self.work_dir, 'tumor.bam')))
+
+    def test_linked_from_outside(self):
+        cache = os.path.join(self.dir, 'cache')
+        os.mkdir(cache)
+        cached = self.write('dbsnp.vcf', 8192, cache)
+        os.link(cached, os.path.join(self.work_dir, 'dbsnp.vcf'))
+        own = self.write('normal.bam', 8192)
+        os.link(own, os.path.join(self.work_dir, 'normal.bam.link'))
+
+        # Every file in work_dir counts, once however many links it has there
+        usage = disk_usage(self.work_dir)
+        self.assertEqual(2 * disk_usage(cache), usage - self.ledger)
+        self.refs.add({'dbsnp.vcf': 1})
+        self.assertEqual(0, self.refs.release(['dbsnp.vcf']), 'Removing a file linked from outside frees nothing')
+        self.assertTrue(os.path.exists(cached))
+        self.assertEqual(usage, self.refs.peak())
+
+    def test_sample(self):
+        self.write('normal.bam', 8192)
+        first = self.refs.sample() - self.ledger
+        self.assertGreaterEqual(first, 8192)
+        self.write('tumor.bam', 8192)
+        self.assertEqual(2 * first, self.refs.sample() - self.ledger)
+        os.remove(os.path.join(self.work_dir, 'tumor.bam'))
+        self.assertEqual(first, self.refs.sample() - self.ledger)
+        self.assertEqual(2 * first, self.refs.peak() - self.ledger)
+
+        # Within the interval, the last sample stands in for a new one
+        throttled = RefCounts(self.work_dir, interval=3600)
+        self.assertEqual(first, throttled.sample() - self.ledger)
+        self.write('tumor.bam', 8192)
+        self.assertEqual(first, throttled.sample() - self.ledger)
+        self.assertEqual(2 * first, self.refs.sample() - self.ledger)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,94 @@
+import errno
+import fcntl
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import staging
+from staging import stage_file
+
+
+class StageFileTest(unittest.TestCase):
+
+    data = os.urandom(64 * 1024)
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.src = os.path.join(self.dir, 'src')
+        self.dest = os.path.join(self.dir, 'dest')
+        with open(self.src, 'wb') as f:
+            f.write(self.data)
+        # Stand-ins for a filesystem without hard links, or without reflinks, restored in tearDown
+        self.link, self.ioctl = os.link, fcntl.ioctl
+
+    def tearDown(self):
+        staging.os.link, staging.fcntl.ioctl = self.link, self.ioctl
+        shutil.rmtree(self.dir)
+
+    def no_links(self):
+        def link(src, dest):
+            raise OSError(errno.EXDEV, 'Invalid cross-device link')
+        staging.os.link = link
+
+    def no_reflinks(self):
+        def ioctl(fd, request, arg):
+            raise IOError(errno.EOPNOTSUPP, 'Operation not supported')
+        staging.fcntl.ioctl = ioctl
+
+    def contents(self, path):
+        with open(path, 'rb') as f:
+            return f.read()
+
+    def leftovers(self):
+        return sorted(set(os.listdir(self.dir)) - {'src', 'dest'})
+
+    def test_link(self):
+        self.assertEqual(0, stage_file(self.src, self.dest))
+        self.assertEqual(os.stat(self.src).st_ino, os.stat(self.dest).st_ino)
+        # Staged again over itself, and over a different file
+        self.assertEqual(0, stage_file(self.src, self.dest))
+        self.assertEqual(2, os.stat(self.src).st_nlink)
+        self.assertEqual([], self.leftovers())
+
+    def test_reflink(self):
+        self.no_links()
+        clones = []
+
+        def ioctl(fd, request, arg):
+            # Clones as the filesystem would: dest gets the data of src, without a copy through stage_file
+            self.assertEqual(staging.FICLONE, request)
+            clones.append(fd)
+            os.write(fd, os.read(arg, len(self.data)))
+        staging.fcntl.ioctl = ioctl
+
+        self.assertEqual(0, stage_file(self.src, self.dest))
+        self.assertEqual(1, len(clones))
+        self.assertEqual(self.data, self.contents(self.dest))
+        self.assertNotEqual(os.stat(self.src).st_ino, os.stat(self.dest).st_ino)
+        self.assertEqual([], self.leftovers())
+
+    def test_copy(self):
+        self.no_links()
+        self.no_reflinks()
+        with open(self.dest, 'w') as f:
+            f.write('stale')
+        self.assertEqual(len(self.data), stage_file(self.src, self.dest))
+        self.assertEqual(self.data, self.contents(self.dest))
+        self.assertEqual(1, os.stat(self.src).st_nlink)
+        self.assertEqual([], self.leftovers())
+
+    def test_failure_keeps_dest(self):
+        self.no_links()
+        self.no_reflinks()
+        with open(self.dest, 'w') as f:
+            f.write('old')
+        self.assertRaises(IOError, stage_file, os.path.join(self.dir, 'missing'), self.dest)
+        self.assertEqual('old', self.contents(self.dest))
+        self.assertEqual([], self.leftovers())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,111 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from tee import FastaIndexer, PipeSink, Tee, feed_file
+
+FASTA = '>chr1 first contig\nACGTACGTAC\nacgtacgtac\nACG\n>chr2\nAAAA\nCC\n'
+
+# samtools faidx of FASTA: name, length, offset of the first base, bases per line, bytes per line
+FAI = 'chr1\t23\t19\t10\t11\nchr2\t6\t51\t4\t5\n'
+
+
+class FastaIndexerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def index(self, fasta, block_size):
+        path = os.path.join(self.dir, 'ref.fasta')
+        with open(path, 'w') as f:
+            f.write(fasta)
+        indexer = FastaIndexer(fai_path=path + '.fai', dict_path=os.path.join(self.dir, 'ref.dict'), uri='ref.fasta')
+        feed_file(path, [indexer], block_size=block_size)
+        indexer.close()
+        with open(path + '.fai') as f:
+            return f.read()
+
+    def test_fai(self):
+        # Headers and lines split across blocks anywhere
+        for block_size in (1, 3, 7, 1024):
+            self.assertEqual(FAI, self.index(FASTA, block_size))
+        with open(os.path.join(self.dir, 'ref.dict')) as f:
+            lines = f.read().splitlines()
+        self.assertEqual('@HD\tVN:1.4\tSO:unsorted', lines[0])
+        self.assertEqual(['SN:chr1', 'LN:23'], lines[1].split('\t')[1:3])
+        self.assertEqual('UR:ref.fasta', lines[2].split('\t')[-1])
+
+    def test_windows_line_endings(self):
+        self.assertEqual('chr1\t8\t7\t4\t6\n', self.index('>chr1\r\nACGT\r\nACGT\r\n', 5))
+
+    def test_ragged(self):
+        for fasta in ('>chr1\nACGT\nAC\nACGT\n', '>chr1\nACGT\nACGTA\n', '>chr1\nACGT\nACGT\n>chr2\nAC\nACG\n'):
+            for block_size in (1, 1024):
+                self.assertRaises(ValueError, self.index, fasta, block_size)
+
+    def test_tee_keeps_download(self):
+        # A failing indexer is dropped, and the other consumers still get every byte
+        indexer, seen = FastaIndexer(), []
+
+        class Sink(object):
+            update = seen.append
+
+            def close(self):
+                pass
+        tee = Tee([indexer, Sink()])
+        for block in ('ACGT\n', '>chr1\n', 'ACGT\n'):
+            tee.update(block)
+        tee.close()
+        self.assertTrue(tee.failed(indexer))
+        self.assertEqual('ACGT\n>chr1\nACGT\n', ''.join(seen))
+
+
+class PipeSinkTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.fifo = os.path.join(self.dir, 'ref.fasta.fifo')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_stream(self):
+        received = []
+
+        def consumer():
+            # Stands in for an indexer in a container reading the pipe
+            with open(self.fifo, 'rb') as f:
+                received.append(f.read())
+        sink = PipeSink(self.fifo, consumer)
+        data = os.urandom(300 * 1024)
+        for i in xrange(0, len(data), 4096):
+            sink.update(data[i:i + 4096])
+        sink.close()
+        self.assertEqual([data], received)
+        self.assertFalse(os.path.exists(self.fifo))
+
+    def test_consumer_fails(self):
+        def consumer():
+            with open(self.fifo, 'rb') as f:
+                f.read()
+            raise RuntimeError('indexer failed')
+        sink = PipeSink(self.fifo, consumer)
+        sink.update('ACGT\n')
+        self.assertRaises(RuntimeError, sink.close)
+        self.assertFalse(os.path.exists(self.fifo))
+
+    def test_consumer_never_reads(self):
+        def consumer():
+            raise RuntimeError('image not found')
+        sink = PipeSink(self.fifo, consumer)
+        self.assertRaises(RuntimeError, sink.update, 'ACGT\n')
+
+
+if __name__ == '__main__':
+    unittest.main()